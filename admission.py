@@ -0,0 +1,84 @@
+import time
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+NORMAL = 'normal'
+DEGRADED = 'degraded'
+SHEDDING = 'shedding'
+
+
+class AdmissionController:
+    """
+    Decides whether new AI work may start, based on how many model calls
+    are in flight and how long messages have been waiting in the queue.
+
+    normal:   everything is admitted.
+    degraded: interactive replies are admitted, low-priority work
+              (admin summaries, background jobs) is deferred.
+    shedding: nothing new reaches the model; callers answer with a
+              canned reply instead.
+    """
+
+    def __init__(self, queue_age: Optional[Callable[[], float]] = None,
+                 degrade_in_flight: int = 16, shed_in_flight: int = 32,
+                 degrade_queue_age: float = 10.0, shed_queue_age: float = 30.0):
+        self._queue_age = queue_age or (lambda: 0.0)
+        self.degrade_in_flight = degrade_in_flight
+        self.shed_in_flight = shed_in_flight
+        self.degrade_queue_age = degrade_queue_age
+        self.shed_queue_age = shed_queue_age
+        self.in_flight = 0
+
+        self._state = NORMAL
+        self._state_since = time.time()
+
+        # Metrics
+        self.admitted = 0
+        self.shed = 0
+        self.deferred = 0
+
+    @asynccontextmanager
+    async def track(self):
+        """Counts a model call as in flight for the duration of the block."""
+        self.in_flight += 1
+        try:
+            yield
+        finally:
+            self.in_flight -= 1
+
+    def state(self) -> str:
+        queue_age = self._queue_age()
+        if self.in_flight >= self.shed_in_flight or queue_age >= self.shed_queue_age:
+            state = SHEDDING
+        elif self.in_flight >= self.degrade_in_flight or queue_age >= self.degrade_queue_age:
+            state = DEGRADED
+        else:
+            state = NORMAL
+
+        if state != self._state:
+            self._state = state
+            self._state_since = time.time()
+        return state
+
+    def admit(self, low_priority: bool = False) -> bool:
+        """Returns True if the work may go to the model now."""
+        state = self.state()
+        if state == SHEDDING:
+            self.shed += 1
+            return False
+        if low_priority and state == DEGRADED:
+            self.deferred += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'state': self.state(),
+            'state_since': self._state_since,
+            'in_flight': self.in_flight,
+            'queue_age_ms': round(self._queue_age() * 1000, 1),
+            'admitted': self.admitted,
+            'shed': self.shed,
+            'deferred': self.deferred,
+        }
@@ -1,100 +1,271 @@
+import asyncio
 import logging
 import json
 import os
+import time
+import weakref
 from abc import ABC, abstractmethod
-from typing import Optional, List, Dict, Any, Union
+from typing import Optional, List, Dict, Any, Tuple, Union, Callable, Awaitable
 import aiohttp
+import httpx
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 import config
+import database
+from context_cache import GeminiContextCache
+from failover import ProviderHealth
+from routing import HEAVY, LIGHT
+from scheduler import INTERACTIVE, ModelCallScheduler
+from token_counter import TokenCounter
+
+TextCallback = Callable[[str], Awaitable[None]]
 
 class AIProvider(ABC):
     @abstractmethod
     async def generate_content(self, contents: List[Any], system_instruction: str = None, tools: List[Any] = None) -> Any:
         pass
 
+    async def generate_content_stream(self, contents: List[Any], on_text: TextCallback, system_instruction: str = None, tools: List[Any] = None) -> Any:
+        """
+        Like generate_content, but passes text to `on_text` as it is generated.
+        Returns the complete response once the model is done. Providers
+        without streaming deliver the whole text in one call.
+        """
+        response = await self.generate_content(contents, system_instruction, tools)
+        text = "".join(part.text for part in response.candidates[0].content.parts if part.text)
+        if text:
+            await on_text(text)
+        return response
+
 class GeminiProvider(AIProvider):
-    def __init__(self, api_key: str, model_name: str):
-        self.client = genai.Client(api_key=api_key)
+    def __init__(self, api_key: str, model_name: str, timeout: float = None, client: genai.Client = None,
+                 context_cache: GeminiContextCache = None):
+        self.client = client or genai.Client(api_key=api_key)
         self.model_name = model_name
+        self.timeout = timeout or config.AI_REQUEST_TIMEOUT
+        # Cached-content handles for the system instruction and tools, if enabled
+        self.context_cache = context_cache
+
+    def _request(self, contents: List[types.Content], system_instruction: str = None, tools: List[Any] = None,
+                 cached_content: str = None) -> Dict:
+        # The cached content already holds the system instruction and tools
+        return {
+            "model": self.model_name,
+            "contents": contents,
+            "config": types.GenerateContentConfig(
+                temperature=1,
+                max_output_tokens=6000,
+                system_instruction=None if cached_content else system_instruction,
+                tools=None if cached_content else tools,
+                cached_content=cached_content,
+                automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True),
+                safety_settings=[
+                    types.SafetySetting(category='HARM_CATEGORY_HATE_SPEECH', threshold='BLOCK_NONE'),
+                    types.SafetySetting(category='HARM_CATEGORY_SEXUALLY_EXPLICIT', threshold='BLOCK_NONE'),
+                    types.SafetySetting(category='HARM_CATEGORY_DANGEROUS_CONTENT', threshold='BLOCK_NONE'),
+                    types.SafetySetting(category='HARM_CATEGORY_HARASSMENT', threshold='BLOCK_NONE'),
+                ],
+            )
+        }
+
+    async def _with_context_cache(self, call: Callable[[Optional[str]], Awaitable[Any]], system_instruction: str,
+                                  tools: List[Any], can_retry: Callable[[], bool] = lambda: True) -> Any:
+        """Runs call(cached_content), retrying with the prefix inline if the API rejects the handle."""
+        cached = await self.context_cache.get(self.model_name, system_instruction, tools) if self.context_cache else None
+        try:
+            return await call(cached)
+        except errors.ClientError as e:
+            if cached is None or e.code not in (400, 403, 404) or not can_retry():
+                raise
+            logging.warning(f"Gemini rejected context cache {cached} ({e.code}), retrying without it.")
+            self.context_cache.invalidate(cached)
+            return await call(None)
 
     async def generate_content(self, contents: List[types.Content], system_instruction: str = None, tools: List[Any] = None) -> Any:
+        contents = token_counter.fit(self.model_name, contents, system_instruction, tools)
+
+        async def call(cached_content: Optional[str]):
+            return await self.client.aio.models.generate_content(**self._request(contents, system_instruction, tools, cached_content))
+
         try:
-            config_params = {
-                "model": self.model_name,
-                "contents": contents,
-                "config": types.GenerateContentConfig(
-                    temperature=1,
-                    max_output_tokens=6000,
-                    system_instruction=system_instruction,
-                    tools=tools,
-                    automatic_function_calling=types.AutomaticFunctionCallingConfig(disable=True),
-                    safety_settings=[
-                        types.SafetySetting(category='HARM_CATEGORY_HATE_SPEECH', threshold='BLOCK_NONE'),
-                        types.SafetySetting(category='HARM_CATEGORY_SEXUALLY_EXPLICIT', threshold='BLOCK_NONE'),
-                        types.SafetySetting(category='HARM_CATEGORY_DANGEROUS_CONTENT', threshold='BLOCK_NONE'),
-                        types.SafetySetting(category='HARM_CATEGORY_HARASSMENT', threshold='BLOCK_NONE'),
-                    ],
-                )
-            }
-            return self.client.models.generate_content(**config_params)
+            # Use the async client so the event loop keeps serving webhooks and the
+            # admin UI; wait_for cancels the underlying request on timeout.
+            return await asyncio.wait_for(
+                self._with_context_cache(call, system_instruction, tools),
+                timeout=self.timeout,
+            )
+        except asyncio.TimeoutError:
+            logging.error(f"Gemini generation timed out after {self.timeout}s")
+            raise
         except Exception as e:
             logging.error(f"Gemini generation error: {e}")
             raise
 
+    async def generate_content_stream(self, contents: List[types.Content], on_text: TextCallback, system_instruction: str = None, tools: List[Any] = None) -> Any:
+        contents = token_counter.fit(self.model_name, contents, system_instruction, tools)
+        streamed = []
+
+        async def consume(cached_content: Optional[str]):
+            stream = await self.client.aio.models.generate_content_stream(**self._request(contents, system_instruction, tools, cached_content))
+            texts, other_parts, usage = [], [], None
+            async for chunk in stream:
+                usage = chunk.usage_metadata or usage
+                if not chunk.candidates or not chunk.candidates[0].content or not chunk.candidates[0].content.parts:
+                    continue
+                for part in chunk.candidates[0].content.parts:
+                    if part.text and not part.thought:
+                        texts.append(part.text)
+                        streamed.append(True)
+                        await on_text(part.text)
+                    elif part.function_call:
+                        other_parts.append(part)
+            # One merged turn, as generate_content would have returned it
+            parts = ([types.Part.from_text(text="".join(texts))] if texts else []) + other_parts
+            return types.GenerateContentResponse(
+                candidates=[types.Candidate(content=types.Content(role="model", parts=parts))],
+                usage_metadata=usage,
+            )
+
+        try:
+            return await asyncio.wait_for(
+                self._with_context_cache(consume, system_instruction, tools, can_retry=lambda: not streamed),
+                timeout=self.timeout,
+            )
+        except asyncio.TimeoutError:
+            logging.error(f"Gemini streaming timed out after {self.timeout}s")
+            raise
+        except Exception as e:
+            logging.error(f"Gemini streaming error: {e}")
+            raise
+
+# Gemini-shaped response objects for the OpenAI-style providers
+class _FunctionCall:
+    __slots__ = ('name', 'args', 'id')
+
+    def __init__(self, name: str, args: Dict, id: str = None):
+        self.name = name
+        self.args = args
+        self.id = id
+
+class _Part:
+    __slots__ = ('text', 'function_call', 'function_response', 'file_data', 'inline_data', 'thought')
+
+    def __init__(self, text: str = None, function_call: _FunctionCall = None):
+        self.text = text
+        self.function_call = function_call
+        self.function_response = None
+        self.file_data = None
+        self.inline_data = None
+        self.thought = None
+
+class _Content:
+    __slots__ = ('role', 'parts')
+
+    def __init__(self, role: str, parts: List[_Part]):
+        self.role = role
+        self.parts = parts
+
+class _Candidate:
+    __slots__ = ('content',)
+
+    def __init__(self, content: _Content):
+        self.content = content
+
+class _UsageMetadata:
+    __slots__ = ('prompt_token_count', 'candidates_token_count', 'cached_content_token_count', 'total_token_count')
+
+    def __init__(self, usage: Dict):
+        self.prompt_token_count = usage.get('prompt_tokens')
+        self.candidates_token_count = usage.get('completion_tokens')
+        self.cached_content_token_count = (usage.get('prompt_tokens_details') or {}).get('cached_tokens')
+        self.total_token_count = usage.get('total_tokens')
+
+class _Response:
+    __slots__ = ('candidates', 'text', 'usage_metadata')
+
+    def __init__(self, content: _Content, text: str = None, usage_metadata: _UsageMetadata = None):
+        self.candidates = [_Candidate(content)]
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+class _MessageCache:
+    """
+    OpenAI-style messages already translated from Gemini-style Content
+    objects, keyed by object identity. History rows keep their Content
+    objects while they stay in the history cache, so a turn only
+    translates the contents that are new; an entry goes away together
+    with its Content object.
+    """
+
+    def __init__(self):
+        self._messages: Dict[int, Tuple[weakref.ref, List[Dict]]] = {}
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, content: Any, translate: Callable[[Any], List[Dict]]) -> List[Dict]:
+        key = id(content)
+        cached = self._messages.get(key)
+        if cached is not None and cached[0]() is content:
+            self.hits += 1
+            return cached[1]
+        self.misses += 1
+        messages = translate(content)
+        try:
+            ref = weakref.ref(content, lambda dead, key=key: self._forget(key, dead))
+        except TypeError:
+            return messages  # Not weak-referenceable, translated every time
+        self._messages[key] = (ref, messages)
+        return messages
+
+    def _forget(self, key: int, ref: weakref.ref):
+        if self._messages.get(key, (None,))[0] is ref:
+            del self._messages[key]
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+_translated_messages = _MessageCache()
+
+# Converted OpenAI tool schemas: tuple of tool ids -> (tools, schemas)
+MAX_CONVERTED_TOOL_SETS = 32
+_converted_tools: Dict[Tuple[int, ...], Tuple[List[Any], List[Dict]]] = {}
+
 class OpenRouterProvider(AIProvider):
-    def __init__(self, api_key: str, model_name: str):
+    def __init__(self, api_key: str, model_name: str, timeout: float = None, session: aiohttp.ClientSession = None):
         self.api_key = api_key
         self.model_name = model_name
         self.api_url = "https://openrouter.ai/api/v1/chat/completions"
+        self.timeout = timeout or config.AI_REQUEST_TIMEOUT
+        # Shared keep-alive session; without one a session is opened per request
+        self.session = session
 
     async def generate_content(self, contents: List[Any], system_instruction: str = None, tools: List[Any] = None) -> Any:
+        payload, headers = self._build_request(contents, system_instruction, tools)
+        if self.session is not None and not self.session.closed:
+            return await self._post(self.session, payload, headers)
+        async with aiohttp.ClientSession() as session:
+            return await self._post(session, payload, headers)
+
+    async def generate_content_stream(self, contents: List[Any], on_text: TextCallback, system_instruction: str = None, tools: List[Any] = None) -> Any:
+        payload, headers = self._build_request(contents, system_instruction, tools)
+        payload["stream"] = True
+        # Usage arrives in a last chunk without choices
+        payload["stream_options"] = {"include_usage": True}
+        if self.session is not None and not self.session.closed:
+            return await self._post_stream(self.session, payload, headers, on_text)
+        async with aiohttp.ClientSession() as session:
+            return await self._post_stream(session, payload, headers, on_text)
+
+    def _build_request(self, contents: List[Any], system_instruction: str = None, tools: List[Any] = None) -> Tuple[Dict, Dict]:
+        contents = token_counter.fit(self.model_name, contents, system_instruction, tools)
         # Convert Gemini-style contents to OpenAI-style
         messages = []
         if system_instruction:
             messages.append({"role": "system", "content": system_instruction})
-        
         for content in contents:
-            if content.role == "tool":
-                for part in content.parts:
-                    if hasattr(part, 'function_response') and part.function_response:
-                        messages.append({
-                            "role": "tool",
-                            "tool_call_id": getattr(part.function_response, 'id', part.function_response.name),
-                            "name": part.function_response.name,
-                            "content": json.dumps(part.function_response.response) if isinstance(part.function_response.response, dict) else str(part.function_response.response)
-                        })
-                continue
-
-            role = "assistant" if content.role == "model" else content.role
-            parts_text = ""
-            tool_calls = []
-            
-            # parts can be a list or a single object depending on how it's passed
-            parts = content.parts if isinstance(content.parts, list) else [content.parts]
-            
-            for part in parts:
-                if hasattr(part, 'text') and part.text:
-                    parts_text += part.text
-                if hasattr(part, 'function_call') and part.function_call:
-                    tool_calls.append({
-                        "id": getattr(part.function_call, 'id', part.function_call.name),
-                        "type": "function",
-                        "function": {
-                            "name": part.function_call.name,
-                            "arguments": json.dumps(part.function_call.args)
-                        }
-                    })
-            
-            msg = {"role": role}
-            if parts_text:
-                msg["content"] = parts_text
-            else:
-                msg["content"] = None # Some APIs require content to be present or null
-                
-            if tool_calls:
-                msg["tool_calls"] = tool_calls
-            messages.append(msg)
+            messages.extend(_translated_messages.get(content, self._translate_content))
 
         payload = {
             "model": self.model_name,
@@ -110,23 +281,120 @@ class OpenRouterProvider(AIProvider):
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        return payload, headers
 
-        async with aiohttp.ClientSession() as session:
-            async with session.post(self.api_url, json=payload, headers=headers) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    res_msg = data['choices'][0]['message']
-                    text = res_msg.get('content')
-                    tool_calls = res_msg.get('tool_calls')
-                    return self._create_mock_gemini_response(text, tool_calls)
-                else:
-                    error_text = await response.text()
-                    logging.error(f"OpenRouter error: {error_text}")
-                    raise Exception(f"OpenRouter API error: {response.status}")
+    @staticmethod
+    def _translate_content(content: Any) -> List[Dict]:
+        """The OpenAI-style messages for one Gemini-style Content."""
+        if content.role == "tool":
+            messages = []
+            for part in content.parts:
+                if hasattr(part, 'function_response') and part.function_response:
+                    messages.append({
+                        "role": "tool",
+                        "tool_call_id": getattr(part.function_response, 'id', part.function_response.name),
+                        "name": part.function_response.name,
+                        "content": json.dumps(part.function_response.response) if isinstance(part.function_response.response, dict) else str(part.function_response.response)
+                    })
+            return messages
+
+        role = "assistant" if content.role == "model" else content.role
+        texts = []
+        tool_calls = []
+
+        # parts can be a list or a single object depending on how it's passed
+        parts = content.parts if isinstance(content.parts, list) else [content.parts]
+
+        for part in parts:
+            if hasattr(part, 'text') and part.text:
+                # Coalesced user turns carry one text part per message
+                texts.append(part.text)
+            if hasattr(part, 'function_call') and part.function_call:
+                tool_calls.append({
+                    "id": getattr(part.function_call, 'id', part.function_call.name),
+                    "type": "function",
+                    "function": {
+                        "name": part.function_call.name,
+                        "arguments": json.dumps(part.function_call.args)
+                    }
+                })
+
+        msg = {"role": role}
+        if texts:
+            msg["content"] = "\n".join(texts)
+        else:
+            msg["content"] = None # Some APIs require content to be present or null
+
+        if tool_calls:
+            msg["tool_calls"] = tool_calls
+        return [msg]
+
+    async def _post(self, session: aiohttp.ClientSession, payload: Dict, headers: Dict) -> Any:
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with session.post(self.api_url, json=payload, headers=headers, timeout=timeout) as response:
+            if response.status == 200:
+                data = await response.json()
+                res_msg = data['choices'][0]['message']
+                text = res_msg.get('content')
+                tool_calls = res_msg.get('tool_calls')
+                return self._create_mock_gemini_response(text, tool_calls, data.get('usage'))
+            else:
+                error_text = await response.text()
+                logging.error(f"OpenRouter error: {error_text}")
+                raise Exception(f"OpenRouter API error: {response.status}")
+
+    async def _post_stream(self, session: aiohttp.ClientSession, payload: Dict, headers: Dict, on_text: TextCallback) -> Any:
+        """Reads an OpenAI-style server-sent event stream."""
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        texts = []
+        tool_calls: Dict[int, Dict] = {}
+        usage = None
+        async with session.post(self.api_url, json=payload, headers=headers, timeout=timeout) as response:
+            if response.status != 200:
+                error_text = await response.text()
+                logging.error(f"OpenRouter error: {error_text}")
+                raise Exception(f"OpenRouter API error: {response.status}")
+
+            async for raw_line in response.content:
+                line = raw_line.decode('utf-8').strip()
+                # Blank lines separate events; ':' lines are keep-alive comments
+                if not line.startswith('data:'):
+                    continue
+                data = line[len('data:'):].strip()
+                if data == '[DONE]':
+                    break
+                chunk = json.loads(data)
+                usage = chunk.get('usage') or usage
+                if not chunk.get('choices'):
+                    continue
+                delta = chunk['choices'][0].get('delta') or {}
+                if delta.get('content'):
+                    texts.append(delta['content'])
+                    await on_text(delta['content'])
+                # Tool calls arrive in fragments keyed by index
+                for tc in delta.get('tool_calls') or []:
+                    call = tool_calls.setdefault(tc.get('index', 0), {'id': None, 'function': {'name': '', 'arguments': ''}})
+                    if tc.get('id'):
+                        call['id'] = tc['id']
+                    function = tc.get('function') or {}
+                    call['function']['name'] += function.get('name') or ''
+                    call['function']['arguments'] += function.get('arguments') or ''
+
+        calls = [tool_calls[i] for i in sorted(tool_calls)]
+        for call in calls:
+            call['id'] = call['id'] or call['function']['name']
+            call['function']['arguments'] = call['function']['arguments'] or '{}'
+        return self._create_mock_gemini_response("".join(texts) or None, calls or None, usage)
 
     def _convert_tools(self, gemini_tools: List[Any]) -> List[Dict]:
         if not gemini_tools:
             return None
+        # The tool set is the same module-level objects on every call
+        key = tuple(id(tool) for tool in gemini_tools)
+        cached = _converted_tools.get(key)
+        if cached is not None and all(a is b for a, b in zip(cached[0], gemini_tools)):
+            return cached[1]
+
         openai_tools = []
         for tool in gemini_tools:
             # gemini_tools can be a list of Tools or a single Tool
@@ -141,6 +409,10 @@ class OpenRouterProvider(AIProvider):
                         "parameters": self._convert_schema(fd.parameters)
                     }
                 })
+        if len(_converted_tools) >= MAX_CONVERTED_TOOL_SETS:
+            _converted_tools.clear()
+        # Holding the tools keeps their ids from being reused while cached
+        _converted_tools[key] = (list(gemini_tools), openai_tools)
         return openai_tools
 
     def _convert_schema(self, schema: Any) -> Dict:
@@ -165,70 +437,361 @@ class OpenRouterProvider(AIProvider):
             
         return res
 
-    def _create_mock_gemini_response(self, text: str, tool_calls: List[Dict] = None):
-        class MockFunctionCall:
-            def __init__(self, name, args, id=None):
-                self.name = name
-                self.args = args
-                self.id = id
-        class MockPart:
-            def __init__(self, t):
-                self.text = t
-                self.function_call = None
-                self.function_response = None
-                self.file_data = None
-                self.inline_data = None
-        class MockContent:
-            def __init__(self, t, tcs=None):
-                self.parts = []
-                if t:
-                    self.parts.append(MockPart(t))
-                if tcs:
-                    for tc in tcs:
-                        tc_name = tc['function']['name']
-                        tc_args = json.loads(tc['function']['arguments']) if isinstance(tc['function']['arguments'], str) else tc['function']['arguments']
-                        fc = MockFunctionCall(tc_name, tc_args, id=tc['id'])
-                        p = MockPart(None)
-                        p.function_call = fc
-                        self.parts.append(p)
-                self.role = "model"
-        class MockCandidate:
-            def __init__(self, t, tcs=None):
-                self.content = MockContent(t, tcs)
-        class MockResponse:
-            def __init__(self, t, tcs=None):
-                self.candidates = [MockCandidate(t, tcs)]
-                self.text = t
-        return MockResponse(text, tool_calls)
+    def _create_mock_gemini_response(self, text: str, tool_calls: List[Dict] = None, usage: Dict = None) -> "_Response":
+        parts = [_Part(text)] if text else []
+        for tc in tool_calls or []:
+            args = tc['function']['arguments']
+            args = json.loads(args) if isinstance(args, str) else args
+            parts.append(_Part(function_call=_FunctionCall(tc['function']['name'], args, id=tc['id'])))
+        return _Response(_Content("model", parts), text, _UsageMetadata(usage) if usage else None)
 
-class AIService:
-    _instance = None
-    _provider = None
+class ProviderRegistry:
+    """
+    Long-lived provider clients shared by every message.
+
+    Gemini clients are kept per API key on a pooled keep-alive httpx
+    transport; OpenAI-compatible providers share one aiohttp session with
+    DNS caching. Providers are cached per ai_settings row and only rebuilt
+    when that row's provider, model or API key changes.
+    """
+
+    def __init__(self, pool_size: int = None):
+        self._pool_size = pool_size or config.AI_HTTP_POOL_SIZE
+        self._genai_clients: Dict[str, Tuple[genai.Client, httpx.AsyncHTTPTransport]] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        # setting id -> (fingerprint, provider)
+        self._providers: Dict[Any, Tuple[tuple, AIProvider]] = {}
+
+    def genai_client(self, api_key: str) -> genai.Client:
+        cached = self._genai_clients.get(api_key)
+        if cached:
+            return cached[0]
+        # With a custom transport the SDK uses its persistent httpx client
+        # instead of opening a new aiohttp session per request.
+        transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(
+            max_connections=self._pool_size,
+            max_keepalive_connections=self._pool_size,
+            keepalive_expiry=60,
+        ))
+        client = genai.Client(
+            api_key=api_key,
+            http_options=types.HttpOptions(async_client_args={'transport': transport}),
+        )
+        self._genai_clients[api_key] = (client, transport)
+        return client
 
-    def __init__(self, db_setting: Optional[dict] = None):
-        if db_setting:
-            self._provider = self._create_provider(db_setting)
+    def http_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self._pool_size, ttl_dns_cache=300, keepalive_timeout=60)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    def get_provider(self, setting: Optional[dict]) -> AIProvider:
+        """Returns the provider for an ai_settings row (or the .env fallback when None)."""
+        if setting:
+            provider_name = setting['provider'].lower()
+            api_key = setting['api_key'] or (config.GOOGLE_API_KEY if provider_name == 'gemini' else None)
+            model_name = setting['model_name'] or (config.GOOGLE_MODEL if provider_name == 'gemini' else "gpt-3.5-turbo")
+            setting_id = setting.get('id')
         else:
             # Fallback to .env/config
-            self._provider = GeminiProvider(config.GOOGLE_API_KEY, config.GOOGLE_MODEL)
+            provider_name, api_key, model_name, setting_id = 'gemini', config.GOOGLE_API_KEY, config.GOOGLE_MODEL, None
+
+        fingerprint = (provider_name, model_name, api_key)
+        cached = self._providers.get(setting_id)
+        if cached and cached[0] == fingerprint:
+            return cached[1]
 
-    def _create_provider(self, setting: dict) -> AIProvider:
-        provider_name = setting['provider'].lower()
-        api_key = setting['api_key'] or (config.GOOGLE_API_KEY if provider_name == 'gemini' else None)
-        model_name = setting['model_name'] or (config.GOOGLE_MODEL if provider_name == 'gemini' else "gpt-3.5-turbo")
+        provider = self._create_provider(provider_name, api_key, model_name)
+        self._providers[setting_id] = (fingerprint, provider)
+        return provider
 
+    def _create_provider(self, provider_name: str, api_key: str, model_name: str) -> AIProvider:
         if provider_name == 'gemini':
-            return GeminiProvider(api_key, model_name)
+            return self._gemini_provider(api_key, model_name)
         elif provider_name == 'openrouter':
-            return OpenRouterProvider(api_key, model_name)
+            return OpenRouterProvider(api_key, model_name, session=self.http_session())
         elif provider_name == 'openai':
             # OpenAI is similar to OpenRouter but different URL
-            p = OpenRouterProvider(api_key, model_name)
+            p = OpenRouterProvider(api_key, model_name, session=self.http_session())
             p.api_url = "https://api.openai.com/v1/chat/completions"
             return p
         else:
             logging.warning(f"Unknown provider {provider_name}, falling back to Gemini")
-            return GeminiProvider(config.GOOGLE_API_KEY, config.GOOGLE_MODEL)
+            return self._gemini_provider(config.GOOGLE_API_KEY, config.GOOGLE_MODEL)
 
-    async def generate_content(self, contents: List[Any], system_instruction: str = None, tools: List[Any] = None) -> Any:
-        return await self._provider.generate_content(contents, system_instruction, tools)
+    def _gemini_provider(self, api_key: str, model_name: str) -> GeminiProvider:
+        client = self.genai_client(api_key)
+        context_cache = None
+        if config.GEMINI_CONTEXT_CACHE:
+            context_cache = GeminiContextCache(
+                client,
+                ttl=config.GEMINI_CONTEXT_CACHE_TTL,
+                refresh_margin=config.GEMINI_CONTEXT_CACHE_REFRESH_MARGIN,
+                min_tokens=config.GEMINI_CONTEXT_CACHE_MIN_TOKENS,
+            )
+        return GeminiProvider(api_key, model_name, client=client, context_cache=context_cache)
+
+    def context_cache_stats(self) -> dict:
+        """Context cache counters summed over the pooled Gemini providers."""
+        totals = {}
+        for _, provider in self._providers.values():
+            cache = getattr(provider, 'context_cache', None)
+            if cache is not None:
+                for key, value in cache.stats().items():
+                    totals[key] = totals.get(key, 0) + value
+        return totals
+
+    async def close(self):
+        """Closes all pooled connections. Called on shutdown."""
+        for _, transport in self._genai_clients.values():
+            await transport.aclose()
+        self._genai_clients.clear()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+        self._providers.clear()
+
+provider_registry = ProviderRegistry()
+
+model_scheduler = ModelCallScheduler(max_concurrent=config.AI_MAX_CONCURRENT_CALLS)
+
+# Context-window trimming and usage accounting, shared by every provider
+token_counter = TokenCounter()
+
+provider_health = ProviderHealth(
+    window=config.AI_BREAKER_WINDOW,
+    min_calls=config.AI_BREAKER_MIN_CALLS,
+    error_rate=config.AI_BREAKER_ERROR_RATE,
+    slow_seconds=config.AI_BREAKER_SLOW_SECONDS,
+    slow_rate=config.AI_BREAKER_SLOW_RATE,
+    cooldown=config.AI_BREAKER_COOLDOWN,
+)
+
+def provider_label(setting: Optional[dict]) -> str:
+    """Name of the provider behind an ai_settings row, as recorded per turn and in metrics."""
+    if not setting:
+        return f"gemini/{config.GOOGLE_MODEL}"
+    return f"{setting['provider'].lower()}/{setting.get('model_name') or 'default'}#{setting.get('id')}"
+
+def fallback_chain(active: Optional[dict], settings: List[dict], order: Optional[List[int]] = None) -> List[dict]:
+    """
+    The ai_settings rows to try after the active one: those listed in
+    AI_FALLBACK_SETTING_IDS, in that order. None when the list is empty.
+    """
+    active_id = active.get('id') if active else None
+    others = {row['id']: row for row in settings if row['id'] != active_id}
+    order = config.AI_FALLBACK_SETTING_IDS if order is None else order
+    return [others[setting_id] for setting_id in order if setting_id in others]
+
+class AIService:
+    """
+    Entry point for model calls. Every call waits for a slot from the
+    ModelCallScheduler, under its priority class and fairness key (the
+    chat id for replies).
+
+    The active ai_settings row is tried first, then `fallback_settings` in
+    order, skipping providers whose circuit breaker is open. With hedging
+    on, a backup request goes to the next provider when the first has not
+    answered within its p95 latency, and the first answer wins.
+    """
+    _instance = None
+    _provider = None
+
+    def __init__(self, db_setting: Optional[dict] = None, registry: ProviderRegistry = None, scheduler: ModelCallScheduler = None,
+                 fallback_settings: Optional[List[dict]] = None, health: ProviderHealth = None, hedge: bool = None):
+        registry = registry or provider_registry
+        self._chain = [(provider_label(setting), registry.get_provider(setting)) for setting in [db_setting] + list(fallback_settings or [])]
+        self._provider = self._chain[0][1]
+        self._scheduler = scheduler or model_scheduler
+        self._health = health or provider_health
+        self._hedge = config.AI_HEDGE_REQUESTS if hedge is None else hedge
+
+    async def generate_content(self, contents: List[Any], system_instruction: str = None, tools: List[Any] = None,
+                               priority: str = INTERACTIVE, key: Optional[str] = None, call_info: Optional[dict] = None) -> Any:
+        """`call_info`, if given, is filled with the provider and model that answered."""
+        async with self._scheduler.slot(priority, key):
+            return await self._call_chain(
+                lambda provider: provider.generate_content(contents, system_instruction, tools),
+                call_info, hedge=self._hedge,
+            )
+
+    async def generate_content_stream(self, contents: List[Any], on_text: TextCallback, system_instruction: str = None, tools: List[Any] = None,
+                                      priority: str = INTERACTIVE, key: Optional[str] = None, call_info: Optional[dict] = None) -> Any:
+        streamed = False
+
+        async def forward(text: str):
+            nonlocal streamed
+            streamed = True
+            await on_text(text)
+
+        # Not hedged: two streams would both reach the user. A provider that
+        # fails after sending text is not retried for the same reason.
+        async with self._scheduler.slot(priority, key):
+            return await self._call_chain(
+                lambda provider: provider.generate_content_stream(contents, forward, system_instruction, tools),
+                call_info, hedge=False, can_retry=lambda: not streamed,
+            )
+
+    async def _call_chain(self, call: Callable[[AIProvider], Awaitable[Any]], call_info: Optional[dict], hedge: bool,
+                          can_retry: Callable[[], bool] = lambda: True) -> Any:
+        available = [entry for entry in self._chain if self._health.breaker(entry[0]).allow()]
+        if not available:
+            # Every breaker is open; the primary is still better than no answer.
+            available = self._chain[:1]
+
+        last_error = None
+        attempts = 0
+        while available:
+            name, provider = available.pop(0)
+            attempts += 1
+            try:
+                if hedge and available:
+                    name, response = await self._hedged(call, (name, provider), available)
+                else:
+                    response = await self._timed(name, call(provider))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                last_error = e
+                if not available or not can_retry():
+                    break
+                self._health.failovers += 1
+                logging.warning(f"AI provider {name} failed ({e}); trying {available[0][0]}.")
+                continue
+
+            self._release_unused(available)
+            if call_info is not None:
+                model_name = next(getattr(p, 'model_name', None) for n, p in self._chain if n == name)
+                call_info.update(provider=name, model=model_name, attempts=attempts)
+            return response
+
+        self._release_unused(available)
+        raise last_error
+
+    async def _hedged(self, call: Callable[[AIProvider], Awaitable[Any]], primary: Tuple[str, AIProvider],
+                      backups: List[Tuple[str, AIProvider]]) -> Tuple[str, Any]:
+        """Runs the primary, and the first backup if the primary is slower than its p95."""
+        primary_task = asyncio.ensure_future(self._timed(primary[0], call(primary[1])))
+        tasks = {primary_task: primary[0]}
+        p95 = self._health.latency(primary[0]).percentile(0.95)
+        try:
+            if p95 is None:
+                return primary[0], await primary_task
+            done, _ = await asyncio.wait({primary_task}, timeout=max(p95, config.AI_HEDGE_MIN_DELAY))
+            if done:
+                return primary[0], primary_task.result()
+
+            backup = backups.pop(0)
+            self._health.hedged += 1
+            logging.info(f"{primary[0]} slower than its p95 ({p95:.1f}s), hedging with {backup[0]}.")
+            tasks[asyncio.ensure_future(self._timed(backup[0], call(backup[1])))] = backup[0]
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        return tasks[task], task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def _timed(self, name: str, call: Awaitable[Any]) -> Any:
+        started = time.monotonic()
+        try:
+            response = await call
+        except asyncio.CancelledError:
+            self._health.record_cancelled(name)
+            raise
+        except Exception:
+            self._health.record(name, False, time.monotonic() - started)
+            raise
+        self._health.record(name, True, time.monotonic() - started)
+        return response
+
+    def _release_unused(self, entries: List[Tuple[str, AIProvider]]):
+        # Providers that were allowed a half-open trial but never called
+        for name, _ in entries:
+            self._health.breaker(name).cancel()
+
+class ActiveSettingCache:
+    """
+    In-memory snapshot of the active ai_settings row and its AIService.
+
+    The settings handlers invalidate it explicitly. Changes made by other
+    processes are picked up through a cheap version query, run at most once
+    every `check_interval` seconds; the full row is only re-read when the
+    version changed.
+    """
+
+    def __init__(self, check_interval: float = 5.0, registry: ProviderRegistry = None):
+        self._check_interval = check_interval
+        self._registry = registry
+        self._lock = asyncio.Lock()
+        self._setting: Optional[dict] = None
+        self._service: Optional[AIService] = None
+        self._light_setting: Optional[dict] = None
+        self._light_service: Optional[AIService] = None
+        self._version = None
+        self._checked_at = 0.0
+
+    def invalidate(self):
+        self._version = None
+
+    async def get(self, db_pool, route: str = HEAVY) -> Tuple[Optional[dict], Optional[AIService]]:
+        """
+        Returns (setting, ai_service) for the route, reloading them if the
+        settings changed. The heavy route is the active row; the light route
+        is the row marked route='light', or (None, None) if there is none.
+        """
+        if not self._is_fresh():
+            await self._refresh(db_pool)
+        if route == LIGHT:
+            return self._light_setting, self._light_service
+        return self._setting, self._service
+
+    async def _refresh(self, db_pool):
+        async with self._lock:
+            if self._is_fresh():
+                return
+            try:
+                version = await database.get_ai_settings_version(db_pool)
+            except database.DatabaseError:
+                if self._service is None:
+                    raise
+                logging.warning("Could not check AI settings version, using cached settings.")
+                return
+
+            if version != self._version or self._service is None:
+                setting = await database.get_active_ai_setting(db_pool)
+                settings = await database.get_ai_settings(db_pool)
+                fallbacks = fallback_chain(setting, settings)
+                self._setting = setting
+                self._service = AIService(setting, registry=self._registry, fallback_settings=fallbacks)
+
+                # The light model falls back to the active one, then to its fallbacks
+                active_id = setting.get('id') if setting else None
+                light = next((row for row in settings if row.get('route') == LIGHT and row['id'] != active_id), None)
+                self._light_setting = light
+                self._light_service = None
+                if light:
+                    light_fallbacks = [setting] + [row for row in fallbacks if row['id'] != light['id']]
+                    self._light_service = AIService(light, registry=self._registry, fallback_settings=light_fallbacks)
+                logging.info(
+                    f"Loaded AI setting: {setting.get('provider') if setting else 'env'} (version {version}), "
+                    f"fallbacks: {[provider_label(row) for row in fallbacks]}, "
+                    f"light route: {provider_label(light) if light else 'none'}"
+                )
+            self._version = version
+            self._checked_at = time.monotonic()
+
+    def _is_fresh(self) -> bool:
+        return (
+            self._version is not None
+            and self._service is not None
+            and time.monotonic() - self._checked_at < self._check_interval
+        )
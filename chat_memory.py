@@ -0,0 +1,126 @@
+import asyncio
+import json
+import logging
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+import database
+
+# Longest tool result copied into the compaction transcript
+MAX_TOOL_RESULT_CHARS = 500
+
+
+def render_transcript(rows: List[Tuple[int, dict, dict]]) -> str:
+    """Renders stored (id, user, bot) rows as a plain-text transcript for summarizing."""
+    lines = []
+    for _, user, bot in rows:
+        for content in (user, bot):
+            speaker = 'User' if content.get('role') == 'user' else 'Assistant'
+            for part in content.get('parts', []):
+                part_type = part.get('type')
+                if part_type == 'text':
+                    lines.append(f"{speaker}: {part['text']}")
+                elif part_type == 'FileData':
+                    lines.append(f"{speaker}: [{part.get('mime_type', 'file')}]")
+                elif part_type == 'function_call':
+                    lines.append(f"Assistant calls {part['name']}({json.dumps(part.get('arguments'), default=str)})")
+                elif part_type == 'function_response':
+                    result = json.dumps(part.get('response'), default=str)
+                    if len(result) > MAX_TOOL_RESULT_CHARS:
+                        result = result[:MAX_TOOL_RESULT_CHARS] + '...'
+                    lines.append(f"{part['name']} returned {result}")
+    return "\n".join(lines)
+
+
+class ConversationCompactor:
+    """
+    Background job that folds old chat_history rows into a per-chat summary.
+
+    Every `interval` seconds it picks chats with at least `min_rows` rows
+    beyond the newest `keep_recent`, and asks `summarize(previous_summary,
+    transcript)` to merge only the rows added since the last checkpoint
+    into the stored summary. The prompt then carries the summary plus the
+    recent rows instead of the whole chat.
+    """
+
+    def __init__(self, db_pool, summarize: Callable[[Optional[str], str], Awaitable[str]],
+                 admit: Optional[Callable[[], bool]] = None, interval: float = 300,
+                 min_rows: int = 20, keep_recent: int = 10, batch_chats: int = 5, batch_rows: int = 100):
+        self._db_pool = db_pool
+        self._summarize = summarize
+        self._admit = admit or (lambda: True)
+        self._interval = interval
+        self._min_rows = min_rows
+        self._keep_recent = keep_recent
+        self._batch_chats = batch_chats
+        self._batch_rows = batch_rows
+        self._task: Optional[asyncio.Task] = None
+
+        # Metrics
+        self.compacted_chats = 0
+        self.compacted_rows = 0
+        self.deferred = 0
+        self.failed = 0
+
+    def start(self):
+        if self._interval > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self._interval)
+            try:
+                await self.run_once()
+            except Exception:
+                logging.exception("Error compacting chat history:")
+
+    async def run_once(self):
+        """Compacts one batch of chats, unless the AI is too busy for background work."""
+        if not self._admit():
+            self.deferred += 1
+            return
+        chat_ids = await database.get_chats_to_compact(
+            self._db_pool, self._keep_recent + self._min_rows, self._batch_chats
+        )
+        for chat_id in chat_ids:
+            try:
+                await self.compact_chat(chat_id)
+            except Exception:
+                self.failed += 1
+                logging.exception(f"Error compacting chat {chat_id}:")
+
+    async def compact_chat(self, chat_id: str) -> bool:
+        """Folds the chat's rows since its last checkpoint into its summary."""
+        summary, last_id = await database.get_chat_summary(self._db_pool, chat_id)
+        rows = await database.get_history_rows_to_compact(
+            self._db_pool, chat_id, last_id, self._keep_recent, self._batch_rows
+        )
+        # A function call whose result is in the recent window stays there
+        # with it, so the prompt never starts with an orphaned tool result.
+        while rows and any(part.get('type') == 'function_call' for part in rows[-1][2].get('parts', [])):
+            rows.pop()
+        if not rows:
+            return False
+
+        new_summary = await self._summarize(summary, render_transcript(rows))
+        if not new_summary:
+            return False
+        await database.save_chat_summary(self._db_pool, chat_id, new_summary.strip(), rows[-1][0])
+
+        self.compacted_chats += 1
+        self.compacted_rows += len(rows)
+        logging.info(f"Compacted {len(rows)} history rows of {chat_id} into its summary.")
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'compacted_chats': self.compacted_chats,
+            'compacted_rows': self.compacted_rows,
+            'deferred': self.deferred,
+            'failed': self.failed,
+        }
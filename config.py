@@ -13,6 +13,124 @@ WHATSAPP_VERIFY_TOKEN = os.getenv("WHATSAPP_VERIFY_TOKEN")
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 GOOGLE_MODEL = os.getenv("GOOGLE_MODEL")
 
+# Seconds before a single model request is cancelled
+AI_REQUEST_TIMEOUT = float(os.getenv("AI_REQUEST_TIMEOUT", "120"))
+# Limits for one user turn: model/tool rounds, and tool calls of one round
+# that may run at the same time
+AI_MAX_TOOL_ROUNDS = int(os.getenv("AI_MAX_TOOL_ROUNDS", "5"))
+AI_TOOL_CONCURRENCY = int(os.getenv("AI_TOOL_CONCURRENCY", "4"))
+# Deadlines: an incoming message gets MESSAGE_DEADLINE seconds from its
+# arrival (queue wait included) for media handling, model rounds and tools,
+# and each of those stages is also capped on its own. When time runs out the
+# user gets DEADLINE_FALLBACK_REPLY. WhatsApp sends are capped at
+# WHATSAPP_SEND_TIMEOUT but not cut by the budget, so a reply still goes out.
+MESSAGE_DEADLINE = float(os.getenv("MESSAGE_DEADLINE", "180"))
+MEDIA_FETCH_TIMEOUT = float(os.getenv("MEDIA_FETCH_TIMEOUT", "20"))
+MEDIA_UPLOAD_TIMEOUT = float(os.getenv("MEDIA_UPLOAD_TIMEOUT", "60"))
+AI_ROUND_TIMEOUT = float(os.getenv("AI_ROUND_TIMEOUT", "150"))
+AI_TOOLS_TIMEOUT = float(os.getenv("AI_TOOLS_TIMEOUT", "30"))
+WHATSAPP_SEND_TIMEOUT = float(os.getenv("WHATSAPP_SEND_TIMEOUT", "15"))
+DEADLINE_FALLBACK_REPLY = os.getenv(
+    "DEADLINE_FALLBACK_REPLY",
+    "⏳ Maaf, pesan Anda butuh waktu terlalu lama untuk diproses. Silakan coba lagi beberapa saat lagi."
+)
+# Seconds between checks whether ai_settings changed in another process
+AI_SETTINGS_CHECK_INTERVAL = float(os.getenv("AI_SETTINGS_CHECK_INTERVAL", "5"))
+# Send the answer paragraph by paragraph while the model is still writing;
+# finished paragraphs are held until they reach AI_STREAM_MIN_CHARS.
+AI_STREAM_RESPONSES = os.getenv("AI_STREAM_RESPONSES", "true").lower() in ("1", "true", "yes")
+AI_STREAM_MIN_CHARS = int(os.getenv("AI_STREAM_MIN_CHARS", "200"))
+# Model calls running at once across all chats; the rest wait in the scheduler
+AI_MAX_CONCURRENT_CALLS = int(os.getenv("AI_MAX_CONCURRENT_CALLS", "16"))
+# Failover: ai_settings ids to try, in order, when the active provider
+# fails (empty = no failover). A provider's circuit breaker
+# opens for AI_BREAKER_COOLDOWN seconds once, over its last
+# AI_BREAKER_WINDOW calls, the share of errors or of calls slower than
+# AI_BREAKER_SLOW_SECONDS reaches the given rate.
+AI_FALLBACK_SETTING_IDS = [int(x) for x in os.getenv("AI_FALLBACK_SETTING_IDS", "").split(",") if x.strip()]
+AI_BREAKER_WINDOW = int(os.getenv("AI_BREAKER_WINDOW", "20"))
+AI_BREAKER_MIN_CALLS = int(os.getenv("AI_BREAKER_MIN_CALLS", "5"))
+AI_BREAKER_ERROR_RATE = float(os.getenv("AI_BREAKER_ERROR_RATE", "0.5"))
+AI_BREAKER_SLOW_SECONDS = float(os.getenv("AI_BREAKER_SLOW_SECONDS", "30"))
+AI_BREAKER_SLOW_RATE = float(os.getenv("AI_BREAKER_SLOW_RATE", "0.5"))
+AI_BREAKER_COOLDOWN = float(os.getenv("AI_BREAKER_COOLDOWN", "30"))
+# Hedging: send a backup request to the next provider when the first has
+# not answered within its p95 latency (but never sooner than MIN_DELAY)
+AI_HEDGE_REQUESTS = os.getenv("AI_HEDGE_REQUESTS", "false").lower() in ("1", "true", "yes")
+AI_HEDGE_MIN_DELAY = float(os.getenv("AI_HEDGE_MIN_DELAY", "3"))
+# Gemini context caching: the system instruction and tool declarations are
+# stored once as cached content (refreshed REFRESH_MARGIN seconds before its
+# TTL runs out) instead of being resent with every request. Prefixes shorter
+# than MIN_TOKENS are sent inline, as the API does not cache them.
+GEMINI_CONTEXT_CACHE = os.getenv("GEMINI_CONTEXT_CACHE", "true").lower() in ("1", "true", "yes")
+GEMINI_CONTEXT_CACHE_TTL = int(os.getenv("GEMINI_CONTEXT_CACHE_TTL", "3600"))
+GEMINI_CONTEXT_CACHE_REFRESH_MARGIN = int(os.getenv("GEMINI_CONTEXT_CACHE_REFRESH_MARGIN", "300"))
+GEMINI_CONTEXT_CACHE_MIN_TOKENS = int(os.getenv("GEMINI_CONTEXT_CACHE_MIN_TOKENS", "1024"))
+# Prefetch: siswa/gukar lookups for NISN, NIP or NIPD numbers in a message
+# start when the turn does; results ready within PREFETCH_WAIT seconds of
+# the first model call are added to the prompt, later ones answer the
+# matching tool call.
+PREFETCH_LOOKUPS = os.getenv("PREFETCH_LOOKUPS", "true").lower() in ("1", "true", "yes")
+PREFETCH_WAIT = float(os.getenv("PREFETCH_WAIT", "0.3"))
+PREFETCH_MAX_LOOKUPS = int(os.getenv("PREFETCH_MAX_LOOKUPS", "3"))
+# Keep-alive connections per AI provider client
+AI_HTTP_POOL_SIZE = int(os.getenv("AI_HTTP_POOL_SIZE", "20"))
+# Routing: the ai_settings row marked route='light' answers short text-only
+# turns (up to ROUTE_LIGHT_MAX_CHARS, without any ROUTE_HEAVY_KEYWORDS);
+# media, long or tool-heavy turns go to the active row.
+ROUTE_LIGHT_MAX_CHARS = int(os.getenv("ROUTE_LIGHT_MAX_CHARS", "300"))
+ROUTE_HEAVY_KEYWORDS = [
+    word.strip().lower()
+    for word in os.getenv(
+        "ROUTE_HEAVY_KEYWORDS", "nisn,ijazah,nilai,siswa,data,ubah,ganti,update,tambah,daftar,screenshot,ss"
+    ).split(",")
+    if word.strip()
+]
+
+# Chat History
+# Only the newest HISTORY_MAX_ROWS exchanges are read per turn, then trimmed
+# to a token budget. HISTORY_TOKEN_BUDGETS overrides it per model, e.g.
+# "gemini-2.5-flash=32000,gpt-4o-mini=12000".
+HISTORY_MAX_ROWS = int(os.getenv("HISTORY_MAX_ROWS", "50"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "16000"))
+HISTORY_TOKEN_BUDGETS = {
+    model.strip(): int(budget)
+    for model, _, budget in (
+        item.partition("=") for item in os.getenv("HISTORY_TOKEN_BUDGETS", "").split(",") if "=" in item
+    )
+}
+# Parsed history kept in memory, in bytes of stored JSON (approximate)
+HISTORY_CACHE_MAX_BYTES = int(os.getenv("HISTORY_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+# Older rows are folded into a per-chat summary every MEMORY_COMPACT_INTERVAL
+# seconds (0 disables) once a chat has MEMORY_COMPACT_MIN_ROWS rows beyond
+# the newest MEMORY_KEEP_RECENT_ROWS.
+MEMORY_COMPACT_INTERVAL = float(os.getenv("MEMORY_COMPACT_INTERVAL", "300"))
+MEMORY_COMPACT_MIN_ROWS = int(os.getenv("MEMORY_COMPACT_MIN_ROWS", "20"))
+MEMORY_KEEP_RECENT_ROWS = int(os.getenv("MEMORY_KEEP_RECENT_ROWS", "10"))
+
+# Context Window & Token Accounting
+# Before sending, the prompt's tokens are estimated locally; if it does not
+# fit the model's context window minus CONTEXT_OUTPUT_RESERVE, the oldest
+# turns are dropped. CONTEXT_TOKEN_LIMITS overrides the window per model,
+# e.g. "gpt-3.5-turbo=16385,gemini-2.5-flash=1048576".
+CONTEXT_TOKEN_LIMIT = int(os.getenv("CONTEXT_TOKEN_LIMIT", "128000"))
+CONTEXT_TOKEN_LIMITS = {
+    model.strip(): int(limit)
+    for model, _, limit in (
+        item.partition("=") for item in os.getenv("CONTEXT_TOKEN_LIMITS", "").split(",") if "=" in item
+    )
+}
+CONTEXT_OUTPUT_RESERVE = int(os.getenv("CONTEXT_OUTPUT_RESERVE", "6000"))
+# USD per million input/output tokens, used to cost each stored turn,
+# e.g. "gemini-2.5-flash=0.30/2.50,gpt-4o-mini=0.15/0.60". Turns of
+# unpriced models are stored without a cost.
+TOKEN_PRICES = {
+    model.strip(): (float(prices.partition("/")[0]), float(prices.partition("/")[2] or 0))
+    for model, _, prices in (
+        item.partition("=") for item in os.getenv("TOKEN_PRICES", "").split(",") if "=" in item
+    )
+}
+
 # System Prompt
 SYSTEM_PROMPT = """
     Kamu asisten whatsapp sman 1 campurdarat bernama Khumaira yang cerdas, lucu, sopan dan ramah. Bisa bicara bahasa apapun. 
@@ -37,10 +155,82 @@ SESSION_SECRET = os.getenv("SESSION_SECRET", "default_secret_change_me")
 # Rate Limiting
 RATE_LIMIT_MAX = int(os.getenv("RATE_LIMIT_MAX", "20"))
 RATE_LIMIT_WINDOW = int(os.getenv("RATE_LIMIT_WINDOW", "60"))
+# Messages per window across all chats (0 disables the global limit)
+RATE_LIMIT_GLOBAL_MAX = int(os.getenv("RATE_LIMIT_GLOBAL_MAX", "300"))
+
+# Webhook Ingest Queue
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "8"))
+INGEST_QUEUE_MAX = int(os.getenv("INGEST_QUEUE_MAX", "1000"))
+# Messages from one chat arriving within this many seconds of each other are
+# merged into a single AI turn (0 disables the debounce).
+COALESCE_WINDOW = float(os.getenv("COALESCE_WINDOW", "1.5"))
+COALESCE_MAX_DELAY = float(os.getenv("COALESCE_MAX_DELAY", "5"))
+
+# Webhook Deduplication
+DEDUPE_TTL = int(os.getenv("DEDUPE_TTL", "3600"))
+DEDUPE_MAX_ENTRIES = int(os.getenv("DEDUPE_MAX_ENTRIES", "10000"))
+DEDUPE_RETENTION_HOURS = int(os.getenv("DEDUPE_RETENTION_HOURS", "168"))
+
+# Load Shedding
+# Past the DEGRADE thresholds low-priority AI work (summaries, background
+# jobs) is deferred; past the MAX thresholds users get SHED_BUSY_REPLY.
+SHED_DEGRADE_IN_FLIGHT = int(os.getenv("SHED_DEGRADE_IN_FLIGHT", "16"))
+SHED_MAX_IN_FLIGHT = int(os.getenv("SHED_MAX_IN_FLIGHT", "32"))
+SHED_DEGRADE_QUEUE_AGE = float(os.getenv("SHED_DEGRADE_QUEUE_AGE", "10"))
+SHED_MAX_QUEUE_AGE = float(os.getenv("SHED_MAX_QUEUE_AGE", "30"))
+SHED_BUSY_REPLY = os.getenv(
+    "SHED_BUSY_REPLY",
+    "⏳ Khumaira sedang menerima banyak pesan. Pesan Anda sudah kami terima, silakan coba lagi beberapa saat lagi."
+)
+
+# FAQ Answer Cache (opt-in)
+# Text questions up to FAQ_MAX_QUESTION_CHARS whose TF-IDF similarity to an
+# approved faq_answers entry reaches FAQ_MATCH_THRESHOLD are answered from
+# it without a model call. With FAQ_SUGGEST, AI answers of at most
+# FAQ_MAX_ANSWER_CHARS to questions asked without earlier chat context are
+# stored as pending entries for admins to approve.
+FAQ_CACHE_ENABLED = os.getenv("FAQ_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+FAQ_MATCH_THRESHOLD = float(os.getenv("FAQ_MATCH_THRESHOLD", "0.8"))
+FAQ_MAX_QUESTION_CHARS = int(os.getenv("FAQ_MAX_QUESTION_CHARS", "200"))
+FAQ_SUGGEST = os.getenv("FAQ_SUGGEST", "true").lower() in ("1", "true", "yes")
+FAQ_MAX_ANSWER_CHARS = int(os.getenv("FAQ_MAX_ANSWER_CHARS", "500"))
+
+# Fast Path
+# Whole-message lookup commands ("cek nisn 0071234567", "jumlah siswa X 1")
+# are answered straight from the database without a model call.
+# FAST_PATH_INTENTS limits it to some of cek_nomor_siswa, cek_nip,
+# cari_siswa and jumlah_siswa (comma-separated); empty enables all.
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() in ("1", "true", "yes")
+FAST_PATH_INTENTS = os.getenv("FAST_PATH_INTENTS", "")
+
+# Search Index
+# siswa and gukar are held in memory for db_siswa_tool/db_gukar_tool
+# searches: names match across spelling variants (Soekarno/Sukarno,
+# Achmad/Ahmad) when their score reaches SEARCH_MIN_SCORE (0..1), best
+# first, at most SEARCH_MAX_RESULTS rows. Edits made through the bot show
+# up at once; other edits within SEARCH_INDEX_REFRESH_INTERVAL seconds.
+SEARCH_INDEX_ENABLED = os.getenv("SEARCH_INDEX_ENABLED", "true").lower() in ("1", "true", "yes")
+SEARCH_INDEX_REFRESH_INTERVAL = float(os.getenv("SEARCH_INDEX_REFRESH_INTERVAL", "600"))
+SEARCH_MIN_SCORE = float(os.getenv("SEARCH_MIN_SCORE", "0.6"))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "25"))
+
+# Tool Result Cache
+# db_siswa_tool/db_gukar_tool results are reused for TOOL_CACHE_TTL
+# seconds (0 disables); writes through the bot clear their table at once.
+TOOL_CACHE_TTL = float(os.getenv("TOOL_CACHE_TTL", "300"))
+TOOL_CACHE_MAX_ENTRIES = int(os.getenv("TOOL_CACHE_MAX_ENTRIES", "512"))
 
 # Constants
 WHATSAPP_API_URL = "https://graph.facebook.com"
 
+def get_history_token_budget(model_name: str = None) -> int:
+    """Returns the chat history token budget for a model."""
+    return HISTORY_TOKEN_BUDGETS.get(model_name or GOOGLE_MODEL, HISTORY_TOKEN_BUDGET)
+
+def get_context_token_limit(model_name: str = None) -> int:
+    """Returns the context window, in tokens, of a model."""
+    return CONTEXT_TOKEN_LIMITS.get(model_name or GOOGLE_MODEL, CONTEXT_TOKEN_LIMIT)
+
 def get_whatsapp_config():
     """Returns only the WhatsApp-related config needed for API calls."""
     return {
@@ -48,4 +238,5 @@ def get_whatsapp_config():
         "WHATSAPP_API_URL": WHATSAPP_API_URL,
         "WHATSAPP_API_VERSION": WHATSAPP_API_VERSION,
         "WHATSAPP_PHONE_NUMBER_ID": WHATSAPP_PHONE_NUMBER_ID,
+        "WHATSAPP_SEND_TIMEOUT": WHATSAPP_SEND_TIMEOUT,
     }
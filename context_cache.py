@@ -0,0 +1,128 @@
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from typing import Any, Dict, List, Optional
+
+from google import genai
+from google.genai import types
+
+from utils import CHARS_PER_TOKEN
+
+
+class _CachedPrefix:
+    __slots__ = ('name', 'expires_at')
+
+    def __init__(self, name: str, expires_at: float):
+        self.name = name
+        self.expires_at = expires_at
+
+
+class GeminiContextCache:
+    """
+    Explicit Gemini cached-content handles for the static part of a request:
+    the system instruction and the tool declarations.
+
+    Handles are keyed by a hash of model, system instruction and tools, and
+    their TTL is extended once less than `refresh_margin` seconds remain.
+    Prefixes estimated below `min_tokens` are never cached (the API refuses
+    them). When creating or refreshing a handle fails, that prefix is sent
+    uncached for `retry_after` seconds. Handles of prefixes that are no
+    longer used simply expire.
+    """
+
+    def __init__(self, client: genai.Client, ttl: int = 3600, refresh_margin: int = 300,
+                 min_tokens: int = 1024, retry_after: float = 600):
+        self._client = client
+        self._ttl = ttl
+        self._refresh_margin = refresh_margin
+        self._min_tokens = min_tokens
+        self._retry_after = retry_after
+        self._entries: Dict[str, _CachedPrefix] = {}
+        self._unavailable: Dict[str, float] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+        # Metrics
+        self.hits = 0
+        self.created = 0
+        self.refreshed = 0
+        self.failures = 0
+        self.rejected = 0
+        self.skipped = 0
+
+    @staticmethod
+    def _prefix(model: str, system_instruction: Optional[str], tools: Optional[List[Any]]) -> str:
+        return json.dumps({
+            'model': model,
+            'system_instruction': system_instruction,
+            'tools': [tool.model_dump(mode='json', exclude_none=True) if isinstance(tool, types.Tool) else tool for tool in tools or []],
+        }, sort_keys=True, default=str)
+
+    async def get(self, model: str, system_instruction: Optional[str], tools: Optional[List[Any]]) -> Optional[str]:
+        """Returns the cached-content name for this prefix, or None to send the prefix inline."""
+        if not system_instruction and not tools:
+            return None
+        prefix = self._prefix(model, system_instruction, tools)
+        if len(prefix) // CHARS_PER_TOKEN < self._min_tokens:
+            self.skipped += 1
+            return None
+        key = hashlib.sha256(prefix.encode()).hexdigest()
+        if self._unavailable.get(key, 0) > time.monotonic():
+            self.skipped += 1
+            return None
+
+        entry = self._entries.get(key)
+        if entry and entry.expires_at - time.monotonic() > self._refresh_margin:
+            self.hits += 1
+            return entry.name
+
+        async with self._locks.setdefault(key, asyncio.Lock()):
+            entry = self._entries.get(key)
+            now = time.monotonic()
+            if entry and entry.expires_at - now > self._refresh_margin:
+                self.hits += 1
+                return entry.name
+            try:
+                if entry and entry.expires_at > now:
+                    await self._client.aio.caches.update(
+                        name=entry.name, config=types.UpdateCachedContentConfig(ttl=f"{self._ttl}s")
+                    )
+                    self.refreshed += 1
+                else:
+                    cached = await self._client.aio.caches.create(model=model, config=types.CreateCachedContentConfig(
+                        system_instruction=system_instruction,
+                        tools=tools,
+                        ttl=f"{self._ttl}s",
+                        display_name=f"wacs-{key[:16]}",
+                    ))
+                    entry = _CachedPrefix(cached.name, 0)
+                    self.created += 1
+                    logging.info(f"Created Gemini context cache {cached.name} for {model}.")
+            except Exception as e:
+                self.failures += 1
+                self._entries.pop(key, None)
+                self._unavailable[key] = time.monotonic() + self._retry_after
+                logging.warning(f"Gemini context caching unavailable for {model}, sending prompt inline: {e}")
+                return None
+            entry.expires_at = now + self._ttl
+            self._entries[key] = entry
+            return entry.name
+
+    def invalidate(self, name: str):
+        """Forgets a handle the API no longer accepts (expired or deleted)."""
+        self.rejected += 1
+        for key, entry in list(self._entries.items()):
+            if entry.name == name:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        return {
+            'handles': len(self._entries),
+            'hits': self.hits,
+            'created': self.created,
+            'refreshed': self.refreshed,
+            'failures': self.failures,
+            'rejected': self.rejected,
+            'skipped': self.skipped,
+        }
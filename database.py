@@ -4,18 +4,30 @@ import aiomysql
 from typing import Optional, List, Tuple, Dict
 from google.genai import types
 
-from utils import content_to_dict, _create_parts_from_dict
+import config
+from history_cache import HistoryCache, HistoryRow
+from utils import content_to_dict, _create_parts_from_dict, trim_history
 
 # Custom Exception for Database
 class DatabaseError(Exception):
     pass
 
+# Parsed chat_history tails, kept in sync by the save/delete functions below
+history_cache = HistoryCache(max_bytes=config.HISTORY_CACHE_MAX_BYTES)
+
 # --- Schema Migration ---
 async def run_migrations(db_pool):
     """Runs database schema migrations on startup."""
     migrations = [
         # Add created_at to chat_history (1060 = duplicate column, silently ignored)
         """ALTER TABLE chat_history ADD COLUMN created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP""",
+        # Which AI provider answered each turn
+        """ALTER TABLE chat_history ADD COLUMN provider VARCHAR(150) DEFAULT NULL""",
+        # Token usage and cost each provider reported for the turn
+        """ALTER TABLE chat_history ADD COLUMN prompt_tokens INT DEFAULT NULL""",
+        """ALTER TABLE chat_history ADD COLUMN output_tokens INT DEFAULT NULL""",
+        """ALTER TABLE chat_history ADD COLUMN cached_tokens INT DEFAULT NULL""",
+        """ALTER TABLE chat_history ADD COLUMN cost DECIMAL(12,6) DEFAULT NULL""",
         # Add label to conversation_control
         """ALTER TABLE conversation_control ADD COLUMN label VARCHAR(50) DEFAULT NULL""",
         # Audit log table
@@ -58,6 +70,35 @@ async def run_migrations(db_pool):
             api_key VARCHAR(255) DEFAULT NULL,
             system_prompt TEXT DEFAULT NULL,
             is_active TINYINT(1) DEFAULT 0,
+            route VARCHAR(20) DEFAULT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+        # Which route an ai_settings row serves ('light' = short text-only turns);
+        # after the CREATE so tables from before this column get it too
+        """ALTER TABLE ai_settings ADD COLUMN route VARCHAR(20) DEFAULT NULL""",
+        # Processed WhatsApp message ids, for webhook idempotency
+        """CREATE TABLE IF NOT EXISTS processed_messages (
+            message_hash BINARY(16) NOT NULL PRIMARY KEY,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            KEY idx_processed_messages_created_at (created_at)
+        ) ENGINE=InnoDB""",
+        # Rolling per-chat summary of compacted history
+        """CREATE TABLE IF NOT EXISTS chat_summaries (
+            chat_id VARCHAR(50) NOT NULL PRIMARY KEY,
+            summary TEXT NOT NULL,
+            last_history_id INT NOT NULL DEFAULT 0,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+        ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
+        # Vetted answers to frequent questions
+        """CREATE TABLE IF NOT EXISTS faq_answers (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            question TEXT NOT NULL,
+            answer TEXT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'pending',
+            asked_count INT NOT NULL DEFAULT 1,
+            hit_count INT NOT NULL DEFAULT 0,
+            expires_at TIMESTAMP NULL DEFAULT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4""",
@@ -104,17 +145,28 @@ async def execute_sql_query(db_pool, sql_query: str, params: Optional[tuple] = N
         raise DatabaseError(f"An unexpected error occurred: {e}")
 
 # --- Chat History ---
-async def save_chat_to_db(db_pool, chat_id: str, user_dict: Dict, bot_content: types.Content):
-    """Fungsi untuk menyimpan chat ke database menggunakan dictionary untuk user."""
+async def save_chat_to_db(db_pool, chat_id: str, user_dict: Dict, bot_content: types.Content, provider: Optional[str] = None,
+                          usage: Optional[Dict] = None):
+    """
+    Fungsi untuk menyimpan chat ke database menggunakan dictionary untuk user.
+    `provider` records which AI provider produced the bot turn, `usage` the
+    tokens and cost it reported (see TokenCounter.usage).
+    """
     try:
        user_json = json.dumps(user_dict)
        bot_json = json.dumps(content_to_dict(bot_content))
+       usage = usage or {}
 
        async with db_pool.acquire() as conn:
             async with conn.cursor() as cursor:
-                query = "INSERT INTO chat_history (chat_id, user, bot) VALUES (%s, %s, %s)"
-                await cursor.execute(query, (chat_id, user_json, bot_json))
+                query = """INSERT INTO chat_history (chat_id, user, bot, provider, prompt_tokens, output_tokens, cached_tokens, cost)
+                           VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"""
+                await cursor.execute(query, (
+                    chat_id, user_json, bot_json, provider,
+                    usage.get('prompt_tokens'), usage.get('output_tokens'), usage.get('cached_tokens'), usage.get('cost'),
+                ))
                 await conn.commit()
+                history_cache.append(chat_id, HistoryRow(cursor.lastrowid, json.loads(user_json), json.loads(bot_json), len(user_json) + len(bot_json)))
 
     except aiomysql.Error as err:
         logging.error(f"Error saving chat to database: {err}")
@@ -123,30 +175,65 @@ async def save_chat_to_db(db_pool, chat_id: str, user_dict: Dict, bot_content: t
         logging.exception(f"An unexpected error occurred: {e}")
         raise DatabaseError(f"An unexpected error occurred: {e}")
 
-async def get_chat_history_from_db(db_pool, chat_id: str) -> Optional[List[types.Content]]:
-    """Fungsi untuk mengambil riwayat chat dari database."""
+async def get_chat_history_from_db(db_pool, chat_id: str, max_rows: Optional[int] = 50, token_budget: Optional[int] = None,
+                                   after_id: int = 0) -> Optional[List[types.Content]]:
+    """
+    Fungsi untuk mengambil riwayat chat dari database.
+
+    Only the newest `max_rows` rows with an id above `after_id` (rows not yet
+    folded into the chat summary) are read; they are then trimmed to
+    `token_budget` estimated tokens, keeping tool calls and their results
+    together (see utils.trim_history).
+    """
     try:
-        async with db_pool.acquire() as conn:
-            async with conn.cursor(aiomysql.DictCursor) as cursor:
-                query = "SELECT user, bot FROM chat_history WHERE chat_id = %s ORDER BY id ASC"
-                await cursor.execute(query, (chat_id,))
-                results = await cursor.fetchall()
+        rows = history_cache.get(chat_id, after_id, max_rows)
+        if rows is None:
+            token = history_cache.snapshot()
+            async with db_pool.acquire() as conn:
+                async with conn.cursor(aiomysql.DictCursor) as cursor:
+                    if max_rows:
+                        query = "SELECT id, user, bot FROM chat_history WHERE chat_id = %s AND id > %s ORDER BY id DESC LIMIT %s"
+                        await cursor.execute(query, (chat_id, after_id, max_rows))
+                    else:
+                        query = "SELECT id, user, bot FROM chat_history WHERE chat_id = %s AND id > %s ORDER BY id DESC"
+                        await cursor.execute(query, (chat_id, after_id))
+                    results = await cursor.fetchall()
 
-        if not results:
+            rows = [
+                HistoryRow(
+                    row['id'],
+                    json.loads(row['user']) if row['user'] else None,
+                    json.loads(row['bot']) if row['bot'] else None,
+                    len(row['user'] or '') + len(row['bot'] or ''),
+                )
+                for row in reversed(results)
+            ]
+            history_cache.put(chat_id, rows, after_id, max_rows, token)
+
+        if not rows:
             return None
-        
+
+        pairs = []
+        parsed = {}
+        for row in rows:
+            if row.user and row.bot:
+                pair = (row.user, row.bot)
+                parsed[id(pair)] = row
+                pairs.append(pair)
+
         contents = []
-        for row in results:
-            if not row['user'] or not row['bot']:
-                continue
-            user_content = json.loads(row['user'])
-            bot_content = json.loads(row['bot'])
-
-            user_parts = _create_parts_from_dict(user_content.get('parts', []))
-            bot_parts = _create_parts_from_dict(bot_content.get('parts', []))
-            
-            contents.append(types.Content(role=user_content.get('role', 'user'), parts=user_parts))
-            contents.append(types.Content(role=bot_content.get('role', 'model'), parts=bot_parts))
+        for pair in trim_history(pairs, token_budget):
+            row = parsed.get(id(pair))
+            if row is not None:
+                user_content, bot_content = row.contents()
+            else:
+                # trim_history rewrote this row (dropped a dangling function call)
+                user_content = types.Content(role=pair[0].get('role', 'user'), parts=_create_parts_from_dict(pair[0].get('parts', [])))
+                bot_content = types.Content(role=pair[1].get('role', 'model'), parts=_create_parts_from_dict(pair[1].get('parts', [])))
+
+            contents.append(user_content)
+            if bot_content.parts:
+                contents.append(bot_content)
         return contents
     except aiomysql.Error as err:
         logging.error(f"Error retrieving chat history from database: {err}")
@@ -155,6 +242,85 @@ async def get_chat_history_from_db(db_pool, chat_id: str) -> Optional[List[types
         logging.exception(f"An unexpected error occurred: {e}")
         raise DatabaseError(f"An unexpected error occurred: {e}")
 
+# --- Chat Summaries ---
+async def get_chat_summary(db_pool, chat_id: str) -> Tuple[Optional[str], int]:
+    """Returns (summary, last_history_id) for a chat; (None, 0) if it was never compacted."""
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT summary, last_history_id FROM chat_summaries WHERE chat_id = %s", (chat_id,)
+                )
+                result = await cursor.fetchone()
+        return (result[0], result[1]) if result else (None, 0)
+    except aiomysql.Error as err:
+        logging.error(f"Error retrieving chat summary: {err}")
+        raise DatabaseError(f"Error retrieving chat summary: {err}")
+
+async def save_chat_summary(db_pool, chat_id: str, summary: str, last_history_id: int):
+    """Stores a chat summary, unless a newer checkpoint was already saved."""
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                query = """INSERT INTO chat_summaries (chat_id, summary, last_history_id) VALUES (%s, %s, %s)
+                           ON DUPLICATE KEY UPDATE
+                               summary = IF(VALUES(last_history_id) > last_history_id, VALUES(summary), summary),
+                               last_history_id = GREATEST(last_history_id, VALUES(last_history_id))"""
+                await cursor.execute(query, (chat_id, summary, last_history_id))
+                await conn.commit()
+    except aiomysql.Error as err:
+        logging.error(f"Error saving chat summary: {err}")
+        raise DatabaseError(f"Error saving chat summary: {err}")
+
+async def get_chats_to_compact(db_pool, min_rows: int, limit: int) -> List[str]:
+    """Returns chats with at least `min_rows` history rows not yet folded into their summary."""
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                query = """SELECT h.chat_id FROM chat_history h
+                           LEFT JOIN chat_summaries s ON s.chat_id = h.chat_id
+                           WHERE h.id > COALESCE(s.last_history_id, 0)
+                           GROUP BY h.chat_id
+                           HAVING COUNT(*) >= %s
+                           ORDER BY COUNT(*) DESC
+                           LIMIT %s"""
+                await cursor.execute(query, (min_rows, limit))
+                results = await cursor.fetchall()
+        return [row[0] for row in results]
+    except aiomysql.Error as err:
+        logging.error(f"Error finding chats to compact: {err}")
+        raise DatabaseError(f"Error finding chats to compact: {err}")
+
+async def get_history_rows_to_compact(db_pool, chat_id: str, after_id: int, keep_recent: int, limit: int) -> List[Tuple[int, dict, dict]]:
+    """
+    Returns up to `limit` (id, user, bot) rows after `after_id`, oldest first,
+    leaving the newest `keep_recent` rows of the chat out.
+    """
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                await cursor.execute(
+                    "SELECT id FROM chat_history WHERE chat_id = %s ORDER BY id DESC LIMIT 1 OFFSET %s",
+                    (chat_id, keep_recent)
+                )
+                cutoff = await cursor.fetchone()
+                if not cutoff or cutoff['id'] <= after_id:
+                    return []
+
+                query = """SELECT id, user, bot FROM chat_history
+                           WHERE chat_id = %s AND id > %s AND id <= %s
+                           ORDER BY id ASC LIMIT %s"""
+                await cursor.execute(query, (chat_id, after_id, cutoff['id'], limit))
+                results = await cursor.fetchall()
+
+        return [
+            (row['id'], json.loads(row['user']) if row['user'] else {}, json.loads(row['bot']) if row['bot'] else {})
+            for row in results
+        ]
+    except aiomysql.Error as err:
+        logging.error(f"Error retrieving history rows to compact: {err}")
+        raise DatabaseError(f"Error retrieving history rows to compact: {err}")
+
 async def get_chat_history_paginated(db_pool, chat_id: str, limit: int = 50, offset: int = 0) -> Optional[List[dict]]:
     """Mengambil riwayat chat dengan pagination untuk admin UI."""
     try:
@@ -192,7 +358,9 @@ async def delete_chat_history_from_db(db_pool, chat_id: str):
             async with conn.cursor() as cursor:
                 query = "DELETE FROM chat_history WHERE chat_id = %s"
                 await cursor.execute(query, (chat_id,))
+                await cursor.execute("DELETE FROM chat_summaries WHERE chat_id = %s", (chat_id,))
                 await conn.commit()
+                history_cache.drop(chat_id)
                 logging.info(f"Chat history for {chat_id} has been deleted.")
     except aiomysql.Error as err:
         logging.error(f"Error deleting chat history from database: {err}")
@@ -269,6 +437,32 @@ async def get_chat_history_for_admin(db_pool, chat_id: str) -> Optional[List[dic
         logging.error(f"Error retrieving chat history for admin: {err}")
         raise DatabaseError(f"Error retrieving chat history for admin: {err}")
 
+# --- Webhook Idempotency ---
+async def claim_message_id(db_pool, message_id: str) -> bool:
+    """Marks a WhatsApp message id as processed. Returns False if it already was."""
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                query = "INSERT IGNORE INTO processed_messages (message_hash) VALUES (UNHEX(MD5(%s)))"
+                await cursor.execute(query, (message_id,))
+                await conn.commit()
+                return cursor.rowcount == 1
+    except aiomysql.Error as err:
+        logging.error(f"Error claiming message id: {err}")
+        raise DatabaseError(f"Error claiming message id: {err}")
+
+async def purge_processed_messages(db_pool, retention_hours: int):
+    """Deletes processed message ids older than the retention period."""
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                query = "DELETE FROM processed_messages WHERE created_at < DATE_SUB(NOW(), INTERVAL %s HOUR)"
+                await cursor.execute(query, (retention_hours,))
+                await conn.commit()
+    except aiomysql.Error as err:
+        logging.error(f"Error purging processed message ids: {err}")
+        raise DatabaseError(f"Error purging processed message ids: {err}")
+
 # --- Conversation Control ---
 async def get_control_status(db_pool, chat_id: str) -> str:
     """Mendapatkan status kendali untuk sebuah chat_id."""
@@ -333,6 +527,7 @@ async def save_admin_reply(db_pool, chat_id: str, admin_text: str):
                 query = "INSERT INTO chat_history (chat_id, user, bot) VALUES (%s, NULL, %s)"
                 await cursor.execute(query, (chat_id, bot_json))
                 await conn.commit()
+                history_cache.append(chat_id, HistoryRow(cursor.lastrowid, None, json.loads(bot_json), len(bot_json)))
     except aiomysql.Error as err:
         logging.error(f"Error saving admin reply: {err}")
         raise DatabaseError(f"Error saving admin reply: {err}")
@@ -346,6 +541,7 @@ async def save_user_message_only(db_pool, chat_id: str, user_message_dict: Dict)
                 query = "INSERT INTO chat_history (chat_id, user, bot) VALUES (%s, %s, NULL)"
                 await cursor.execute(query, (chat_id, user_json))
                 await conn.commit()
+                history_cache.append(chat_id, HistoryRow(cursor.lastrowid, json.loads(user_json), None, len(user_json)))
     except aiomysql.Error as err:
         logging.error(f"Error saving user-only message: {err}")
         raise DatabaseError(f"Error saving user-only message: {err}")
@@ -468,6 +664,104 @@ async def check_auto_reply(db_pool, message_text: str) -> Optional[str]:
         logging.error(f"Error checking auto-reply: {err}")
         return None
 
+# --- FAQ Answers ---
+async def get_faq_entries(db_pool, include_expired: bool = False) -> List[dict]:
+    """Get FAQ entries; `expires_in` is the seconds left before each one expires."""
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                query = """
+                    SELECT id, question, answer, status, asked_count, hit_count, expires_at,
+                           TIMESTAMPDIFF(SECOND, NOW(), expires_at) AS expires_in, updated_at
+                    FROM faq_answers
+                """
+                if not include_expired:
+                    query += " WHERE expires_at IS NULL OR expires_at > NOW()"
+                await cursor.execute(query + " ORDER BY id ASC")
+                return await cursor.fetchall()
+    except aiomysql.Error as err:
+        logging.error(f"Error getting FAQ entries: {err}")
+        raise DatabaseError(f"Error getting FAQ entries: {err}")
+
+async def save_faq_entry(db_pool, question: str, answer: str, status: str = 'approved', expires_at: Optional[str] = None,
+                         entry_id: Optional[int] = None) -> int:
+    """Save a new FAQ entry or update an existing one. Returns the entry ID."""
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                if entry_id:
+                    query = "UPDATE faq_answers SET question = %s, answer = %s, status = %s, expires_at = %s WHERE id = %s"
+                    await cursor.execute(query, (question, answer, status, expires_at, entry_id))
+                else:
+                    query = "INSERT INTO faq_answers (question, answer, status, expires_at) VALUES (%s, %s, %s, %s)"
+                    await cursor.execute(query, (question, answer, status, expires_at))
+                    entry_id = cursor.lastrowid
+                await conn.commit()
+                return entry_id
+    except aiomysql.Error as err:
+        logging.error(f"Error saving FAQ entry: {err}")
+        raise DatabaseError(f"Error saving FAQ entry: {err}")
+
+async def set_faq_status(db_pool, entry_id: int, status: str):
+    """Approve an FAQ entry, or send it back to pending."""
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("UPDATE faq_answers SET status = %s WHERE id = %s", (status, entry_id))
+                await conn.commit()
+    except aiomysql.Error as err:
+        logging.error(f"Error setting FAQ status: {err}")
+        raise DatabaseError(f"Error setting FAQ status: {err}")
+
+async def expire_faq_entry(db_pool, entry_id: int):
+    """Expire an FAQ entry now; it stays listed for the admin but is no longer served."""
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("UPDATE faq_answers SET expires_at = NOW() WHERE id = %s", (entry_id,))
+                await conn.commit()
+    except aiomysql.Error as err:
+        logging.error(f"Error expiring FAQ entry: {err}")
+        raise DatabaseError(f"Error expiring FAQ entry: {err}")
+
+async def delete_faq_entry(db_pool, entry_id: int):
+    """Delete an FAQ entry."""
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute("DELETE FROM faq_answers WHERE id = %s", (entry_id,))
+                await conn.commit()
+    except aiomysql.Error as err:
+        logging.error(f"Error deleting FAQ entry: {err}")
+        raise DatabaseError(f"Error deleting FAQ entry: {err}")
+
+async def record_faq_hit(db_pool, entry_id: int):
+    """Count one question answered from an FAQ entry."""
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                # Leave updated_at alone; it marks edits, not usage
+                await cursor.execute(
+                    "UPDATE faq_answers SET hit_count = hit_count + 1, updated_at = updated_at WHERE id = %s", (entry_id,)
+                )
+                await conn.commit()
+    except aiomysql.Error as err:
+        logging.error(f"Error recording FAQ hit: {err}")
+        raise DatabaseError(f"Error recording FAQ hit: {err}")
+
+async def record_faq_question(db_pool, entry_id: int):
+    """Count one more time a pending entry's question was asked."""
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "UPDATE faq_answers SET asked_count = asked_count + 1, updated_at = updated_at WHERE id = %s", (entry_id,)
+                )
+                await conn.commit()
+    except aiomysql.Error as err:
+        logging.error(f"Error recording FAQ question: {err}")
+        raise DatabaseError(f"Error recording FAQ question: {err}")
+
 # --- Message Templates ---
 async def get_message_templates(db_pool) -> List[dict]:
     """Get all message templates."""
@@ -564,6 +858,51 @@ async def get_analytics_data(db_pool) -> dict:
         logging.error(f"Error getting analytics data: {err}")
         raise DatabaseError(f"Error getting analytics data: {err}")
 
+async def get_token_usage_report(db_pool, days: int = 30, top_chats: int = 20) -> dict:
+    """Token and cost totals of the last `days` days, per day and for the chats that used the most tokens."""
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor(aiomysql.DictCursor) as cursor:
+                totals = """COUNT(prompt_tokens) as turns, COALESCE(SUM(prompt_tokens), 0) as prompt_tokens,
+                            COALESCE(SUM(output_tokens), 0) as output_tokens, COALESCE(SUM(cached_tokens), 0) as cached_tokens,
+                            COALESCE(SUM(cost), 0) as cost"""
+                await cursor.execute(f"""
+                    SELECT DATE(created_at) as date, {totals}
+                    FROM chat_history
+                    WHERE created_at >= DATE_SUB(CURDATE(), INTERVAL %s DAY) AND prompt_tokens IS NOT NULL
+                    GROUP BY DATE(created_at)
+                    ORDER BY date ASC
+                """, (days,))
+                daily = await cursor.fetchall()
+
+                await cursor.execute(f"""
+                    SELECT chat_id, {totals}
+                    FROM chat_history
+                    WHERE created_at >= DATE_SUB(CURDATE(), INTERVAL %s DAY) AND prompt_tokens IS NOT NULL
+                    GROUP BY chat_id
+                    ORDER BY SUM(prompt_tokens) + SUM(output_tokens) DESC
+                    LIMIT %s
+                """, (days, top_chats))
+                chats = await cursor.fetchall()
+
+        def row_totals(row: dict) -> dict:
+            return {
+                'turns': row['turns'],
+                'prompt_tokens': int(row['prompt_tokens']),
+                'output_tokens': int(row['output_tokens']),
+                'cached_tokens': int(row['cached_tokens']),
+                'cost': float(row['cost']),
+            }
+
+        return {
+            'days': days,
+            'daily': [dict(row_totals(row), date=row['date'].isoformat() if row['date'] else None) for row in daily],
+            'chats': [dict(row_totals(row), chat_id=row['chat_id']) for row in chats],
+        }
+    except aiomysql.Error as err:
+        logging.error(f"Error getting token usage report: {err}")
+        raise DatabaseError(f"Error getting token usage report: {err}")
+
 # --- Broadcast ---
 async def save_broadcast_log(db_pool, message: str, recipients_count: int, status: str = 'sent'):
     """Save a broadcast log entry."""
@@ -584,8 +923,10 @@ async def delete_conversation(db_pool, chat_id: str):
         async with db_pool.acquire() as conn:
             async with conn.cursor() as cursor:
                 await cursor.execute("DELETE FROM chat_history WHERE chat_id = %s", (chat_id,))
+                await cursor.execute("DELETE FROM chat_summaries WHERE chat_id = %s", (chat_id,))
                 await cursor.execute("DELETE FROM conversation_control WHERE chat_id = %s", (chat_id,))
                 await conn.commit()
+                history_cache.drop(chat_id)
                 logging.info(f"Conversation {chat_id} fully deleted.")
     except aiomysql.Error as err:
         logging.error(f"Error deleting conversation: {err}")
@@ -614,7 +955,21 @@ async def get_active_ai_setting(db_pool) -> Optional[dict]:
         logging.error(f"Error getting active AI setting: {err}")
         raise DatabaseError(f"Error getting active AI setting: {err}")
 
-async def save_ai_setting(db_pool, provider: str, model_name: str, api_key: str = None, system_prompt: str = None, is_active: bool = False, setting_id: int = None):
+async def get_ai_settings_version(db_pool) -> tuple:
+    """Cheap fingerprint of the ai_settings table, used to detect changes from other processes."""
+    try:
+        async with db_pool.acquire() as conn:
+            async with conn.cursor() as cursor:
+                await cursor.execute(
+                    "SELECT (SELECT id FROM ai_settings WHERE is_active = 1 LIMIT 1), MAX(updated_at), COUNT(*) FROM ai_settings"
+                )
+                return tuple(await cursor.fetchone())
+    except aiomysql.Error as err:
+        logging.error(f"Error getting AI settings version: {err}")
+        raise DatabaseError(f"Error getting AI settings version: {err}")
+
+async def save_ai_setting(db_pool, provider: str, model_name: str, api_key: str = None, system_prompt: str = None, is_active: bool = False, setting_id: int = None,
+                          route: str = None):
     """Save or update an AI provider setting."""
     try:
         async with db_pool.acquire() as conn:
@@ -628,17 +983,17 @@ async def save_ai_setting(db_pool, provider: str, model_name: str, api_key: str
                     query = """
                         UPDATE ai_settings 
                         SET provider = %s, model_name = %s, api_key = COALESCE(%s, api_key), 
-                            system_prompt = %s, is_active = %s
+                            system_prompt = %s, is_active = %s, route = %s
                         WHERE id = %s
                     """
-                    await cursor.execute(query, (provider, model_name, api_key, system_prompt, 1 if is_active else 0, setting_id))
+                    await cursor.execute(query, (provider, model_name, api_key, system_prompt, 1 if is_active else 0, route, setting_id))
                 else:
                     # Insert new
                     query = """
-                        INSERT INTO ai_settings (provider, model_name, api_key, system_prompt, is_active)
-                        VALUES (%s, %s, %s, %s, %s)
+                        INSERT INTO ai_settings (provider, model_name, api_key, system_prompt, is_active, route)
+                        VALUES (%s, %s, %s, %s, %s, %s)
                     """
-                    await cursor.execute(query, (provider, model_name, api_key, system_prompt, 1 if is_active else 0))
+                    await cursor.execute(query, (provider, model_name, api_key, system_prompt, 1 if is_active else 0, route))
                 
                 await conn.commit()
     except aiomysql.Error as err:
@@ -0,0 +1,115 @@
+import asyncio
+import inspect
+import logging
+import time
+from typing import Awaitable, Dict, Optional, TypeVar
+
+T = TypeVar('T')
+
+# Stages of handling one incoming message
+MEDIA_FETCH = 'media_fetch'    # media URL lookup and download from WhatsApp
+MEDIA_UPLOAD = 'media_upload'  # upload to Gemini and wait for the file to be ACTIVE
+MODEL = 'model'                # one model round, failover included
+TOOLS = 'tools'                # the tool calls of one round
+SEND = 'send'                  # one WhatsApp send
+STAGES = (MEDIA_FETCH, MEDIA_UPLOAD, MODEL, TOOLS, SEND)
+
+
+class StageTimeout(asyncio.TimeoutError):
+    """A stage ran past its cap or past what was left of the message's budget."""
+
+    def __init__(self, stage: str, budget_exhausted: bool = False):
+        reason = "message deadline" if budget_exhausted else "stage timeout"
+        super().__init__(f"{stage} stopped by the {reason}")
+        self.stage = stage
+        self.budget_exhausted = budget_exhausted
+
+
+class StageStats:
+    """Timeouts per stage, shared by every Deadline and by the WhatsApp sender."""
+
+    def __init__(self):
+        self.timeouts: Dict[str, int] = {stage: 0 for stage in STAGES}
+        self.budget_exhausted = 0
+        self.fallback_replies = 0
+
+    def record_timeout(self, stage: str, budget_exhausted: bool = False):
+        self.timeouts[stage] = self.timeouts.get(stage, 0) + 1
+        if budget_exhausted:
+            self.budget_exhausted += 1
+
+    def stats(self) -> dict:
+        return {
+            'timeouts': dict(self.timeouts),
+            'budget_exhausted': self.budget_exhausted,
+            'fallback_replies': self.fallback_replies,
+        }
+
+stage_stats = StageStats()
+
+
+class Deadline:
+    """
+    The time budget of one incoming message (or coalesced batch), counted
+    from when it arrived.
+
+    Every stage runs through run(), which cancels it once it exceeds its
+    own cap from `caps` or the time left of `budget`, whichever is sooner,
+    and raises StageTimeout. A stage started after the budget is spent
+    fails at once. Without a budget or cap a stage is not limited.
+    Errors raised by the stage itself, its own timeouts included, pass
+    through unchanged and are not counted.
+    """
+
+    def __init__(self, budget: Optional[float] = None, caps: Optional[Dict[str, float]] = None,
+                 started_at: Optional[float] = None, stats: Optional[StageStats] = None):
+        self._budget = budget
+        self._caps = caps or {}
+        self.started_at = time.monotonic() if started_at is None else started_at
+        self._stats = stats or stage_stats
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left of the budget (never negative), or None without a budget."""
+        if self._budget is None:
+            return None
+        return max(self._budget - (time.monotonic() - self.started_at), 0.0)
+
+    def expired(self) -> bool:
+        return self.remaining() == 0.0
+
+    def _timeout(self, stage: str) -> Optional[float]:
+        limits = [limit for limit in (self._caps.get(stage), self.remaining()) if limit is not None]
+        return min(limits) if limits else None
+
+    async def run(self, stage: str, awaitable: Awaitable[T]) -> T:
+        """Awaits one stage within its cap and the remaining budget."""
+        timeout = self._timeout(stage)
+        cap = self._caps.get(stage)
+        budget_bound = timeout is not None and (cap is None or timeout < cap)
+        if timeout == 0.0:
+            if inspect.iscoroutine(awaitable):
+                awaitable.close()
+            self._stats.record_timeout(stage, budget_exhausted=True)
+            raise StageTimeout(stage, budget_exhausted=True)
+        if timeout is None:
+            return await awaitable
+
+        task = asyncio.ensure_future(awaitable)
+        try:
+            done, _ = await asyncio.wait({task}, timeout=timeout)
+        except asyncio.CancelledError:
+            task.cancel()
+            raise
+        if done:
+            # Finished in time: its result, or its own error (a provider's
+            # TimeoutError included) unchanged
+            return task.result()
+
+        task.cancel()
+        await asyncio.wait({task})
+        if not task.cancelled():
+            task.exception()
+        self._stats.record_timeout(stage, budget_exhausted=budget_bound)
+        logging.warning(f"Stage {stage} timed out after {timeout:.1f}s"
+                        f"{' (message deadline)' if budget_bound else ''}.")
+        raise StageTimeout(stage, budget_exhausted=budget_bound)
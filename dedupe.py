@@ -0,0 +1,77 @@
+import logging
+import time
+from collections import OrderedDict
+
+import database
+
+
+class MessageDeduplicator:
+    """
+    Drops WhatsApp messages that were already received.
+
+    Recently seen message ids live in a bounded in-memory TTL map, so
+    redeliveries are caught in O(1) while the webhook request is still open.
+    The processed_messages table is the durable record that also covers
+    restarts and other processes.
+    """
+
+    def __init__(self, ttl: int = 3600, max_entries: int = 10000, retention_hours: int = 168):
+        self._ttl = ttl
+        self._max_entries = max_entries
+        self._retention_hours = retention_hours
+        self._seen: "OrderedDict[str, float]" = OrderedDict()
+        self._last_purge = time.monotonic()
+
+        # Metrics
+        self.memory_duplicates = 0
+        self.db_duplicates = 0
+
+    def check_and_mark(self, message_id: str) -> bool:
+        """Returns True if the id was seen recently; otherwise remembers it."""
+        now = time.monotonic()
+        # Entries are kept in insertion order, so expired ones sit at the front.
+        while self._seen:
+            oldest_id, seen_at = next(iter(self._seen.items()))
+            if now - seen_at < self._ttl:
+                break
+            del self._seen[oldest_id]
+
+        if message_id in self._seen:
+            self.memory_duplicates += 1
+            return True
+
+        self._seen[message_id] = now
+        if len(self._seen) > self._max_entries:
+            self._seen.popitem(last=False)
+        return False
+
+    def forget(self, message_id: str):
+        """Removes an id from memory, e.g. when the message could not be queued."""
+        self._seen.pop(message_id, None)
+
+    async def claim(self, db_pool, message_id: str) -> bool:
+        """Records the id in the database. Returns False if it was already processed."""
+        try:
+            if not await database.claim_message_id(db_pool, message_id):
+                self.db_duplicates += 1
+                return False
+        except database.DatabaseError as e:
+            # Better to risk a double reply than to lose the message.
+            logging.warning(f"Could not record message id {message_id}: {e}")
+            return True
+
+        if time.monotonic() - self._last_purge > 3600:
+            self._last_purge = time.monotonic()
+            try:
+                await database.purge_processed_messages(db_pool, self._retention_hours)
+            except database.DatabaseError as e:
+                logging.warning(f"Could not purge processed message ids: {e}")
+        return True
+
+    def stats(self) -> dict:
+        return {
+            'tracked_ids': len(self._seen),
+            'memory_duplicates': self.memory_duplicates,
+            'db_duplicates': self.db_duplicates,
+            'duplicates': self.memory_duplicates + self.db_duplicates,
+        }
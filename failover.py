@@ -0,0 +1,149 @@
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class LatencyTracker:
+    """Latencies of the last `size` successful calls, for percentile estimates."""
+
+    def __init__(self, size: int = 100, min_samples: int = 20):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._min_samples = min_samples
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, fraction: float) -> Optional[float]:
+        """Returns the given percentile, or None while there are too few samples."""
+        if len(self._samples) < self._min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class CircuitBreaker:
+    """
+    Stops sending traffic to a provider that keeps failing or is too slow.
+
+    The last `window` calls are kept. Once at least `min_calls` of them are
+    known and the share of errors or of calls slower than `slow_seconds`
+    reaches its threshold, the breaker opens for `cooldown` seconds. After
+    that one trial call is let through (half-open): success closes the
+    breaker, failure opens it again.
+    """
+
+    def __init__(self, window: int = 20, min_calls: int = 5, error_rate: float = 0.5,
+                 slow_seconds: float = 30.0, slow_rate: float = 0.5, cooldown: float = 30.0):
+        self._calls: Deque[Tuple[bool, bool]] = deque(maxlen=window)
+        self._min_calls = min_calls
+        self._error_rate = error_rate
+        self._slow_seconds = slow_seconds
+        self._slow_rate = slow_rate
+        self._cooldown = cooldown
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trial_running = False
+
+        # Metrics
+        self.opened = 0
+
+    @property
+    def state(self) -> str:
+        if self._state == OPEN and time.monotonic() - self._opened_at >= self._cooldown:
+            self._state = HALF_OPEN
+            self._trial_running = False
+        return self._state
+
+    def allow(self) -> bool:
+        """Returns True if a call may be sent to the provider now."""
+        state = self.state
+        if state == CLOSED:
+            return True
+        if state == HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def record(self, ok: bool, seconds: float):
+        if self._state == HALF_OPEN:
+            self._trial_running = False
+            if ok and seconds < self._slow_seconds:
+                self._state = CLOSED
+                self._calls.clear()
+            else:
+                self._open()
+            return
+
+        self._calls.append((ok, seconds >= self._slow_seconds))
+        if self._state == CLOSED and len(self._calls) >= self._min_calls:
+            errors = sum(1 for ok, _ in self._calls if not ok) / len(self._calls)
+            slow = sum(1 for _, is_slow in self._calls if is_slow) / len(self._calls)
+            if errors >= self._error_rate or slow >= self._slow_rate:
+                self._open()
+
+    def cancel(self):
+        """A call was abandoned without an outcome; lets another trial through."""
+        if self._state == HALF_OPEN:
+            self._trial_running = False
+
+    def _open(self):
+        self._state = OPEN
+        self._opened_at = time.monotonic()
+        self.opened += 1
+
+
+class ProviderHealth:
+    """Circuit breaker, latency history and call counts per provider, kept across settings reloads."""
+
+    def __init__(self, **breaker_args):
+        self._breaker_args = breaker_args
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._latencies: Dict[str, LatencyTracker] = {}
+        self._served: Dict[str, int] = {}
+        self._failed: Dict[str, int] = {}
+
+        # Metrics
+        self.hedged = 0
+        self.failovers = 0
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        if name not in self._breakers:
+            self._breakers[name] = CircuitBreaker(**self._breaker_args)
+        return self._breakers[name]
+
+    def latency(self, name: str) -> LatencyTracker:
+        if name not in self._latencies:
+            self._latencies[name] = LatencyTracker()
+        return self._latencies[name]
+
+    def record(self, name: str, ok: bool, seconds: float):
+        self.breaker(name).record(ok, seconds)
+        if ok:
+            self.latency(name).add(seconds)
+            self._served[name] = self._served.get(name, 0) + 1
+        else:
+            self._failed[name] = self._failed.get(name, 0) + 1
+
+    def record_cancelled(self, name: str):
+        """
+        A call was cancelled (lost a hedge race, or the turn gave up). Its
+        time is not a latency sample, so it does not move the p95.
+        """
+        self.breaker(name).cancel()
+
+    def stats(self) -> dict:
+        providers = {}
+        for name, breaker in self._breakers.items():
+            p95 = self.latency(name).percentile(0.95)
+            providers[name] = {
+                'state': breaker.state,
+                'opened': breaker.opened,
+                'served': self._served.get(name, 0),
+                'failed': self._failed.get(name, 0),
+                'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+            }
+        return {'providers': providers, 'hedged': self.hedged, 'failovers': self.failovers}
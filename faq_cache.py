@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import math
+import re
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import database
+
+APPROVED = 'approved'
+PENDING = 'pending'
+
+# Filler words that say nothing about what is being asked
+STOPWORDS = frozenset(
+    "apa apakah yang di ke dari dan itu ini ya kak kakak min admin bu pak bapak ibu "
+    "mau tanya dong sih kah nya saya aku gimana bagaimana tolong mohon info halo selamat".split()
+)
+
+
+def normalize_question(text: str) -> str:
+    """Lowercases a question and drops punctuation and filler words."""
+    words = re.sub(r"[^\w\s]", " ", text.lower()).split()
+    return " ".join(word for word in words if word not in STOPWORDS)
+
+
+def _features(normalized: str) -> Counter:
+    # Whole words plus character trigrams, so typos and
+    # abbreviations ("pendaftaran" / "pendaftran") still overlap
+    features = Counter()
+    for word in normalized.split():
+        features["w:" + word] += 1
+        padded = f"#{word}#"
+        for i in range(len(padded) - 2):
+            features[padded[i:i + 3]] += 1
+    return features
+
+
+class _FaqEntry:
+    __slots__ = ('id', 'question', 'answer', 'approved', 'expires_at', 'vector')
+
+    def __init__(self, entry_id: int, question: str, answer: str, approved: bool, expires_at: Optional[float]):
+        self.id = entry_id
+        self.question = question
+        self.answer = answer
+        self.approved = approved
+        self.expires_at = expires_at
+        self.vector: Dict[str, float] = {}
+
+
+class FaqIndex:
+    """TF-IDF vectors of the FAQ questions, matched by cosine similarity."""
+
+    def __init__(self, entries: List[_FaqEntry]):
+        self._entries = entries
+        features = [_features(normalize_question(entry.question)) for entry in entries]
+        document_frequency = Counter(feature for counts in features for feature in counts)
+        self._idf = {
+            feature: math.log((1 + len(entries)) / (1 + df)) + 1 for feature, df in document_frequency.items()
+        }
+        self._unseen_idf = math.log(1 + len(entries)) + 1
+        for entry, counts in zip(entries, features):
+            entry.vector = self._vector(counts)
+
+    def _vector(self, counts: Counter) -> Dict[str, float]:
+        weights = {feature: count * self._idf.get(feature, self._unseen_idf) for feature, count in counts.items()}
+        norm = math.sqrt(sum(weight * weight for weight in weights.values())) or 1.0
+        return {feature: weight / norm for feature, weight in weights.items()}
+
+    def best_match(self, question: str, approved_only: bool = True) -> Tuple[Optional[_FaqEntry], float]:
+        """Returns the closest unexpired entry and its similarity (0..1)."""
+        vector = self._vector(_features(normalize_question(question)))
+        now = time.monotonic()
+        best, best_score = None, 0.0
+        for entry in self._entries:
+            if approved_only and not entry.approved:
+                continue
+            if entry.expires_at is not None and entry.expires_at <= now:
+                continue
+            score = sum(weight * entry.vector.get(feature, 0.0) for feature, weight in vector.items())
+            if score > best_score:
+                best, best_score = entry, score
+        return best, best_score
+
+    def add(self, entry: _FaqEntry):
+        """Adds an entry, weighted with the current IDF; the next reload recomputes it."""
+        entry.vector = self._vector(_features(normalize_question(entry.question)))
+        self._entries.append(entry)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class FaqAnswerCache:
+    """
+    Vetted answers to frequently asked questions, served without a model call.
+
+    Questions are matched locally by TF-IDF similarity against the
+    approved, unexpired faq_answers rows; a match at or above `threshold`
+    is answered straight away. With `suggest` on, AI answers of at most
+    `max_answer_chars` to questions asked without prior context are stored
+    as pending entries (or counted against a similar pending one) for
+    admins to approve; new ones are added to the index in place. The index
+    is reloaded on invalidate() and at most every `refresh_interval`
+    seconds, so edits from other processes are picked up too.
+    """
+
+    def __init__(self, db_pool, enabled: bool = False, threshold: float = 0.8, max_question_chars: int = 200,
+                 suggest: bool = True, max_answer_chars: int = 500, refresh_interval: float = 60):
+        self._db_pool = db_pool
+        self.enabled = enabled
+        self._threshold = threshold
+        self._max_question_chars = max_question_chars
+        self._suggest = suggest
+        self._max_answer_chars = max_answer_chars
+        self._refresh_interval = refresh_interval
+        self._index: Optional[FaqIndex] = None
+        self._loaded_at = 0.0
+        self._lock = asyncio.Lock()
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.suggested = 0
+
+    def invalidate(self):
+        self._index = None
+
+    async def _get_index(self) -> FaqIndex:
+        if self._index is not None and time.monotonic() - self._loaded_at < self._refresh_interval:
+            return self._index
+        async with self._lock:
+            if self._index is None or time.monotonic() - self._loaded_at >= self._refresh_interval:
+                rows = await database.get_faq_entries(self._db_pool)
+                now = time.monotonic()
+                self._index = FaqIndex([
+                    _FaqEntry(
+                        row['id'], row['question'], row['answer'], row['status'] == APPROVED,
+                        now + row['expires_in'] if row.get('expires_in') is not None else None,
+                    )
+                    for row in rows
+                ])
+                self._loaded_at = now
+            return self._index
+
+    def _eligible(self, question: Optional[str]) -> bool:
+        return bool(self.enabled and question and len(question) <= self._max_question_chars and normalize_question(question))
+
+    async def match(self, question: Optional[str]) -> Optional[Tuple[int, str]]:
+        """Returns (entry_id, answer) for a question close enough to an approved entry."""
+        if not self._eligible(question):
+            return None
+        try:
+            entry, score = (await self._get_index()).best_match(question)
+        except database.DatabaseError:
+            return None
+        if entry is None or score < self._threshold:
+            self.misses += 1
+            return None
+        self.hits += 1
+        logging.info(f"FAQ entry {entry.id} answers {question!r} (similarity {score:.2f}).")
+        return entry.id, entry.answer
+
+    async def record_hit(self, entry_id: int):
+        try:
+            await database.record_faq_hit(self._db_pool, entry_id)
+        except database.DatabaseError:
+            pass
+
+    async def suggest(self, question: Optional[str], answer: Optional[str], had_context: bool = False):
+        """
+        Offers an AI answer to admins as a pending FAQ entry. Answers that
+        are long, or that may depend on the chat (`had_context`: history,
+        memory or lookup results were sent with the question), are skipped.
+        """
+        if not self._suggest or had_context or not self._eligible(question):
+            return
+        if not answer or len(answer) > self._max_answer_chars:
+            return
+        try:
+            index = await self._get_index()
+            entry, score = index.best_match(question, approved_only=False)
+            if entry is not None and score >= self._threshold:
+                await database.record_faq_question(self._db_pool, entry.id)
+                return
+            entry_id = await database.save_faq_entry(self._db_pool, question, answer, status=PENDING)
+        except database.DatabaseError:
+            return
+        self.suggested += 1
+        index.add(_FaqEntry(entry_id, question, answer, approved=False, expires_at=None))
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'enabled': self.enabled,
+            'entries': len(self._index) if self._index is not None else None,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'suggested': self.suggested,
+        }
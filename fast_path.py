@@ -0,0 +1,143 @@
+import logging
+import re
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+import database
+import tools
+
+# At most this many people are listed in one reply; the rest are counted
+MAX_LISTED_ROWS = 5
+
+SISWA_ROW = "*{nama}* ({jk})\nNISN: {nisn}\nNIPD: {nipd}\nRombel: {rombel_saat_ini}"
+GUKAR_ROW = "*{nama}*\nNIP: {nip}\nMengajar: {mengajar}"
+COUNT_REPLY = "Jumlah siswa rombel {rombel}: *{total}* siswa."
+
+
+class _Row(dict):
+    # Empty or missing columns show as "-"
+    def __missing__(self, key):
+        return "-"
+
+
+def _list_rows(rows: List[dict], total: int, template: str) -> str:
+    reply = "\n\n".join(template.format_map(_Row({k: v for k, v in row.items() if v not in (None, "")}))
+                        for row in rows[:MAX_LISTED_ROWS])
+    if total > MAX_LISTED_ROWS:
+        reply += f"\n\n...dan {total - MAX_LISTED_ROWS} lainnya. Mohon perjelas pencariannya."
+    return reply
+
+
+class Intent:
+    """A command shape answered by one siswa/gukar search and a reply template."""
+    __slots__ = ('name', 'pattern', 'lookup', 'render')
+
+    def __init__(self, name: str, pattern: str,
+                 lookup: Callable[[Dict[str, str], object], Awaitable[Tuple[List[dict], int]]],
+                 render: Callable[[Dict[str, str], List[dict], int], Optional[str]]):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.lookup = lookup
+        self.render = render
+
+
+INTENTS = [
+    Intent(
+        'cek_nomor_siswa',
+        r"^(?:cek|cari|data)\s+(?:nisn|nipd|nis)\s*[:.]?\s*(?P<term>\d[\d./-]{2,19})$",
+        lambda m, db_pool: tools.search_siswa({'search_term': m['term'].rstrip("./-")}, db_pool),
+        lambda m, rows, total: _list_rows(rows, total, SISWA_ROW) if rows else None,
+    ),
+    Intent(
+        'cek_nip',
+        r"^(?:cek|cari|data)\s+(?:nip|guru)\s*[:.]?\s*(?P<term>\d{8}[ .]?\d{6}[ .]?\d[ .]?\d{3})$",
+        lambda m, db_pool: tools.search_gukar({'search_term': re.sub(r"[ .]", "", m['term'])}, db_pool),
+        lambda m, rows, total: _list_rows(rows, total, GUKAR_ROW) if rows else None,
+    ),
+    Intent(
+        'cari_siswa',
+        r"^(?:cek|cari|data)\s+siswa\s+(?:bernama\s+|nama\s+)?(?P<term>[a-z][a-z .']{2,49})$",
+        lambda m, db_pool: tools.search_siswa({'search_term': m['term'].strip()}, db_pool),
+        lambda m, rows, total: _list_rows(rows, total, SISWA_ROW) if rows else None,
+    ),
+    Intent(
+        'jumlah_siswa',
+        r"^(?:jumlah|total)\s+siswa\s+(?:kelas\s+|rombel\s+)?(?P<rombel>[a-z0-9][a-z0-9 .-]{0,19})$",
+        lambda m, db_pool: tools.search_siswa({'rombel_saat_ini': m['rombel'].strip(), 'aggregate': 'count'}, db_pool),
+        lambda m, rows, total: COUNT_REPLY.format(rombel=m['rombel'].strip().upper(), total=rows[0]['total'])
+        if rows and rows[0]['total'] else None,
+    ),
+]
+
+
+def enabled_intents(names: str) -> List[Intent]:
+    """The built-in intents named in a comma-separated list; empty means all of them."""
+    wanted = {name.strip() for name in names.split(",") if name.strip()}
+    return [intent for intent in INTENTS if not wanted or intent.name in wanted]
+
+
+def normalize_command(text: str) -> str:
+    """Lowercases a message, collapses whitespace and drops trailing punctuation."""
+    return " ".join(text.lower().split()).rstrip("?!. ")
+
+
+class FastPathRouter:
+    """
+    Answers structured lookup commands ("cek nisn 0071234567", "jumlah
+    siswa X 1") straight from the database, without a model call.
+
+    A message must match an intent's pattern in full, so anything else
+    goes to the model as before. A match whose query finds nothing (or
+    fails) also falls through to the model, which can try other ways to
+    find what was asked.
+    """
+
+    def __init__(self, intents: List[Intent], enabled: bool = True):
+        self._intents = intents
+        self.enabled = enabled
+
+        # Metrics
+        self.answered: Dict[str, int] = {intent.name: 0 for intent in intents}
+        self.fell_through = 0
+        self._seconds = 0.0
+
+    def match(self, text: Optional[str]) -> Optional[Tuple[Intent, Dict[str, str]]]:
+        if not self.enabled or not text or len(text) > 100:
+            return None
+        command = normalize_command(text)
+        for intent in self._intents:
+            m = intent.pattern.match(command)
+            if m:
+                return intent, m.groupdict()
+        return None
+
+    async def answer(self, text: Optional[str], db_pool) -> Optional[Tuple[str, str]]:
+        """Returns (intent name, reply) for a recognised command, else None."""
+        matched = self.match(text)
+        if matched is None:
+            return None
+        intent, groups = matched
+        started = time.perf_counter()
+        try:
+            rows, total = await intent.lookup(groups, db_pool)
+            reply = intent.render(groups, rows, total)
+        except (database.DatabaseError, ValueError) as e:
+            logging.warning(f"Fast path '{intent.name}' failed, falling back to the model: {e}")
+            reply = None
+        if reply is None:
+            self.fell_through += 1
+            return None
+        elapsed = time.perf_counter() - started
+        self.answered[intent.name] += 1
+        self._seconds += elapsed
+        logging.info(f"Fast path '{intent.name}' answered in {elapsed * 1000:.1f} ms.")
+        return intent.name, reply
+
+    def stats(self) -> dict:
+        answered = sum(self.answered.values())
+        return {
+            'enabled': self.enabled,
+            'answered': dict(self.answered),
+            'fell_through': self.fell_through,
+            'avg_ms': round(self._seconds / answered * 1000, 1) if answered else 0.0,
+        }
@@ -0,0 +1,155 @@
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
+from google.genai import types
+
+from utils import _create_parts_from_dict
+
+# Rough per-row overhead of the parsed objects on top of the stored JSON size
+ROW_OVERHEAD_BYTES = 256
+
+
+class HistoryRow:
+    """One chat_history row, parsed once; its Content objects are built on first use."""
+    __slots__ = ('id', 'user', 'bot', 'size', '_contents')
+
+    def __init__(self, row_id: int, user: Optional[dict], bot: Optional[dict], size: int):
+        self.id = row_id
+        self.user = user
+        self.bot = bot
+        self.size = size + ROW_OVERHEAD_BYTES
+        self._contents = None
+
+    def contents(self) -> List[types.Content]:
+        if self._contents is None:
+            self._contents = [
+                types.Content(role=self.user.get('role', 'user'), parts=_create_parts_from_dict(self.user.get('parts', []))),
+                types.Content(role=self.bot.get('role', 'model'), parts=_create_parts_from_dict(self.bot.get('parts', []))),
+            ]
+        return self._contents
+
+
+class _Entry:
+    __slots__ = ('rows', 'covers_after', 'size')
+
+    def __init__(self):
+        self.rows: Deque[HistoryRow] = deque()
+        # Every row of the chat with an id above this is in `rows`
+        self.covers_after = 0
+        self.size = 0
+
+
+class HistoryCache:
+    """
+    LRU of parsed chat_history tails, bounded by an approximate byte size.
+
+    Each entry holds the newest rows of one chat, oldest first. Writes
+    made through database.py append to an existing entry, so the row
+    that was just saved is not read and parsed again on the next turn.
+    The cache only sees writes from this process, which is the only
+    writer of chat_history.
+    """
+
+    def __init__(self, max_bytes: int = 32 * 1024 * 1024, max_rows_per_chat: int = 200,
+                 max_tracked_writes: int = 10000):
+        self.max_bytes = max_bytes
+        self._max_rows_per_chat = max_rows_per_chat
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._size = 0
+
+        # Write sequence numbers, so a slow read never overwrites a newer write.
+        self._seq = 0
+        self._written: "OrderedDict[str, int]" = OrderedDict()
+        self._max_tracked_writes = max_tracked_writes
+        self._forgotten_seq = 0
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def snapshot(self) -> int:
+        """Returns a token to pass to put() for rows read from the database after this call."""
+        return self._seq
+
+    def get(self, chat_id: str, after_id: int = 0, max_rows: Optional[int] = None) -> Optional[List[HistoryRow]]:
+        """Returns the newest `max_rows` rows with an id above `after_id`, or None on a miss."""
+        entry = self._entries.get(chat_id)
+        if entry is not None:
+            rows = [row for row in entry.rows if row.id > after_id]
+            if max_rows and len(rows) >= max_rows:
+                rows = rows[-max_rows:]
+            elif entry.covers_after > after_id:
+                rows = None
+            if rows is not None:
+                self._entries.move_to_end(chat_id)
+                self.hits += 1
+                return rows
+        self.misses += 1
+        return None
+
+    def put(self, chat_id: str, rows: List[HistoryRow], after_id: int, max_rows: Optional[int], token: int):
+        """Caches rows just read from the database (oldest first) with get()'s arguments."""
+        if self._written.get(chat_id, self._forgotten_seq) > token:
+            return  # The chat was written to while the rows were being read.
+        self.drop(chat_id, _write=False)
+        entry = _Entry()
+        entry.covers_after = after_id if not max_rows or len(rows) < max_rows else rows[0].id - 1
+        self._entries[chat_id] = entry
+        for row in rows:
+            self._add(entry, row)
+        self._trim(entry)
+
+    def append(self, chat_id: str, row: HistoryRow):
+        """Adds a newly saved row to the chat's entry, if the chat is cached."""
+        self._record_write(chat_id)
+        entry = self._entries.get(chat_id)
+        if entry is None:
+            return
+        self._entries.move_to_end(chat_id)
+        self._add(entry, row)
+        self._trim(entry)
+
+    def drop(self, chat_id: str, _write: bool = True):
+        """Forgets a chat, e.g. after its history was deleted."""
+        if _write:
+            self._record_write(chat_id)
+        entry = self._entries.pop(chat_id, None)
+        if entry is not None:
+            self._size -= entry.size
+
+    def _add(self, entry: _Entry, row: HistoryRow):
+        entry.rows.append(row)
+        entry.size += row.size
+        self._size += row.size
+
+    def _trim(self, entry: _Entry):
+        while len(entry.rows) > self._max_rows_per_chat:
+            row = entry.rows.popleft()
+            entry.size -= row.size
+            self._size -= row.size
+            entry.covers_after = row.id
+        while self._size > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._size -= evicted.size
+            self.evictions += 1
+
+    def _record_write(self, chat_id: str):
+        self._seq += 1
+        self._written.pop(chat_id, None)
+        self._written[chat_id] = self._seq
+        if len(self._written) > self._max_tracked_writes:
+            _, seq = self._written.popitem(last=False)
+            self._forgotten_seq = seq
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'chats': len(self._entries),
+            'bytes': self._size,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+            'evictions': self.evictions,
+        }
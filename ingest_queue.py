@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Deque, List, Optional, Tuple
+
+
+class _ChatState:
+    __slots__ = ('pending', 'timer', 'first_at', 'last_at', 'queued', 'active')
+
+    def __init__(self):
+        self.pending: Deque[Tuple[float, Any]] = deque()
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.first_at = 0.0
+        self.last_at = 0.0
+        self.queued = False
+        self.active = False
+
+
+class IngestQueue:
+    """
+    In-process queue for incoming WhatsApp messages.
+
+    Messages are buffered per chat and handled by a fixed pool of workers.
+    A chat is owned by at most one worker at a time, so messages from the
+    same chat are processed in arrival order while different chats run
+    concurrently.
+
+    With a debounce window, a chat is only handed to a worker once it has
+    been quiet for `window` seconds (but never later than `max_delay` after
+    its first buffered message). The worker then gets every buffered
+    message of that chat as one batch.
+    """
+
+    def __init__(self, handler: Callable[[str, List[Any]], Awaitable[None]], workers: int = 8,
+                 max_pending: int = 1000, window: float = 0.0, max_delay: float = 5.0):
+        self._handler = handler
+        self._worker_count = max(1, workers)
+        self._max_pending = max_pending
+        self._window = window
+        self._max_delay = max(window, max_delay)
+        self._chats: Dict[str, _ChatState] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._tasks: List[asyncio.Task] = []
+        self._size = 0
+        self._in_flight = 0
+
+        # Metrics
+        self.enqueued = 0
+        self.processed = 0
+        self.batches = 0
+        self.rejected = 0
+        self.failed = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def start(self):
+        """Spawns the worker tasks on the running event loop."""
+        if self._tasks:
+            return
+        for i in range(self._worker_count):
+            self._tasks.append(asyncio.create_task(self._worker(), name=f"ingest-worker-{i}"))
+        logging.info(f"Ingest queue started with {self._worker_count} workers.")
+
+    async def stop(self):
+        """Cancels the workers. Messages still pending are dropped."""
+        for state in self._chats.values():
+            if state.timer:
+                state.timer.cancel()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._size:
+            logging.warning(f"Ingest queue stopped with {self._size} unprocessed messages.")
+
+    def submit(self, chat_id: str, item: Any) -> bool:
+        """Queues an item for a chat. Returns False if the queue is full."""
+        if self._size >= self._max_pending:
+            self.rejected += 1
+            return False
+
+        now = time.monotonic()
+        state = self._chats.get(chat_id)
+        if state is None:
+            state = self._chats[chat_id] = _ChatState()
+        if not state.pending:
+            state.first_at = now
+        state.last_at = now
+        state.pending.append((now, item))
+        self._size += 1
+        self.enqueued += 1
+
+        # A chat that is queued or being processed picks the message up later.
+        if not state.queued and not state.active:
+            self._schedule(chat_id, state)
+        return True
+
+    def _schedule(self, chat_id: str, state: _ChatState):
+        if state.timer:
+            state.timer.cancel()
+            state.timer = None
+
+        due = min(state.last_at + self._window, state.first_at + self._max_delay)
+        delay = due - time.monotonic()
+        if delay <= 0:
+            self._mark_ready(chat_id)
+        else:
+            state.timer = asyncio.get_running_loop().call_later(delay, self._mark_ready, chat_id)
+
+    def _mark_ready(self, chat_id: str):
+        state = self._chats[chat_id]
+        state.timer = None
+        state.queued = True
+        self._ready.put_nowait(chat_id)
+
+    async def _worker(self):
+        while True:
+            chat_id = await self._ready.get()
+            state = self._chats[chat_id]
+            state.queued = False
+            state.active = True
+
+            now = time.monotonic()
+            batch = []
+            while state.pending:
+                enqueued_at, item = state.pending.popleft()
+                wait = now - enqueued_at
+                self._wait_total += wait
+                self._wait_max = max(self._wait_max, wait)
+                batch.append(item)
+            self._in_flight += len(batch)
+
+            try:
+                await self._handler(chat_id, batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                self.failed += 1
+                logging.exception(f"Unhandled error while processing queued messages for {chat_id}:")
+            finally:
+                state.active = False
+                self._in_flight -= len(batch)
+                self._size -= len(batch)
+                self.processed += len(batch)
+                self.batches += 1
+                if state.pending:
+                    # Messages that arrived meanwhile get their own debounce window.
+                    self._schedule(chat_id, state)
+                else:
+                    del self._chats[chat_id]
+
+    def oldest_wait(self) -> float:
+        """Age in seconds of the oldest message that has not been picked up yet."""
+        now = time.monotonic()
+        oldest = 0.0
+        for state in self._chats.values():
+            if state.pending:
+                oldest = max(oldest, now - state.pending[0][0])
+        return oldest
+
+    def stats(self) -> dict:
+        started = self.processed + self._in_flight
+        return {
+            'workers': self._worker_count,
+            'max_pending': self._max_pending,
+            'coalesce_window_ms': round(self._window * 1000),
+            'depth': self._size - self._in_flight,
+            'in_flight': self._in_flight,
+            'chats': len(self._chats),
+            'enqueued': self.enqueued,
+            'processed': self.processed,
+            'batches': self.batches,
+            'failed': self.failed,
+            'rejected': self.rejected,
+            'avg_wait_ms': round(self._wait_total / started * 1000, 1) if started else 0.0,
+            'max_wait_ms': round(self._wait_max * 1000, 1),
+            'oldest_wait_ms': round(self.oldest_wait() * 1000, 1),
+        }
@@ -0,0 +1,365 @@
+import asyncio
+import bisect
+import logging
+import re
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import config
+import database
+
+# Old (pre-1972) and variant spellings folded to one form, applied in order:
+# Soekarno/Sukarno, Djoko/Joko, Tjahjo/Cahyo, Achmad/Akhmad/Ahmad, Ridho/Rido ...
+# The old j is the new y, so every j ends up as y on both sides.
+SPELLING_RULES = (
+    ("oe", "u"), ("dj", "j"), ("tj", "c"), ("sj", "sy"), ("nj", "ny"), ("j", "y"), ("ch", "kh"), ("kh", "h"),
+    ("ph", "f"), ("dh", "d"), ("th", "t"), ("q", "k"), ("v", "f"),
+)
+# Same for the start of a word: Mohammad/Muhammad
+PREFIX_RULES = (("moh", "muh"),)
+_REPEATED = re.compile(r"(.)\1+")
+
+# A name token that is only this similar to a query word does not count at all
+MIN_TOKEN_SIMILARITY = 0.3
+
+# After a failed load, searches go to MySQL for this long before retrying
+LOAD_RETRY_SECONDS = 60
+
+
+def fold_word(word: str) -> str:
+    """Folds one lowercase word to a spelling-insensitive form: Muhammad/Mochammad, Rizky/Rizki."""
+    for old, new in SPELLING_RULES:
+        word = word.replace(old, new)
+    for old, new in PREFIX_RULES:
+        if word.startswith(old):
+            word = new + word[len(old):]
+    word = _REPEATED.sub(r"\1", word)
+    if len(word) > 2 and word.endswith("y"):
+        word = word[:-1] + "i"
+    return word
+
+
+def fold_text(text: str) -> List[str]:
+    return [fold_word(word) for word in re.sub(r"[^\w]", " ", str(text).lower()).split()]
+
+
+def normalize_value(value) -> str:
+    """How MySQL's case-insensitive `=` sees a value: lowercased, trailing spaces ignored."""
+    return "" if value is None else " ".join(str(value).lower().split())
+
+
+def _trigrams(token: str) -> Set[str]:
+    padded = f"#{token}#"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _similarity(query: str, query_grams: Set[str], token: str, token_grams: Set[str]) -> float:
+    if query == token:
+        return 1.0
+    if token.startswith(query):
+        return 0.9
+    if len(query) >= 3 and query in token:
+        return 0.75
+    return 2 * len(query_grams & token_grams) / (len(query_grams) + len(token_grams))
+
+
+class _FieldIndex:
+    """Folded tokens of one text column: token -> records, trigram -> tokens."""
+
+    def __init__(self):
+        self._records: Dict[str, Set[int]] = defaultdict(set)
+        self._grams: Dict[str, Set[str]] = {}
+        self._by_gram: Dict[str, Set[str]] = defaultdict(set)
+        self._sorted: List[str] = []
+
+    def add(self, record_id: int, text):
+        for token in set(fold_text(text or "")):
+            if token not in self._grams:
+                grams = self._grams[token] = _trigrams(token)
+                for gram in grams:
+                    self._by_gram[gram].add(token)
+                bisect.insort(self._sorted, token)
+            self._records[token].add(record_id)
+
+    def remove(self, record_id: int, text):
+        for token in set(fold_text(text or "")):
+            records = self._records.get(token)
+            if records is None:
+                continue
+            records.discard(record_id)
+            if not records:
+                del self._records[token]
+                for gram in self._grams.pop(token):
+                    self._by_gram[gram].discard(token)
+                self._sorted.pop(bisect.bisect_left(self._sorted, token))
+
+    def _candidates(self, query: str, query_grams: Set[str]) -> Set[str]:
+        tokens = set()
+        for gram in query_grams:
+            tokens |= self._by_gram.get(gram, set())
+        # Prefixes too short to share a trigram ("m" for Muhammad)
+        start = bisect.bisect_left(self._sorted, query)
+        for token in self._sorted[start:start + 50]:
+            if not token.startswith(query):
+                break
+            tokens.add(token)
+        return tokens
+
+    def match(self, words: List[str]) -> Dict[int, float]:
+        """Scores records by how well their tokens cover the query words (mean of each word's best match)."""
+        totals: Dict[int, float] = defaultdict(float)
+        for word in words:
+            grams = _trigrams(word)
+            best: Dict[int, float] = {}
+            for token in self._candidates(word, grams):
+                similarity = _similarity(word, grams, token, self._grams[token])
+                if similarity < MIN_TOKEN_SIMILARITY:
+                    continue
+                for record_id in self._records[token]:
+                    if similarity > best.get(record_id, 0.0):
+                        best[record_id] = similarity
+            for record_id, similarity in best.items():
+                totals[record_id] += similarity
+        return {record_id: total / len(words) for record_id, total in totals.items()}
+
+
+class TableIndex:
+    """
+    One table held in memory: its rows, fuzzy indexes over `text_fields`,
+    exact maps over `id_fields`, and an exact map over `filter_field`.
+    """
+
+    def __init__(self, text_fields: Iterable[str], id_fields: Iterable[str], filter_field: Optional[str] = None):
+        self._text_fields = {field: _FieldIndex() for field in text_fields}
+        self._id_fields = {field: defaultdict(set) for field in id_fields}
+        self._filter_field = filter_field
+        self._filter: Dict[str, Set[int]] = defaultdict(set)
+        self.rows: Dict[int, dict] = {}
+        self._next_id = 0
+
+    @staticmethod
+    def _identifier(value) -> str:
+        return re.sub(r"[\s.]", "", normalize_value(value))
+
+    def add(self, row: dict) -> int:
+        record_id = self._next_id
+        self._next_id += 1
+        self.rows[record_id] = row
+        self._link(record_id, row)
+        return record_id
+
+    def _link(self, record_id: int, row: dict):
+        for field, index in self._text_fields.items():
+            index.add(record_id, row.get(field))
+        for field, values in self._id_fields.items():
+            if row.get(field):
+                values[self._identifier(row[field])].add(record_id)
+        if self._filter_field:
+            self._filter[normalize_value(row.get(self._filter_field))].add(record_id)
+
+    def _unlink(self, record_id: int, row: dict):
+        for field, index in self._text_fields.items():
+            index.remove(record_id, row.get(field))
+        for field, values in self._id_fields.items():
+            if row.get(field):
+                values[self._identifier(row[field])].discard(record_id)
+        if self._filter_field:
+            self._filter[normalize_value(row.get(self._filter_field))].discard(record_id)
+
+    def update(self, updates: dict, where: dict) -> int:
+        """Applies an UPDATE ... WHERE col = value AND ... to the rows in memory. Returns the rows changed."""
+        wanted = {column: normalize_value(value) for column, value in where.items()}
+        changed = 0
+        for record_id, row in list(self.rows.items()):
+            if all(normalize_value(row.get(column)) == value for column, value in wanted.items()):
+                self._unlink(record_id, row)
+                row.update(updates)
+                self._link(record_id, row)
+                changed += 1
+        return changed
+
+    def search(self, term: Optional[str], filter_value: Optional[str] = None, min_score: float = 0.6,
+               limit: Optional[int] = None) -> List[dict]:
+        """
+        Rows matching `term`, best first: exact identifier matches, then
+        fuzzy matches on the text fields scoring at least `min_score`.
+        `filter_value` keeps only rows whose filter field equals it.
+        """
+        allowed = self._filter.get(normalize_value(filter_value), set()) if filter_value else None
+        if not term:
+            record_ids = sorted(allowed or ())
+            return [self.rows[record_id] for record_id in record_ids]
+
+        scores: Dict[int, float] = {}
+        identifier = self._identifier(term)
+        for values in self._id_fields.values():
+            for record_id in values.get(identifier, ()):
+                scores[record_id] = 2.0
+        words = fold_text(term)
+        # Numbers are identifiers; they never match names approximately
+        if words and not identifier.isdigit():
+            for index in self._text_fields.values():
+                for record_id, score in index.match(words).items():
+                    if score >= min_score and score > scores.get(record_id, 0.0):
+                        scores[record_id] = score
+
+        if allowed is not None:
+            scores = {record_id: score for record_id, score in scores.items() if record_id in allowed}
+        ranked = sorted(scores, key=lambda record_id: (-scores[record_id], record_id))
+        return [self.rows[record_id] for record_id in ranked[:limit]]
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+class PeopleIndex:
+    """
+    In-process search index over the siswa and gukar tables, replacing
+    `LIKE '%term%'` scans. Names (and gukar's mengajar) are matched by
+    folded tokens and trigrams, so spelling variants and partial names
+    rank together; NISN, NIPD and NIP are matched exactly.
+
+    Each table is loaded on first use and reloaded every
+    `refresh_interval` seconds, to pick up edits made outside the bot.
+    Writes through db_update_tool/db_insert_tool are applied to the rows in
+    memory right away (and replayed if a reload was running meanwhile).
+    While a table cannot be loaded, search() returns None for a minute and
+    the caller queries MySQL instead.
+    """
+
+    def __init__(self, columns: Dict[str, List[str]], enabled: bool = None, refresh_interval: float = None,
+                 min_score: float = None, max_results: int = None):
+        self._columns = columns
+        self.enabled = config.SEARCH_INDEX_ENABLED if enabled is None else enabled
+        self._refresh_interval = config.SEARCH_INDEX_REFRESH_INTERVAL if refresh_interval is None else refresh_interval
+        self._min_score = config.SEARCH_MIN_SCORE if min_score is None else min_score
+        self._max_results = config.SEARCH_MAX_RESULTS if max_results is None else max_results
+        self._tables: Dict[str, TableIndex] = {}
+        self._loaded_at: Dict[str, float] = {}
+        self._retry_at: Dict[str, float] = {}
+        self._loading: Dict[str, List[Tuple[str, dict, dict]]] = {}
+        self._locks: Dict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+
+        # Metrics
+        self.searches = 0
+        self.fallbacks = 0
+        self.reloads = 0
+        self.incremental_writes = 0
+        self._search_seconds = 0.0
+
+    @staticmethod
+    def _new_table(table: str) -> TableIndex:
+        if table == 'siswa':
+            return TableIndex(text_fields=['nama'], id_fields=['nisn', 'nipd'], filter_field='rombel_saat_ini')
+        return TableIndex(text_fields=['nama', 'mengajar'], id_fields=['nip'])
+
+    def invalidate(self, table: Optional[str] = None):
+        """Makes the next search reload `table` (or every table) from the database."""
+        for name in [table] if table else list(self._loaded_at):
+            self._loaded_at.pop(name, None)
+
+    def _fresh(self, table: str) -> bool:
+        return time.monotonic() - self._loaded_at.get(table, float('-inf')) < self._refresh_interval
+
+    async def _get_table(self, table: str, db_pool) -> Optional[TableIndex]:
+        if self._fresh(table):
+            return self._tables[table]
+        if time.monotonic() < self._retry_at.get(table, 0.0):
+            return None
+        async with self._locks[table]:
+            if self._fresh(table):
+                return self._tables[table]
+            col_str = ", ".join(f"`{column}`" for column in self._columns[table])
+            index = self._new_table(table)
+            self._loading[table] = []
+            try:
+                rows = await database.execute_sql_query(db_pool, f"SELECT {col_str} FROM `{table}`")
+                for row in rows:
+                    index.add(dict(row))
+                # Writes made while the rows were being read; an insert the
+                # SELECT already saw is not added twice
+                for kind, values, where in self._loading[table]:
+                    if kind == 'insert' and values in index.rows.values():
+                        continue
+                    self._apply(index, kind, values, where)
+            except database.DatabaseError as e:
+                logging.error(f"Search index could not load {table}, using SQL searches for now: {e}")
+                self._retry_at[table] = time.monotonic() + LOAD_RETRY_SECONDS
+                return None
+            finally:
+                del self._loading[table]
+            self._tables[table] = index
+            self._loaded_at[table] = time.monotonic()
+            self.reloads += 1
+            logging.info(f"Search index loaded {len(index)} {table} rows.")
+            return index
+
+    async def _search(self, table: str, term: Optional[str], db_pool, filter_value: Optional[str],
+                      limit: Optional[int]) -> Optional[List[dict]]:
+        index = await self._get_table(table, db_pool) if self.enabled else None
+        if index is None:
+            self.fallbacks += 1
+            return None
+        started = time.perf_counter()
+        rows = index.search(term, filter_value, self._min_score, limit)
+        self._search_seconds += time.perf_counter() - started
+        self.searches += 1
+        return rows
+
+    async def search(self, table: str, term: Optional[str], db_pool,
+                     filter_value: Optional[str] = None) -> Optional[Tuple[List[dict], int]]:
+        """
+        (rows, total): the rows of `table` matching `term`, best first and
+        at most `max_results` of them (every row when only `filter_value`
+        is given), and how many matched in all. None when the index is off
+        or cannot be loaded.
+        """
+        rows = await self._search(table, term, db_pool, filter_value, None)
+        if rows is None:
+            return None
+        return (rows[:self._max_results] if term else rows), len(rows)
+
+    async def count(self, table: str, term: Optional[str], db_pool, filter_value: Optional[str] = None) -> Optional[int]:
+        """How many rows search() would find without its limit, or None like search()."""
+        rows = await self._search(table, term, db_pool, filter_value, None)
+        return None if rows is None else len(rows)
+
+    @staticmethod
+    def _apply(index: TableIndex, kind: str, values: dict, where: dict):
+        if kind == 'update':
+            index.update(values, where)
+        else:
+            index.add(dict(values))
+
+    def _record_write(self, table: str, kind: str, values: dict, where: dict):
+        if table not in self._columns:
+            return
+        if kind == 'insert':
+            values = {column: values.get(column) for column in self._columns[table]}
+        else:
+            values = {column: value for column, value in values.items() if column in self._columns[table]}
+        if table in self._loading:
+            self._loading[table].append((kind, values, where))
+        if table in self._tables:
+            self._apply(self._tables[table], kind, values, where)
+            self.incremental_writes += 1
+
+    def record_update(self, table: str, updates: dict, where: dict):
+        """Applies a successful UPDATE ... SET `updates` WHERE `where` to the rows in memory."""
+        self._record_write(table, 'update', updates, where)
+
+    def record_insert(self, table: str, data: dict):
+        """Adds a successfully INSERTed row to the index."""
+        self._record_write(table, 'insert', data, {})
+
+    def stats(self) -> dict:
+        return {
+            'enabled': self.enabled,
+            'rows': {table: len(index) for table, index in self._tables.items()},
+            'searches': self.searches,
+            'avg_search_us': round(self._search_seconds / self.searches * 1_000_000, 1) if self.searches else 0.0,
+            'fallbacks': self.fallbacks,
+            'reloads': self.reloads,
+            'incremental_writes': self.incremental_writes,
+        }
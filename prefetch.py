@@ -0,0 +1,143 @@
+import asyncio
+import json
+import logging
+import re
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from google.genai import types
+
+# NIP: 18 digits, often written as 8-6-1-3 groups
+NIP_PATTERN = re.compile(r"(?<!\d)(\d{8})[ .]?(\d{6})[ .]?(\d)[ .]?(\d{3})(?!\d)")
+# NISN: 10 digits
+NISN_PATTERN = re.compile(r"(?<!\d)\d{10}(?!\d)")
+# NIPD has no fixed shape, so only when it is named
+NIPD_PATTERN = re.compile(r"\b(?:nipd|nis)\b\s*[:.]?\s*(\d[\d./-]{2,19})", re.IGNORECASE)
+
+Lookup = Tuple[str, str]  # (tool name, search term)
+
+
+def detect_identifiers(text: str, limit: int = 3) -> List[Lookup]:
+    """Returns the lookups a message's NIP, NISN or NIPD numbers call for, in order of appearance."""
+    found = []
+    for match in NIP_PATTERN.finditer(text):
+        found.append((match.start(), ("db_gukar_tool", "".join(match.groups()))))
+    for match in NISN_PATTERN.finditer(text):
+        found.append((match.start(), ("db_siswa_tool", match.group(0))))
+    for match in NIPD_PATTERN.finditer(text):
+        found.append((match.start(), ("db_siswa_tool", match.group(1).rstrip("./-"))))
+    lookups = []
+    for _, lookup in sorted(found):
+        if lookup not in lookups:
+            lookups.append(lookup)
+    return lookups[:limit]
+
+
+class PrefetchedLookups:
+    """The lookups started for one turn; each result is handed out at most once."""
+
+    def __init__(self, prefetcher: "LookupPrefetcher", tasks: Dict[Lookup, asyncio.Task]):
+        self._prefetcher = prefetcher
+        self._tasks = tasks
+        self._lookups = set(tasks)
+        self._used = set()
+        self._injected = False
+
+    async def context_part(self, wait: float) -> Optional[types.Part]:
+        """
+        A text part with the results that are ready within `wait` seconds,
+        to add to the user's message so the model can answer in one round.
+        """
+        if wait > 0:
+            await asyncio.wait(self._tasks.values(), timeout=wait)
+        lines = []
+        for (tool_name, search_term), task in self._tasks.items():
+            if task.done() and not task.cancelled() and task.exception() is None:
+                response = task.result().function_response.response
+                lines.append(f"{tool_name}(search_term={search_term!r}): {json.dumps(response, default=str)}")
+                self._used.add((tool_name, search_term))
+        if not lines:
+            return None
+        self._injected = True
+        self._prefetcher.injected += 1
+        return types.Part.from_text(text=(
+            "[Hasil pencarian otomatis di database untuk nomor dalam pesan ini. Gunakan bila relevan, "
+            "tidak perlu memanggil tool yang sama lagi.]\n" + "\n".join(lines)
+        ))
+
+    def take(self, function_call: types.FunctionCall) -> Optional[Awaitable[types.Part]]:
+        """The prefetched result for a tool call asking exactly for a prefetched lookup."""
+        args = dict(function_call.args or {})
+        search_term = str(args.pop("search_term", ""))
+        if function_call.name == "db_gukar_tool":
+            search_term = re.sub(r"[ .]", "", search_term)
+        lookup = (function_call.name, search_term)
+        if args or lookup not in self._tasks:
+            return None
+        task = self._tasks.pop(lookup)
+        self._used.add(lookup)
+        self._prefetcher.served += 1
+        return task
+
+    def first_round_done(self, function_calls: List[types.FunctionCall]):
+        """Counts a model round saved when injected results made a lookup call unnecessary."""
+        if self._injected and not any(call.name in ("db_siswa_tool", "db_gukar_tool") for call in function_calls):
+            self._prefetcher.rounds_saved += 1
+
+    def close(self):
+        """Cancels the remaining lookups and counts which ones reached the model."""
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks.clear()
+        self._prefetcher.hits += len(self._used)
+        self._prefetcher.unused += len(self._lookups - self._used)
+        self._lookups.clear()
+
+
+class LookupPrefetcher:
+    """
+    Starts siswa/gukar lookups for identifiers in a message as soon as the
+    turn begins, so they run while history is loaded and the model is
+    called. Results that are ready in time go into the prompt; a later
+    tool call asking for the same lookup is answered from the result.
+    """
+
+    def __init__(self, run_lookup: Callable[[types.FunctionCall], Awaitable[types.Part]], max_lookups: int = 3):
+        self._run_lookup = run_lookup
+        self._max_lookups = max_lookups
+
+        # Metrics
+        self.turns = 0
+        self.lookups = 0
+        self.hits = 0
+        self.injected = 0
+        self.served = 0
+        self.unused = 0
+        self.rounds_saved = 0
+
+    def start(self, content: types.Content) -> Optional[PrefetchedLookups]:
+        text = " ".join(part.text for part in content.parts or [] if part.text)
+        lookups = detect_identifiers(text, self._max_lookups) if text else []
+        if not lookups:
+            return None
+        self.turns += 1
+        self.lookups += len(lookups)
+        logging.info(f"Prefetching lookups {lookups}")
+        tasks = {
+            (tool_name, search_term): asyncio.create_task(
+                self._run_lookup(types.FunctionCall(name=tool_name, args={"search_term": search_term}))
+            )
+            for tool_name, search_term in lookups
+        }
+        return PrefetchedLookups(self, tasks)
+
+    def stats(self) -> dict:
+        finished = self.hits + self.unused
+        return {
+            'turns': self.turns,
+            'lookups': self.lookups,
+            'injected_turns': self.injected,
+            'served_tool_calls': self.served,
+            'unused': self.unused,
+            'hit_rate': round(self.hits / finished, 3) if finished else 0.0,
+            'rounds_saved': self.rounds_saved,
+        }
@@ -0,0 +1,89 @@
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import List, Optional
+
+
+class RateLimiter(ABC):
+    """Interface for message rate limiters, so a shared backend can replace the in-memory one."""
+
+    @abstractmethod
+    async def is_limited(self, key: str) -> bool:
+        """Consumes one request for `key`. Returns True if it must be rejected."""
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+
+class TokenBucketRateLimiter(RateLimiter):
+    """
+    In-memory token bucket limiter.
+
+    Each chat gets a bucket of `capacity` tokens that refills at
+    capacity / window tokens per second, plus one global bucket shared by
+    all chats. A bucket that has been idle for a full window is full again,
+    so it is simply dropped; memory only holds recently active chats.
+    """
+
+    def __init__(self, capacity: int, window: float, global_capacity: Optional[int] = None):
+        self._capacity = capacity
+        self._rate = capacity / window
+        self._idle_ttl = window
+        # chat_id -> [tokens, last_seen], least recently seen first
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+        self._global_capacity = global_capacity
+        self._global_rate = global_capacity / window if global_capacity else 0.0
+        self._global = [float(global_capacity or 0), time.monotonic()]
+
+        # Metrics
+        self.allowed = 0
+        self.rejected_chat = 0
+        self.rejected_global = 0
+        self.evicted = 0
+
+    async def is_limited(self, key: str) -> bool:
+        now = time.monotonic()
+        self._evict_idle(now)
+
+        bucket = self._buckets.pop(key, None)
+        if bucket is None:
+            bucket = [float(self._capacity), now]
+        else:
+            bucket[0] = min(self._capacity, bucket[0] + (now - bucket[1]) * self._rate)
+            bucket[1] = now
+        self._buckets[key] = bucket
+
+        if bucket[0] < 1:
+            self.rejected_chat += 1
+            return True
+
+        if self._global_capacity:
+            self._global[0] = min(self._global_capacity, self._global[0] + (now - self._global[1]) * self._global_rate)
+            self._global[1] = now
+            if self._global[0] < 1:
+                self.rejected_global += 1
+                return True
+            self._global[0] -= 1
+
+        bucket[0] -= 1
+        self.allowed += 1
+        return False
+
+    def _evict_idle(self, now: float):
+        while self._buckets:
+            key, (_, last_seen) = next(iter(self._buckets.items()))
+            if now - last_seen < self._idle_ttl:
+                break
+            del self._buckets[key]
+            self.evicted += 1
+
+    def stats(self) -> dict:
+        return {
+            'tracked_chats': len(self._buckets),
+            'allowed': self.allowed,
+            'rejected_chat': self.rejected_chat,
+            'rejected_global': self.rejected_global,
+            'evicted': self.evicted,
+        }
@@ -0,0 +1,77 @@
+import re
+from typing import Dict, Iterable, Tuple
+
+from google.genai import types
+
+from failover import LatencyTracker
+
+# Routes, by ai_settings.route
+LIGHT = 'light'
+HEAVY = 'heavy'
+ROUTES = (LIGHT, HEAVY)
+
+
+class TurnRouter:
+    """
+    Picks the model route for a chat turn before the first model call.
+
+    Short text-only turns go to the light (fast, cheap) model. Turns with
+    media, longer text, or words that usually lead to tool calls go to the
+    heavy model. A light turn that still asks for tools is escalated, so
+    its remaining rounds run on the heavy model.
+    """
+
+    def __init__(self, light_max_chars: int = 300, heavy_keywords: Iterable[str] = ()):
+        self._light_max_chars = light_max_chars
+        keywords = [re.escape(word) for word in heavy_keywords]
+        self._keyword_pattern = re.compile(r"\b(" + "|".join(keywords) + r")\b", re.IGNORECASE) if keywords else None
+        self._latencies = {route: LatencyTracker(min_samples=1) for route in ROUTES}
+
+        # Metrics
+        self.decisions: Dict[str, Dict[str, int]] = {route: {} for route in ROUTES}
+        self.escalated = 0
+        self._calls = {route: 0 for route in ROUTES}
+        self._seconds = {route: 0.0 for route in ROUTES}
+
+    def route(self, content: types.Content, light_available: bool = True) -> Tuple[str, str]:
+        """Returns (route, reason) for a user turn and counts the decision."""
+        route, reason = self._classify(content, light_available)
+        self.decisions[route][reason] = self.decisions[route].get(reason, 0) + 1
+        return route, reason
+
+    def _classify(self, content: types.Content, light_available: bool) -> Tuple[str, str]:
+        if not light_available:
+            return HEAVY, 'no_light_model'
+        parts = content.parts or []
+        if any(part.file_data or part.inline_data for part in parts):
+            return HEAVY, 'media'
+        text = " ".join(part.text for part in parts if part.text)
+        if len(text) > self._light_max_chars:
+            return HEAVY, 'long_text'
+        if self._keyword_pattern and self._keyword_pattern.search(text):
+            return HEAVY, 'keyword'
+        return LIGHT, 'short_text'
+
+    def escalate(self):
+        """A light turn asked for tools; its next rounds use the heavy model."""
+        self.escalated += 1
+
+    def record(self, route: str, seconds: float):
+        """Records the duration of one model call made on `route`."""
+        self._calls[route] += 1
+        self._seconds[route] += seconds
+        self._latencies[route].add(seconds)
+
+    def stats(self) -> dict:
+        routes = {}
+        for route in ROUTES:
+            calls = self._calls[route]
+            p95 = self._latencies[route].percentile(0.95)
+            routes[route] = {
+                'turns': sum(self.decisions[route].values()),
+                'reasons': dict(self.decisions[route]),
+                'model_calls': calls,
+                'avg_ms': round(self._seconds[route] / calls * 1000, 1) if calls else 0.0,
+                'p95_ms': round(p95 * 1000, 1) if p95 is not None else None,
+            }
+        return {'routes': routes, 'escalated': self.escalated}
@@ -0,0 +1,125 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+# Priority classes, served strictly in this order
+INTERACTIVE = 'interactive'
+ADMIN = 'admin'
+BATCH = 'batch'
+PRIORITIES = (INTERACTIVE, ADMIN, BATCH)
+
+
+class _PriorityClass:
+    __slots__ = ('queue', 'virtual_time', 'last_tag', 'granted', 'wait_total', 'wait_max')
+
+    def __init__(self):
+        # (finish tag, sequence, start tag, key, future), smallest finish tag served first
+        self.queue: List[tuple] = []
+        self.virtual_time = 0.0
+        # key -> finish tag of its newest queued request
+        self.last_tag: Dict[str, float] = {}
+
+        # Metrics
+        self.granted = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+
+class ModelCallScheduler:
+    """
+    Central gate in front of the AI providers.
+
+    At most `max_concurrent` model calls run at once. Waiting calls are
+    served by priority class first (interactive replies, then admin work,
+    then batch jobs). Inside a class, start-time fair queuing across keys
+    (chat ids) keeps one busy chat from starving the others: each key's
+    requests get virtual finish tags spaced 1/weight apart, and the
+    smallest tag runs next.
+    """
+
+    def __init__(self, max_concurrent: int = 16):
+        self.max_concurrent = max(1, max_concurrent)
+        self._active = 0
+        self._classes = {priority: _PriorityClass() for priority in PRIORITIES}
+        self._sequence = itertools.count()
+
+    @asynccontextmanager
+    async def slot(self, priority: str = INTERACTIVE, key: Optional[str] = None, weight: float = 1.0):
+        """Waits for a turn to call the model and holds it for the duration of the block."""
+        await self.acquire(priority, key, weight)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, priority: str = INTERACTIVE, key: Optional[str] = None, weight: float = 1.0):
+        pclass = self._classes[priority]
+        if self._active < self.max_concurrent and not any(c.queue for c in self._classes.values()):
+            self._active += 1
+            self._record_wait(pclass, 0.0)
+            return
+
+        key = key or ''
+        start = max(pclass.virtual_time, pclass.last_tag.get(key, 0.0))
+        tag = start + 1.0 / weight
+        pclass.last_tag[key] = tag
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(pclass.queue, (tag, next(self._sequence), start, key, future))
+        self._dispatch()
+
+        queued_at = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just as the caller gave up.
+                self.release()
+            raise
+        self._record_wait(pclass, time.monotonic() - queued_at)
+
+    def release(self):
+        self._active -= 1
+        self._dispatch()
+
+    def _dispatch(self):
+        while self._active < self.max_concurrent:
+            entry = self._next_waiter()
+            if entry is None:
+                return
+            self._active += 1
+            entry.set_result(None)
+
+    def _next_waiter(self) -> Optional[asyncio.Future]:
+        for pclass in self._classes.values():
+            while pclass.queue:
+                tag, _, start, key, future = heapq.heappop(pclass.queue)
+                if pclass.last_tag.get(key) == tag:
+                    del pclass.last_tag[key]
+                if future.done():
+                    continue  # cancelled while waiting
+                pclass.virtual_time = max(pclass.virtual_time, start)
+                return future
+        return None
+
+    def _record_wait(self, pclass: _PriorityClass, waited: float):
+        pclass.granted += 1
+        pclass.wait_total += waited
+        pclass.wait_max = max(pclass.wait_max, waited)
+
+    def stats(self) -> dict:
+        return {
+            'active': self._active,
+            'max_concurrent': self.max_concurrent,
+            'classes': {
+                priority: {
+                    'queued': sum(1 for entry in pclass.queue if not entry[-1].done()),
+                    'granted': pclass.granted,
+                    'avg_wait_ms': round(pclass.wait_total / pclass.granted * 1000, 1) if pclass.granted else 0.0,
+                    'max_wait_ms': round(pclass.wait_max * 1000, 1),
+                }
+                for priority, pclass in self._classes.items()
+            },
+        }
@@ -1,8 +1,13 @@
 -- Khumaira AI Database Schema Migration
 -- Run this SQL against your database to add the new columns and tables.
 
--- 1. Add timestamp to chat_history (if not exists)
+-- 1. Add timestamp, answering AI provider and token usage to chat_history (if not exists)
 ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS provider VARCHAR(150) DEFAULT NULL;
+ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS prompt_tokens INT DEFAULT NULL;
+ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS output_tokens INT DEFAULT NULL;
+ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS cached_tokens INT DEFAULT NULL;
+ALTER TABLE chat_history ADD COLUMN IF NOT EXISTS cost DECIMAL(12,6) DEFAULT NULL;
 
 -- 2. Add label column to conversation_control
 ALTER TABLE conversation_control ADD COLUMN IF NOT EXISTS label VARCHAR(50) DEFAULT NULL;
@@ -51,6 +56,35 @@ CREATE TABLE IF NOT EXISTS ai_settings (
     api_key VARCHAR(255) DEFAULT NULL,
     system_prompt TEXT DEFAULT NULL,
     is_active TINYINT(1) DEFAULT 0,
+    route VARCHAR(20) DEFAULT NULL,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 8. Processed WhatsApp message ids (webhook idempotency)
+CREATE TABLE IF NOT EXISTS processed_messages (
+    message_hash BINARY(16) NOT NULL PRIMARY KEY,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    KEY idx_processed_messages_created_at (created_at)
+) ENGINE=InnoDB;
+
+-- 9. Rolling per-chat summary of compacted history
+CREATE TABLE IF NOT EXISTS chat_summaries (
+    chat_id VARCHAR(50) NOT NULL PRIMARY KEY,
+    summary TEXT NOT NULL,
+    last_history_id INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+
+-- 10. Vetted answers to frequent questions (pending until approved)
+CREATE TABLE IF NOT EXISTS faq_answers (
+    id INT AUTO_INCREMENT PRIMARY KEY,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    status VARCHAR(20) NOT NULL DEFAULT 'pending',
+    asked_count INT NOT NULL DEFAULT 1,
+    hit_count INT NOT NULL DEFAULT 0,
+    expires_at TIMESTAMP NULL DEFAULT NULL,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
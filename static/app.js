@@ -32,6 +32,7 @@ document.addEventListener('DOMContentLoaded', function () {
     const statModel = document.getElementById('stat-model');
     const statActiveChats = document.getElementById('stat-active-chats');
     const statUptime = document.getElementById('stat-uptime');
+    const statAiLoad = document.getElementById('stat-ai-load');
     const summaryCard = document.getElementById('summary-card');
     const summaryText = document.getElementById('chat-summary-text');
     const labelDisplay = document.getElementById('label-display');
@@ -42,6 +43,9 @@ document.addEventListener('DOMContentLoaded', function () {
     const statTotalChats = document.getElementById('stat-total-chats');
     const chartDaily = document.getElementById('chart-daily');
     const topChatsList = document.getElementById('top-chats-list');
+    const statTokenTotal = document.getElementById('stat-token-total');
+    const chartTokens = document.getElementById('chart-tokens');
+    const tokenChatsList = document.getElementById('token-chats-list');
 
     // Tools
     const broadcastText = document.getElementById('broadcast-text');
@@ -54,6 +58,10 @@ document.addEventListener('DOMContentLoaded', function () {
     const arKeyword = document.getElementById('ar-keyword');
     const arResponse = document.getElementById('ar-response');
     const btnAddAr = document.getElementById('btn-add-ar');
+    const faqList = document.getElementById('faq-list');
+    const faqQuestion = document.getElementById('faq-question');
+    const faqAnswer = document.getElementById('faq-answer');
+    const btnAddFaq = document.getElementById('btn-add-faq');
 
     // Modal
     const modalOverlay = document.getElementById('modal-overlay');
@@ -90,11 +98,14 @@ document.addEventListener('DOMContentLoaded', function () {
     fetchStats();
     fetchInitialConversations();
     fetchAnalytics();
+    fetchTokenUsage();
     fetchTemplates();
     fetchAutoReplies();
+    fetchFaqs();
     setupGlobalWebSocket();
     setInterval(fetchStats, 60000);
     setInterval(fetchAnalytics, 120000);
+    setInterval(fetchTokenUsage, 300000);
 
     // ===== Mobile Sidebar Toggle =====
     if (btnHamburger) {
@@ -234,6 +245,12 @@ document.addEventListener('DOMContentLoaded', function () {
     });
 
     // ===== Stats =====
+    const AI_LOAD_LABELS = {
+        normal: '🟢 Normal',
+        degraded: '🟡 Degraded (summary ditunda)',
+        shedding: '🔴 Sibuk (balasan otomatis)',
+    };
+
     async function fetchStats() {
         const res = await apiFetch('/api/stats');
         if (!res) return;
@@ -242,6 +259,7 @@ document.addEventListener('DOMContentLoaded', function () {
             statActiveChats.textContent = data.active_chats;
             statUptime.textContent = data.uptime;
             statModel.textContent = data.model;
+            if (statAiLoad) statAiLoad.textContent = AI_LOAD_LABELS[data.ai_load] || data.ai_load || '-';
         }
     }
 
@@ -293,6 +311,60 @@ document.addEventListener('DOMContentLoaded', function () {
         }
     }
 
+    // ===== Token Usage =====
+    function formatTokens(n) {
+        return n >= 1000000 ? `${(n / 1000000).toFixed(1)}M` : n >= 1000 ? `${(n / 1000).toFixed(1)}k` : `${n}`;
+    }
+
+    function formatCost(c) {
+        return `$${c.toFixed(c < 1 ? 4 : 2)}`;
+    }
+
+    async function fetchTokenUsage() {
+        const res = await apiFetch('/api/token-usage?days=30');
+        if (!res) return;
+        const data = await res.json();
+        if (data.error) return;
+
+        const total = data.daily.reduce((sum, d) => sum + d.prompt_tokens + d.output_tokens, 0);
+        const cost = data.daily.reduce((sum, d) => sum + d.cost, 0);
+        if (statTokenTotal) statTokenTotal.textContent = `${formatTokens(total)} · ${formatCost(cost)}`;
+
+        if (chartTokens) {
+            chartTokens.innerHTML = '';
+            const days = data.daily.slice(-14);
+            if (days.length > 0) {
+                const max = Math.max(...days.map(d => d.prompt_tokens + d.output_tokens), 1);
+                days.forEach(d => {
+                    const tokens = d.prompt_tokens + d.output_tokens;
+                    const bar = document.createElement('div');
+                    bar.className = 'chart-bar';
+                    bar.style.height = `${Math.max(tokens / max * 100, 5)}%`;
+                    bar.title = `${d.date}: ${tokens.toLocaleString()} token (${d.prompt_tokens.toLocaleString()} masuk, ${d.output_tokens.toLocaleString()} keluar), ${formatCost(d.cost)}`;
+                    const dayLabel = d.date ? new Date(d.date).getDate() : '?';
+                    bar.innerHTML = `<span class="chart-bar-value">${formatTokens(tokens)}</span><span class="chart-bar-label">${dayLabel}</span>`;
+                    chartTokens.appendChild(bar);
+                });
+            } else {
+                chartTokens.innerHTML = '<span style="color: var(--text-muted); font-size: 0.8rem; padding: 20px;">Belum ada data</span>';
+            }
+        }
+
+        if (tokenChatsList) {
+            tokenChatsList.innerHTML = '';
+            data.chats.forEach(c => {
+                const item = document.createElement('div');
+                item.className = 'mini-list-item';
+                item.title = `${c.turns} giliran, ${c.prompt_tokens.toLocaleString()} token masuk (${c.cached_tokens.toLocaleString()} dari cache), ${c.output_tokens.toLocaleString()} keluar`;
+                item.innerHTML = `
+                    <span class="item-text" style="font-size: 0.78rem;">${formatPhoneNumber(c.chat_id)}</span>
+                    <span style="color: var(--accent-color); font-weight: 600; font-size: 0.8rem;">${formatTokens(c.prompt_tokens + c.output_tokens)} · ${formatCost(c.cost)}</span>
+                `;
+                tokenChatsList.appendChild(item);
+            });
+        }
+    }
+
     // ===== Conversations =====
     async function fetchInitialConversations() {
         const res = await apiFetch('/api/conversations');
@@ -793,6 +865,70 @@ document.addEventListener('DOMContentLoaded', function () {
         });
     }
 
+    // ===== FAQ Answers =====
+    async function fetchFaqs() {
+        const res = await apiFetch('/api/faq');
+        if (!res) return;
+        const entries = await res.json();
+        renderFaqs(entries);
+    }
+
+    function renderFaqs(entries) {
+        if (!faqList) return;
+        faqList.innerHTML = '';
+        if (!entries || entries.length === 0) {
+            faqList.innerHTML = '<div style="padding: 10px; color: var(--text-muted); font-size: 0.78rem; text-align: center;"><i class="bi bi-patch-question"></i> Belum ada FAQ</div>';
+            return;
+        }
+        entries.forEach(f => {
+            const status = f.expired ? 'kedaluwarsa' : (f.status === 'approved' ? 'aktif' : `menunggu · ditanya ${f.asked_count}x`);
+            const item = document.createElement('div');
+            item.className = 'mini-list-item';
+            item.innerHTML = `
+                <div class="item-text">
+                    <div class="item-keyword"></div>
+                    <div class="item-response"></div>
+                    <div class="item-response"></div>
+                </div>
+                ${f.status !== 'approved' && !f.expired ? `<button class="btn-delete-item" data-action="approve" title="Setujui"><i class="bi bi-check2"></i></button>` : ''}
+                ${f.status === 'approved' && !f.expired ? `<button class="btn-delete-item" data-action="expire" title="Kedaluwarsakan"><i class="bi bi-clock-history"></i></button>` : ''}
+                <button class="btn-delete-item" data-action="delete" title="Hapus"><i class="bi bi-trash3"></i></button>
+            `;
+            // Suggested questions are typed by WhatsApp users, so never parse them as HTML
+            const [question, answer, info] = item.querySelectorAll('.item-text > div');
+            question.textContent = `"${f.question}"`;
+            answer.textContent = `→ ${f.answer.substring(0, 40)}${f.answer.length > 40 ? '...' : ''}`;
+            info.textContent = `${status} · ${f.hit_count} terjawab`;
+            item.querySelectorAll('.btn-delete-item').forEach(btn => btn.addEventListener('click', async () => {
+                const action = btn.dataset.action;
+                if (action === 'delete') {
+                    await apiFetch(`/api/faq/${f.id}`, { method: 'DELETE' });
+                } else {
+                    await apiFetch(`/api/faq/${f.id}/${action}`, { method: 'POST' });
+                }
+                fetchFaqs();
+                showToast(action === 'approve' ? 'FAQ disetujui ✅' : (action === 'expire' ? 'FAQ dinonaktifkan' : 'FAQ dihapus'), 'success');
+            }));
+            faqList.appendChild(item);
+        });
+    }
+
+    if (btnAddFaq) {
+        btnAddFaq.addEventListener('click', async () => {
+            const question = faqQuestion.value.trim();
+            const answer = faqAnswer.value.trim();
+            if (!question || !answer) return showToast('Isi pertanyaan dan jawaban', 'error');
+            await apiFetch('/api/faq', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ question, answer })
+            });
+            faqQuestion.value = ''; faqAnswer.value = '';
+            fetchFaqs();
+            showToast('FAQ ditambahkan ✅', 'success');
+        });
+    }
+
     // ===== WebSocket =====
     function setupGlobalWebSocket() {
         const protocol = window.location.protocol === 'https:' ? 'wss:' : 'ws:';
@@ -0,0 +1,43 @@
+import unittest
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from admission import AdmissionController, NORMAL, DEGRADED, SHEDDING
+
+
+class TestAdmissionController(unittest.IsolatedAsyncioTestCase):
+
+    async def test_in_flight_thresholds(self):
+        """Tests the state transitions driven by in-flight model calls."""
+        admission = AdmissionController(degrade_in_flight=1, shed_in_flight=2)
+        self.assertEqual(admission.state(), NORMAL)
+
+        async with admission.track():
+            self.assertEqual(admission.state(), DEGRADED)
+            self.assertTrue(admission.admit())
+            self.assertFalse(admission.admit(low_priority=True))
+            async with admission.track():
+                self.assertEqual(admission.state(), SHEDDING)
+                self.assertFalse(admission.admit())
+
+        self.assertEqual(admission.state(), NORMAL)
+        stats = admission.stats()
+        self.assertEqual(stats['in_flight'], 0)
+        self.assertEqual((stats['admitted'], stats['deferred'], stats['shed']), (1, 1, 1))
+
+    def test_queue_age_thresholds(self):
+        """Tests that a deep ingest queue alone triggers shedding."""
+        age = [0.0]
+        admission = AdmissionController(queue_age=lambda: age[0], degrade_queue_age=5, shed_queue_age=20)
+
+        age[0] = 6
+        self.assertEqual(admission.state(), DEGRADED)
+        age[0] = 25
+        self.assertEqual(admission.state(), SHEDDING)
+        self.assertFalse(admission.admit())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,336 @@
+import asyncio
+import json
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from aiohttp import web
+from aiohttp.test_utils import TestClient, TestServer
+from google.genai import types
+
+from ai_service import ActiveSettingCache, AIService, AIProvider, GeminiProvider, OpenRouterProvider, ProviderRegistry, fallback_chain
+from failover import ProviderHealth
+
+
+def make_slow_gemini(delay: float, timeout: float = 5) -> GeminiProvider:
+    """A GeminiProvider whose async client takes `delay` seconds to answer."""
+    provider = GeminiProvider("fake-key", "gemini-test", timeout=timeout)
+
+    async def slow_generate(**kwargs):
+        await asyncio.sleep(delay)
+        return "model-response"
+
+    provider.client = MagicMock()
+    provider.client.aio.models.generate_content = slow_generate
+    return provider
+
+
+class TestGeminiProvider(unittest.IsolatedAsyncioTestCase):
+
+    async def test_slow_model_call_does_not_block_server(self):
+        """Tests that other requests are served while a model call is running."""
+        async def ping(request):
+            return web.Response(text="pong")
+
+        app = web.Application()
+        app.router.add_get('/ping', ping)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            provider = make_slow_gemini(delay=0.5)
+            contents = [types.Content(role="user", parts=[types.Part.from_text(text="halo")])]
+            model_call = asyncio.create_task(provider.generate_content(contents))
+            await asyncio.sleep(0.01)
+
+            resp = await client.get('/ping')
+            self.assertEqual(await resp.text(), "pong")
+            self.assertFalse(model_call.done())
+
+            self.assertEqual(await model_call, "model-response")
+        finally:
+            await client.close()
+
+    async def test_model_call_times_out(self):
+        """Tests that a hanging model call is cancelled after the timeout."""
+        provider = make_slow_gemini(delay=5, timeout=0.05)
+        contents = [types.Content(role="user", parts=[types.Part.from_text(text="halo")])]
+        with self.assertRaises(asyncio.TimeoutError):
+            await provider.generate_content(contents)
+
+    async def test_stream_passes_text_and_merges_turn(self):
+        """Tests that streamed text reaches the callback and the result is one merged turn."""
+        chunks = [
+            types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(
+                role="model", parts=[types.Part.from_text(text=text)]))])
+            for text in ("Halo, ", "apa kabar?")
+        ]
+        chunks.append(types.GenerateContentResponse(candidates=[types.Candidate(content=types.Content(
+            role="model", parts=[types.Part.from_function_call(name="db_siswa_tool", args={"q": "Ani"})]))]))
+
+        async def stream():
+            for chunk in chunks:
+                yield chunk
+
+        provider = GeminiProvider("fake-key", "gemini-test")
+        provider.client = MagicMock()
+        provider.client.aio.models.generate_content_stream = AsyncMock(return_value=stream())
+        received = []
+
+        async def on_text(text):
+            received.append(text)
+
+        contents = [types.Content(role="user", parts=[types.Part.from_text(text="halo")])]
+        response = await provider.generate_content_stream(contents, on_text)
+
+        self.assertEqual(received, ["Halo, ", "apa kabar?"])
+        parts = response.candidates[0].content.parts
+        self.assertEqual(parts[0].text, "Halo, apa kabar?")
+        self.assertEqual(parts[1].function_call.name, "db_siswa_tool")
+
+
+class TestOpenRouterProvider(unittest.IsolatedAsyncioTestCase):
+
+    async def test_stream_reads_server_sent_events(self):
+        """Tests that SSE text deltas are streamed, tool call fragments are joined and usage is kept."""
+        events = [
+            {"choices": [{"delta": {"content": "Sebentar, "}}]},
+            {"choices": [{"delta": {"content": "saya cek."}}]},
+            {"choices": [{"delta": {"tool_calls": [{"index": 0, "id": "call_1", "function": {"name": "db_siswa_tool", "arguments": '{"q": '}}]}}]},
+            {"choices": [{"delta": {"tool_calls": [{"index": 0, "function": {"arguments": '"Ani"}'}}]}}]},
+            {"choices": [], "usage": {"prompt_tokens": 120, "completion_tokens": 30, "total_tokens": 150}},
+        ]
+
+        async def completions(request):
+            resp = web.StreamResponse(headers={'Content-Type': 'text/event-stream'})
+            await resp.prepare(request)
+            await resp.write(b": keep-alive\n\n")
+            for event in events:
+                await resp.write(f"data: {json.dumps(event)}\n\n".encode())
+            await resp.write(b"data: [DONE]\n\n")
+            return resp
+
+        app = web.Application()
+        app.router.add_post('/chat/completions', completions)
+        client = TestClient(TestServer(app))
+        await client.start_server()
+        try:
+            provider = OpenRouterProvider("key", "model", session=client.session)
+            provider.api_url = str(client.make_url('/chat/completions'))
+            received = []
+
+            async def on_text(text):
+                received.append(text)
+
+            contents = [types.Content(role="user", parts=[types.Part.from_text(text="cari Ani")])]
+            response = await provider.generate_content_stream(contents, on_text)
+        finally:
+            await client.close()
+
+        self.assertEqual(received, ["Sebentar, ", "saya cek."])
+        parts = response.candidates[0].content.parts
+        self.assertEqual(parts[0].text, "Sebentar, saya cek.")
+        self.assertEqual(parts[1].function_call.name, "db_siswa_tool")
+        self.assertEqual(parts[1].function_call.args, {"q": "Ani"})
+        self.assertEqual(parts[1].function_call.id, "call_1")
+        self.assertEqual((response.usage_metadata.prompt_token_count, response.usage_metadata.candidates_token_count), (120, 30))
+
+    async def test_history_translated_once(self):
+        """Tests that a Content object is translated on first use and reused by later turns."""
+        provider = OpenRouterProvider("key", "model")
+        old = types.Content(role="user", parts=[types.Part.from_text(text="halo")])
+        new = types.Content(role="user", parts=[types.Part.from_text(text="apa kabar")])
+
+        with patch.object(OpenRouterProvider, '_translate_content', wraps=OpenRouterProvider._translate_content) as translate:
+            provider._build_request([old])
+            payload, _ = provider._build_request([old, new], system_instruction="prompt")
+
+        self.assertEqual(translate.call_count, 2)
+        self.assertEqual([m["content"] for m in payload["messages"]], ["prompt", "halo", "apa kabar"])
+
+    def test_tool_schemas_converted_once(self):
+        """Tests that the same tool set is converted once and the result reused."""
+        provider = OpenRouterProvider("key", "model")
+        tool = types.Tool(function_declarations=[types.FunctionDeclaration(
+            name="db_siswa_tool", description="Cari siswa",
+            parameters=types.Schema(type="OBJECT", properties={"q": types.Schema(type="STRING")}),
+        )])
+
+        first = provider._convert_tools([tool])
+        with patch.object(provider, '_convert_schema') as convert_schema:
+            again = provider._convert_tools([tool])
+
+        self.assertIs(again, first)
+        convert_schema.assert_not_called()
+        self.assertEqual(first[0]["function"]["parameters"]["properties"]["q"], {"type": "string"})
+
+
+class FakeProvider(AIProvider):
+    def __init__(self, delay: float = 0.0, error: Exception = None):
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def generate_content(self, contents, system_instruction=None, tools=None):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return "from-provider"
+
+
+def make_service(providers, hedge=False):
+    """An AIService whose chain is the given (name, provider) pairs."""
+    service = AIService(registry=MagicMock(), health=ProviderHealth(min_calls=2, error_rate=1.0), hedge=hedge)
+    service._chain = list(providers)
+    return service
+
+
+class TestAIServiceFailover(unittest.IsolatedAsyncioTestCase):
+
+    async def test_falls_back_and_records_provider(self):
+        """Tests that a failing primary is skipped and the answering provider is reported."""
+        primary, backup = FakeProvider(error=RuntimeError("503")), FakeProvider()
+        service = make_service([('primary', primary), ('backup', backup)])
+        call_info = {}
+
+        self.assertEqual(await service.generate_content([], call_info=call_info), "from-provider")
+        self.assertEqual(call_info['provider'], 'backup')
+
+    async def test_open_breaker_skips_provider(self):
+        """Tests that a provider is no longer called once its breaker opened."""
+        primary, backup = FakeProvider(error=RuntimeError("503")), FakeProvider()
+        service = make_service([('primary', primary), ('backup', backup)])
+        for _ in range(3):
+            await service.generate_content([])
+
+        self.assertEqual(primary.calls, 2)
+        self.assertEqual(backup.calls, 3)
+
+    async def test_hedged_request_wins_when_primary_is_slow(self):
+        """Tests that a backup request is fired after the primary's p95, the faster answer is used, and the loser's time is not a latency sample."""
+        primary, backup = FakeProvider(delay=5), FakeProvider()
+        service = make_service([('primary', primary), ('backup', backup)], hedge=True)
+        for _ in range(20):
+            service._health.latency('primary').add(0.01)
+        call_info = {}
+
+        with patch('ai_service.config.AI_HEDGE_MIN_DELAY', 0.01):
+            result = await asyncio.wait_for(service.generate_content([], call_info=call_info), timeout=1)
+
+        self.assertEqual(result, "from-provider")
+        self.assertEqual(call_info['provider'], 'backup')
+        self.assertEqual(service._health.hedged, 1)
+        self.assertEqual(service._health.latency('primary').percentile(1.0), 0.01)
+
+    def test_fallback_chain_order(self):
+        """Tests that configured ids set the order, and nothing is tried without them."""
+        rows = [{'id': 1}, {'id': 2}, {'id': 3}]
+        self.assertEqual(fallback_chain(rows[0], rows, order=[]), [])
+        self.assertEqual(fallback_chain(rows[0], rows, order=[3, 1]), [{'id': 3}])
+
+
+class TestProviderRegistry(unittest.IsolatedAsyncioTestCase):
+
+    async def test_provider_reused_until_setting_changes(self):
+        """Tests that providers are rebuilt only when their ai_settings row changes."""
+        registry = ProviderRegistry(pool_size=2)
+        setting = {'id': 1, 'provider': 'gemini', 'model_name': 'gemini-a', 'api_key': 'key-1'}
+
+        first = registry.get_provider(setting)
+        self.assertIs(registry.get_provider(dict(setting)), first)
+
+        changed = registry.get_provider(dict(setting, model_name='gemini-b'))
+        self.assertIsNot(changed, first)
+        self.assertEqual(changed.model_name, 'gemini-b')
+        # Same API key, same pooled client
+        self.assertIs(changed.client, first.client)
+        await registry.close()
+
+    async def test_openai_compatible_providers_share_session(self):
+        """Tests that OpenRouter and OpenAI providers share one keep-alive session."""
+        registry = ProviderRegistry(pool_size=2)
+        openrouter = registry.get_provider({'id': 1, 'provider': 'openrouter', 'model_name': 'm', 'api_key': 'k'})
+        openai = registry.get_provider({'id': 2, 'provider': 'openai', 'model_name': 'm', 'api_key': 'k'})
+
+        self.assertIsInstance(openrouter, OpenRouterProvider)
+        self.assertIs(openrouter.session, openai.session)
+        self.assertEqual(openai.api_url, "https://api.openai.com/v1/chat/completions")
+
+        await registry.close()
+        self.assertTrue(openrouter.session.closed)
+
+
+class TestActiveSettingCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.setting = {'id': 1, 'provider': 'gemini', 'model_name': 'gemini-a', 'api_key': 'key-1'}
+        version_patcher = patch('ai_service.database.get_ai_settings_version', new_callable=AsyncMock)
+        setting_patcher = patch('ai_service.database.get_active_ai_setting', new_callable=AsyncMock)
+        all_settings_patcher = patch('ai_service.database.get_ai_settings', new_callable=AsyncMock, return_value=[])
+        all_settings_patcher.start()
+        self.addCleanup(all_settings_patcher.stop)
+        self.mock_version = version_patcher.start()
+        self.mock_setting = setting_patcher.start()
+        self.addCleanup(version_patcher.stop)
+        self.addCleanup(setting_patcher.stop)
+        self.mock_version.return_value = (1, 'ts-1', 1)
+        self.mock_setting.return_value = self.setting
+
+    async def test_snapshot_served_from_memory(self):
+        """Tests that repeated lookups within the check interval hit no database."""
+        cache = ActiveSettingCache(check_interval=60, registry=ProviderRegistry())
+        setting, service = await cache.get(MagicMock())
+        again, same_service = await cache.get(MagicMock())
+
+        self.assertEqual(setting, self.setting)
+        self.assertIs(same_service, service)
+        self.mock_version.assert_called_once()
+        self.mock_setting.assert_called_once()
+
+    async def test_invalidate_forces_reload(self):
+        """Tests that an explicit invalidation rebuilds the service on the next lookup."""
+        cache = ActiveSettingCache(check_interval=60, registry=ProviderRegistry())
+        _, service = await cache.get(MagicMock())
+
+        cache.invalidate()
+        self.mock_setting.return_value = dict(self.setting, model_name='gemini-b')
+        setting, reloaded = await cache.get(MagicMock())
+
+        self.assertIsNot(reloaded, service)
+        self.assertEqual(setting['model_name'], 'gemini-b')
+
+    async def test_reloads_only_when_version_changes(self):
+        """Tests that an expired snapshot re-reads the row only if the version changed."""
+        cache = ActiveSettingCache(check_interval=0, registry=ProviderRegistry())
+        _, service = await cache.get(MagicMock())
+
+        _, unchanged = await cache.get(MagicMock())
+        self.assertIs(unchanged, service)
+        self.assertEqual(self.mock_setting.call_count, 1)
+
+        self.mock_version.return_value = (1, 'ts-2', 1)
+        _, reloaded = await cache.get(MagicMock())
+        self.assertIsNot(reloaded, service)
+        self.assertEqual(self.mock_setting.call_count, 2)
+
+    async def test_light_route(self):
+        """Tests that the row marked route='light' gets its own service, falling back to the active row."""
+        light = {'id': 2, 'provider': 'gemini', 'model_name': 'gemini-lite', 'api_key': 'key-2', 'route': 'light'}
+        cache = ActiveSettingCache(check_interval=60, registry=ProviderRegistry())
+
+        self.assertEqual(await cache.get(MagicMock(), route='light'), (None, None))
+
+        cache.invalidate()
+        with patch('ai_service.database.get_ai_settings', new_callable=AsyncMock, return_value=[self.setting, light]):
+            setting, service = await cache.get(MagicMock(), route='light')
+        _, heavy_service = await cache.get(MagicMock())
+
+        self.assertEqual(setting, light)
+        self.assertEqual([label for label, _ in service._chain], ['gemini/gemini-lite#2', 'gemini/gemini-a#1'])
+        self.assertEqual(heavy_service._chain[0][0], 'gemini/gemini-a#1')
+
+if __name__ == '__main__':
+    unittest.main()
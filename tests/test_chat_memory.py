@@ -0,0 +1,79 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from chat_memory import ConversationCompactor, render_transcript
+
+
+def text_row(row_id, user_text, bot_text):
+    return (row_id,
+            {"role": "user", "parts": [{"type": "text", "text": user_text}]},
+            {"role": "model", "parts": [{"type": "text", "text": bot_text}]})
+
+
+class TestConversationCompactor(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        patchers = {
+            'get_chat_summary': patch('chat_memory.database.get_chat_summary', new_callable=AsyncMock),
+            'get_rows': patch('chat_memory.database.get_history_rows_to_compact', new_callable=AsyncMock),
+            'save': patch('chat_memory.database.save_chat_summary', new_callable=AsyncMock),
+            'get_chats': patch('chat_memory.database.get_chats_to_compact', new_callable=AsyncMock),
+        }
+        self.mocks = {name: patcher.start() for name, patcher in patchers.items()}
+        for patcher in patchers.values():
+            self.addCleanup(patcher.stop)
+        self.summarize = AsyncMock(return_value="ringkasan baru")
+
+    async def test_only_rows_since_checkpoint_are_summarized(self):
+        """Tests that compaction starts at the last checkpoint and moves it forward."""
+        self.mocks['get_chat_summary'].return_value = ("ringkasan lama", 7)
+        self.mocks['get_rows'].return_value = [text_row(8, "halo", "hai"), text_row(9, "nama saya Ani", "salam kenal")]
+        compactor = ConversationCompactor(MagicMock(), self.summarize, keep_recent=10)
+
+        self.assertTrue(await compactor.compact_chat("628111"))
+
+        self.assertEqual(self.mocks['get_rows'].call_args[0][1:4], ("628111", 7, 10))
+        previous, transcript = self.summarize.call_args[0]
+        self.assertEqual(previous, "ringkasan lama")
+        self.assertIn("User: nama saya Ani", transcript)
+        self.mocks['save'].assert_called_once_with(compactor._db_pool, "628111", "ringkasan baru", 9)
+
+    async def test_trailing_function_call_left_with_its_result(self):
+        """Tests that a call whose result is still recent is not compacted."""
+        call = (9, {"role": "user", "parts": [{"type": "text", "text": "cari Ani"}]},
+                {"role": "model", "parts": [{"type": "function_call", "name": "db_siswa_tool", "arguments": {}}]})
+        self.mocks['get_chat_summary'].return_value = (None, 0)
+        self.mocks['get_rows'].return_value = [text_row(8, "halo", "hai"), call]
+        compactor = ConversationCompactor(MagicMock(), self.summarize)
+
+        await compactor.compact_chat("628111")
+
+        self.assertNotIn("cari Ani", self.summarize.call_args[0][1])
+        self.assertEqual(self.mocks['save'].call_args[0][3], 8)
+
+    async def test_deferred_when_not_admitted(self):
+        """Tests that compaction waits while the AI is too busy for background work."""
+        compactor = ConversationCompactor(MagicMock(), self.summarize, admit=lambda: False)
+
+        await compactor.run_once()
+
+        self.mocks['get_chats'].assert_not_called()
+        self.assertEqual(compactor.stats()['deferred'], 1)
+
+    def test_render_transcript_truncates_tool_results(self):
+        """Tests that large tool results are shortened in the transcript."""
+        row = (1, {"role": "tool", "parts": [{"type": "function_response", "name": "db_siswa_tool",
+                                              "response": {"result": "x" * 2000}}]},
+               {"role": "model", "parts": [{"type": "text", "text": "ok"}]})
+        transcript = render_transcript([row])
+
+        self.assertIn("db_siswa_tool returned", transcript)
+        self.assertLess(len(transcript), 700)
+
+
+if __name__ == '__main__':
+    unittest.main()
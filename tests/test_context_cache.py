@@ -0,0 +1,114 @@
+import unittest
+from types import SimpleNamespace
+from unittest.mock import patch
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from google.genai import errors, types
+
+from ai_service import GeminiProvider
+from context_cache import GeminiContextCache
+
+TOOLS = [types.Tool(function_declarations=[types.FunctionDeclaration(name="db_siswa_tool", description="Cari siswa")])]
+
+
+class FakeGeminiAPI:
+    """Local stand-in for the parts of genai.Client.aio used by context caching."""
+
+    def __init__(self, fail_create: bool = False):
+        self.fail_create = fail_create
+        self.caches = {}
+        self.requests = []
+        self.aio = SimpleNamespace(
+            caches=SimpleNamespace(create=self._create, update=self._update),
+            models=SimpleNamespace(generate_content=self._generate_content),
+        )
+
+    async def _create(self, model, config):
+        if self.fail_create:
+            raise errors.ClientError(400, {'error': {'message': 'Cached content is too small'}})
+        name = f"cachedContents/{len(self.caches) + 1}"
+        self.caches[name] = {'model': model, 'ttl': config.ttl, 'system_instruction': config.system_instruction}
+        return types.CachedContent(name=name, model=model)
+
+    async def _update(self, name, config):
+        self.caches[name]['ttl'] = config.ttl
+        return types.CachedContent(name=name)
+
+    async def _generate_content(self, model, contents, config):
+        self.requests.append(config)
+        if config.cached_content and config.cached_content not in self.caches:
+            raise errors.ClientError(404, {'error': {'message': 'CachedContent not found'}})
+        return "model-response"
+
+
+class TestGeminiContextCache(unittest.IsolatedAsyncioTestCase):
+
+    async def test_handle_reused_per_prefix(self):
+        """Tests that one handle is created per model, prompt and tools, then reused."""
+        api = FakeGeminiAPI()
+        cache = GeminiContextCache(api, ttl=3600, min_tokens=0)
+
+        first = await cache.get("gemini-a", "prompt", TOOLS)
+        again = await cache.get("gemini-a", "prompt", TOOLS)
+        other = await cache.get("gemini-a", "another prompt", TOOLS)
+
+        self.assertEqual(first, again)
+        self.assertNotEqual(first, other)
+        self.assertEqual(cache.stats()['created'], 2)
+        self.assertEqual(cache.stats()['hits'], 1)
+
+    async def test_refreshed_before_ttl_runs_out(self):
+        """Tests that the TTL is extended once less than the refresh margin remains."""
+        api = FakeGeminiAPI()
+        cache = GeminiContextCache(api, ttl=600, refresh_margin=300, min_tokens=0)
+        with patch('context_cache.time.monotonic', return_value=1000.0):
+            name = await cache.get("gemini-a", "prompt", TOOLS)
+        with patch('context_cache.time.monotonic', return_value=1350.0):
+            self.assertEqual(await cache.get("gemini-a", "prompt", TOOLS), name)
+
+        self.assertEqual(cache.stats()['refreshed'], 1)
+        self.assertEqual(cache.stats()['created'], 1)
+
+    async def test_unavailable_falls_back_inline(self):
+        """Tests that short prefixes and failed creations are sent inline without retrying every call."""
+        api = FakeGeminiAPI(fail_create=True)
+        cache = GeminiContextCache(api, min_tokens=0, retry_after=600)
+        self.assertIsNone(await cache.get("gemini-a", "prompt", TOOLS))
+        self.assertIsNone(await cache.get("gemini-a", "prompt", TOOLS))
+        self.assertEqual(cache.stats()['failures'], 1)
+
+        self.assertIsNone(await GeminiContextCache(FakeGeminiAPI(), min_tokens=1024).get("gemini-a", "short", TOOLS))
+
+
+class TestGeminiProviderContextCache(unittest.IsolatedAsyncioTestCase):
+
+    async def test_request_uses_cached_prefix(self):
+        """Tests that requests reference the handle instead of resending prompt and tools."""
+        api = FakeGeminiAPI()
+        provider = GeminiProvider("fake-key", "gemini-a", client=api, context_cache=GeminiContextCache(api, min_tokens=0))
+
+        await provider.generate_content([], system_instruction="prompt", tools=TOOLS)
+
+        request = api.requests[0]
+        self.assertEqual(request.cached_content, "cachedContents/1")
+        self.assertIsNone(request.system_instruction)
+        self.assertIsNone(request.tools)
+
+    async def test_rejected_handle_retried_inline(self):
+        """Tests that a handle the API no longer knows is dropped and the call retried inline."""
+        api = FakeGeminiAPI()
+        cache = GeminiContextCache(api, min_tokens=0)
+        provider = GeminiProvider("fake-key", "gemini-a", client=api, context_cache=cache)
+        await provider.generate_content([], system_instruction="prompt", tools=TOOLS)
+        api.caches.clear()
+
+        self.assertEqual(await provider.generate_content([], system_instruction="prompt", tools=TOOLS), "model-response")
+        self.assertIsNone(api.requests[-1].cached_content)
+        self.assertEqual(api.requests[-1].system_instruction, "prompt")
+        self.assertEqual(cache.stats()['rejected'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
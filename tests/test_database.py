@@ -7,6 +7,8 @@ import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from google.genai import types
+import database
+from history_cache import HistoryCache
 from database import (
     execute_sql_query, save_chat_to_db, get_chat_history_from_db,
     delete_chat_history_from_db, check_auto_reply, DatabaseError
@@ -41,6 +43,9 @@ class TestDatabase(unittest.IsolatedAsyncioTestCase):
 
     def setUp(self):
         self.mock_pool, self.mock_conn, self.mock_cursor = create_mock_pool()
+        cache_patcher = patch.object(database, 'history_cache', HistoryCache())
+        cache_patcher.start()
+        self.addCleanup(cache_patcher.stop)
 
     async def test_execute_sql_query_select(self):
         """Tests a successful SELECT query."""
@@ -79,7 +84,7 @@ class TestDatabase(unittest.IsolatedAsyncioTestCase):
         user_content = {"role": "user", "parts": [{"type": "text", "text": "Hello"}]}
         bot_content = {"role": "model", "parts": [{"type": "text", "text": "Hi there"}]}
         self.mock_cursor.fetchall.return_value = [
-            {'user': json.dumps(user_content), 'bot': json.dumps(bot_content)}
+            {'id': 1, 'user': json.dumps(user_content), 'bot': json.dumps(bot_content)}
         ]
 
         history = await get_chat_history_from_db(self.mock_pool, "12345")
@@ -90,6 +95,53 @@ class TestDatabase(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(history[1].role, 'model')
         self.assertEqual(history[1].parts[0].text, 'Hi there')
 
+    async def test_get_chat_history_reads_newest_rows_only(self):
+        """Tests that only the tail of the history is read and returned oldest first."""
+        rows = []
+        for row_id, text in ((2, "second"), (1, "first")):
+            rows.append({
+                'id': row_id,
+                'user': json.dumps({"role": "user", "parts": [{"type": "text", "text": text}]}),
+                'bot': json.dumps({"role": "model", "parts": [{"type": "text", "text": "ok"}]}),
+            })
+        self.mock_cursor.fetchall.return_value = rows
+
+        history = await get_chat_history_from_db(self.mock_pool, "12345", max_rows=2)
+
+        query, params = self.mock_cursor.execute.call_args[0]
+        self.assertIn("ORDER BY id DESC LIMIT %s", query)
+        self.assertEqual(params, ("12345", 0, 2))
+        self.assertEqual(history[0].parts[0].text, "first")
+        self.assertEqual(history[2].parts[0].text, "second")
+
+    async def test_saved_rows_served_from_cache(self):
+        """Tests that a cached chat is read once and then kept current by saves."""
+        self.mock_cursor.fetchall.return_value = []
+        await get_chat_history_from_db(self.mock_pool, "12345", max_rows=10)
+
+        self.mock_cursor.lastrowid = 7
+        user_dict = {"role": "user", "parts": [{"type": "text", "text": "Hello"}]}
+        await save_chat_to_db(self.mock_pool, "12345", user_dict,
+                              types.Content(role="model", parts=[types.Part.from_text(text="Hi")]))
+        self.mock_cursor.execute.reset_mock()
+
+        history = await get_chat_history_from_db(self.mock_pool, "12345", max_rows=10)
+
+        self.mock_cursor.execute.assert_not_called()
+        self.assertEqual([c.parts[0].text for c in history], ["Hello", "Hi"])
+        self.assertEqual(database.history_cache.stats()['hits'], 1)
+
+    async def test_save_chat_records_usage(self):
+        """Tests that the token usage of a turn is stored next to it."""
+        user_dict = {"role": "user", "parts": [{"type": "text", "text": "Hello"}]}
+        usage = {'prompt_tokens': 120, 'output_tokens': 30, 'cached_tokens': 100, 'cost': 0.000111}
+        await save_chat_to_db(self.mock_pool, "12345", user_dict,
+                              types.Content(role="model", parts=[types.Part.from_text(text="Hi")]), provider="gemini/x", usage=usage)
+
+        query, params = self.mock_cursor.execute.call_args[0]
+        self.assertIn("prompt_tokens, output_tokens, cached_tokens, cost", query)
+        self.assertEqual(params[3:], ("gemini/x", 120, 30, 100, 0.000111))
+
     async def test_get_chat_history_empty(self):
         """Tests retrieving chat history when none exists."""
         self.mock_cursor.fetchall.return_value = []
@@ -100,9 +152,12 @@ class TestDatabase(unittest.IsolatedAsyncioTestCase):
     async def test_delete_chat_history(self):
         """Tests the deletion of chat history."""
         await delete_chat_history_from_db(self.mock_pool, "12345")
-        self.mock_cursor.execute.assert_called_once_with(
+        self.mock_cursor.execute.assert_any_call(
             "DELETE FROM chat_history WHERE chat_id = %s", ("12345",)
         )
+        self.mock_cursor.execute.assert_any_call(
+            "DELETE FROM chat_summaries WHERE chat_id = %s", ("12345",)
+        )
         self.mock_conn.commit.assert_called_once()
 
     async def test_check_auto_reply_match(self):
@@ -0,0 +1,75 @@
+import asyncio
+import time
+import unittest
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from deadline import MEDIA_UPLOAD, MODEL, TOOLS, Deadline, StageStats, StageTimeout
+
+
+class TestDeadline(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.stats = StageStats()
+
+    async def test_stage_cap(self):
+        """Tests that a stage over its own cap is cancelled and counted, while a fast one passes."""
+        deadline = Deadline(60, caps={TOOLS: 0.05}, stats=self.stats)
+        cancelled = asyncio.Event()
+
+        async def hang():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        self.assertEqual(await deadline.run(MODEL, asyncio.sleep(0, result="ok")), "ok")
+        with self.assertRaises(StageTimeout) as raised:
+            await deadline.run(TOOLS, hang())
+
+        self.assertEqual((raised.exception.stage, raised.exception.budget_exhausted), (TOOLS, False))
+        self.assertTrue(cancelled.is_set())
+        self.assertEqual(self.stats.stats()['timeouts'][TOOLS], 1)
+        self.assertEqual(self.stats.stats()['budget_exhausted'], 0)
+
+    async def test_budget_counted_from_arrival(self):
+        """Tests that time spent before a stage (e.g. in the queue) shortens it, and a spent budget fails at once."""
+        deadline = Deadline(1.0, caps={MODEL: 30}, started_at=time.monotonic() - 0.95, stats=self.stats)
+        with self.assertRaises(StageTimeout) as raised:
+            await deadline.run(MODEL, asyncio.sleep(1))
+        self.assertTrue(raised.exception.budget_exhausted)
+        self.assertTrue(deadline.expired())
+
+        started = []
+
+        async def stage():
+            started.append(True)
+
+        with self.assertRaises(StageTimeout):
+            await deadline.run(MEDIA_UPLOAD, stage())
+        self.assertEqual(started, [])
+        self.assertEqual(self.stats.stats()['budget_exhausted'], 2)
+
+    async def test_unbounded(self):
+        """Tests that a deadline without budget or caps leaves stages alone, and their own timeouts pass through."""
+        deadline = Deadline(stats=self.stats)
+        self.assertIsNone(deadline.remaining())
+        self.assertEqual(await deadline.run(MODEL, asyncio.sleep(0.01, result=1)), 1)
+        with self.assertRaises(asyncio.TimeoutError):
+            await deadline.run(MODEL, asyncio.wait_for(asyncio.sleep(1), 0.01))
+        self.assertEqual(self.stats.stats()['timeouts'][MODEL], 0)
+
+    async def test_inner_timeout_passes_through(self):
+        """Tests that a timeout raised inside a bounded stage is re-raised unchanged and not counted as the stage's."""
+        deadline = Deadline(60, caps={MODEL: 30}, stats=self.stats)
+        with self.assertRaises(asyncio.TimeoutError) as raised:
+            await deadline.run(MODEL, asyncio.wait_for(asyncio.sleep(1), 0.01))
+
+        self.assertNotIsInstance(raised.exception, StageTimeout)
+        self.assertEqual(self.stats.stats()['timeouts'][MODEL], 0)
+
+if __name__ == '__main__':
+    unittest.main()
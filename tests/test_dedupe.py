@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from dedupe import MessageDeduplicator
+from database import DatabaseError
+
+
+class TestMessageDeduplicator(unittest.IsolatedAsyncioTestCase):
+
+    def test_check_and_mark_detects_redelivery(self):
+        """Tests that the second delivery of an id is reported as duplicate."""
+        dedupe = MessageDeduplicator()
+        self.assertFalse(dedupe.check_and_mark("wamid.1"))
+        self.assertTrue(dedupe.check_and_mark("wamid.1"))
+        self.assertFalse(dedupe.check_and_mark("wamid.2"))
+        self.assertEqual(dedupe.stats()['memory_duplicates'], 1)
+
+    def test_memory_is_bounded(self):
+        """Tests that the oldest ids are evicted past max_entries."""
+        dedupe = MessageDeduplicator(max_entries=2)
+        for message_id in ("a", "b", "c"):
+            dedupe.check_and_mark(message_id)
+        self.assertEqual(dedupe.stats()['tracked_ids'], 2)
+        self.assertFalse(dedupe.check_and_mark("a"))
+
+    def test_forget_allows_redelivery(self):
+        """Tests that a forgotten id is accepted again."""
+        dedupe = MessageDeduplicator()
+        dedupe.check_and_mark("wamid.1")
+        dedupe.forget("wamid.1")
+        self.assertFalse(dedupe.check_and_mark("wamid.1"))
+
+    @patch('dedupe.database.claim_message_id', new_callable=AsyncMock)
+    async def test_claim_rejects_already_processed(self, mock_claim):
+        """Tests that an id already stored in the database is dropped."""
+        mock_claim.return_value = False
+        dedupe = MessageDeduplicator()
+
+        self.assertFalse(await dedupe.claim(MagicMock(), "wamid.1"))
+        self.assertEqual(dedupe.stats()['db_duplicates'], 1)
+
+    @patch('dedupe.database.claim_message_id', new_callable=AsyncMock)
+    async def test_claim_fails_open_on_db_error(self, mock_claim):
+        """Tests that a database error does not drop the message."""
+        mock_claim.side_effect = DatabaseError("connection lost")
+        dedupe = MessageDeduplicator()
+
+        self.assertTrue(await dedupe.claim(MagicMock(), "wamid.1"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+from unittest.mock import patch
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from failover import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, LatencyTracker
+
+
+class TestCircuitBreaker(unittest.TestCase):
+
+    def test_opens_on_error_rate(self):
+        """Tests that the breaker opens once enough recent calls failed."""
+        breaker = CircuitBreaker(window=10, min_calls=4, error_rate=0.5)
+        for ok in (True, False, True):
+            breaker.record(ok, 1.0)
+        self.assertEqual(breaker.state, CLOSED)
+
+        breaker.record(False, 1.0)
+        self.assertEqual(breaker.state, OPEN)
+        self.assertFalse(breaker.allow())
+
+    def test_opens_on_slow_calls(self):
+        """Tests that successful but slow calls also open the breaker."""
+        breaker = CircuitBreaker(min_calls=2, slow_seconds=5, slow_rate=1.0)
+        breaker.record(True, 6.0)
+        breaker.record(True, 7.0)
+        self.assertEqual(breaker.state, OPEN)
+
+    def test_half_open_allows_one_trial(self):
+        """Tests that after the cooldown a single trial decides whether to close again."""
+        breaker = CircuitBreaker(min_calls=1, error_rate=1.0, cooldown=30)
+        with patch('failover.time.monotonic', return_value=100.0):
+            breaker.record(False, 1.0)
+        with patch('failover.time.monotonic', return_value=131.0):
+            self.assertEqual(breaker.state, HALF_OPEN)
+            self.assertTrue(breaker.allow())
+            self.assertFalse(breaker.allow())
+            breaker.record(True, 1.0)
+            self.assertEqual(breaker.state, CLOSED)
+
+
+class TestLatencyTracker(unittest.TestCase):
+
+    def test_percentile_needs_enough_samples(self):
+        tracker = LatencyTracker(min_samples=20)
+        for i in range(19):
+            tracker.add(float(i))
+        self.assertIsNone(tracker.percentile(0.95))
+
+        for i in range(19, 100):
+            tracker.add(float(i))
+        self.assertEqual(tracker.percentile(0.95), 95.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
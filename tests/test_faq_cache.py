@@ -0,0 +1,78 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from faq_cache import FaqAnswerCache, normalize_question
+
+ROWS = [
+    {'id': 1, 'question': 'Jam berapa masuk sekolah?', 'answer': 'Masuk pukul 07.00.', 'status': 'approved', 'expires_in': None},
+    {'id': 2, 'question': 'Kapan pendaftaran siswa baru dibuka?', 'answer': 'Mulai 1 Juni.', 'status': 'approved', 'expires_in': 3600},
+    {'id': 3, 'question': 'Seragam hari jumat apa?', 'answer': 'Batik.', 'status': 'pending', 'expires_in': None},
+]
+
+
+class TestFaqAnswerCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        patcher = patch('faq_cache.database', new=MagicMock())
+        self.db = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.db.DatabaseError = Exception
+        self.db.get_faq_entries = AsyncMock(return_value=[dict(row) for row in ROWS])
+        self.db.save_faq_entry = AsyncMock(return_value=4)
+        self.db.record_faq_question = AsyncMock()
+        self.cache = FaqAnswerCache(MagicMock(), enabled=True, threshold=0.6)
+
+    def test_normalize_question(self):
+        """Tests that case, punctuation and filler words are dropped."""
+        self.assertEqual(normalize_question("Kak, jam berapa MASUK sekolah ya??"), "jam berapa masuk sekolah")
+
+    async def test_similar_question_served(self):
+        """Tests that a reworded question is answered from the closest approved entry."""
+        self.assertEqual(await self.cache.match("kak, jam masuk sekolah jam berapa?"), (1, 'Masuk pukul 07.00.'))
+        self.assertEqual(await self.cache.match("pendaftaran siswa baru kapan dibuka"), (2, 'Mulai 1 Juni.'))
+        self.assertIsNone(await self.cache.match("berapa nilai rapor anak saya"))
+        self.db.get_faq_entries.assert_called_once()
+
+    async def test_pending_disabled_and_expired_not_served(self):
+        """Tests that pending entries, expired entries and a disabled cache never answer."""
+        self.assertIsNone(await self.cache.match("Seragam hari jumat apa?"))
+
+        self.db.get_faq_entries.return_value = [dict(ROWS[0], expires_in=0)]
+        self.cache.invalidate()
+        self.assertIsNone(await self.cache.match("Jam berapa masuk sekolah?"))
+
+        self.cache.enabled = False
+        self.assertIsNone(await self.cache.match("Kapan pendaftaran siswa baru dibuka?"))
+
+    async def test_suggest(self):
+        """Tests that a new question becomes a pending entry and a repeated one is counted."""
+        await self.cache.suggest("seragam hari jumat pakai apa?", "Batik.")
+        self.db.record_faq_question.assert_awaited_once_with(self.cache._db_pool, 3)
+        self.db.save_faq_entry.assert_not_called()
+
+        await self.cache.suggest("Di mana lokasi perpustakaan?", "Di lantai 2.")
+        self.db.save_faq_entry.assert_awaited_once_with(
+            self.cache._db_pool, "Di mana lokasi perpustakaan?", "Di lantai 2.", status='pending'
+        )
+
+        # Kept in the index without a reload, so asking again only counts
+        await self.cache.suggest("lokasi perpustakaan di mana?", "Di lantai 2.")
+        self.db.record_faq_question.assert_awaited_with(self.cache._db_pool, 4)
+        self.db.get_faq_entries.assert_called_once()
+
+    async def test_suggest_skips_long_or_contextual_answers(self):
+        """Tests that answers that are too long or may depend on the chat are not suggested."""
+        self.cache = FaqAnswerCache(MagicMock(), enabled=True, threshold=0.6, max_answer_chars=20)
+
+        await self.cache.suggest("Kapan ujian semester?", "Minggu depan, seperti yang Bapak tanyakan tadi.")
+        await self.cache.suggest("Kapan ujian semester?", "Minggu depan.", had_context=True)
+
+        self.db.save_faq_entry.assert_not_called()
+        self.db.record_faq_question.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
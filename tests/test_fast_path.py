@@ -0,0 +1,77 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from fast_path import INTENTS, FastPathRouter, enabled_intents
+
+SISWA = {'nama': 'Ani Lestari', 'jk': 'P', 'nisn': '0071234567', 'nipd': '2122.10.001', 'rombel_saat_ini': 'X 1'}
+
+
+class TestFastPathRouter(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        patcher = patch('fast_path.database', new=MagicMock())
+        self.db = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.db.DatabaseError = Exception
+        patcher = patch('tools.search_siswa', new_callable=AsyncMock, return_value=([SISWA], 1))
+        self.search_siswa = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.router = FastPathRouter(INTENTS)
+
+    def test_match(self):
+        """Tests that whole-message commands pick the right intent and everything else is left alone."""
+        cases = {
+            "Cek NISN 0071234567": ('cek_nomor_siswa', '0071234567'),
+            "cek nipd: 2122.10.001?": ('cek_nomor_siswa', '2122.10.001'),
+            "cek nip 19800101 200501 1 001": ('cek_nip', '19800101 200501 1 001'),
+            "cari siswa ani lestari": ('cari_siswa', 'ani lestari'),
+            "Jumlah siswa kelas X 1": ('jumlah_siswa', 'x 1'),
+        }
+        for text, (intent_name, value) in cases.items():
+            intent, groups = self.router.match(text)
+            self.assertEqual((intent.name, next(iter(groups.values()))), (intent_name, value), text)
+
+        for text in ("nisn anak saya 0071234567 kelas berapa?", "halo", "", None):
+            self.assertIsNone(self.router.match(text), text)
+
+    async def test_answer_from_template(self):
+        """Tests that a command runs the tool's search and formats the rows without a model call."""
+        intent_name, reply = await self.router.answer("cek nisn 0071234567", None)
+
+        self.assertEqual(intent_name, 'cek_nomor_siswa')
+        self.assertEqual(reply, "*Ani Lestari* (P)\nNISN: 0071234567\nNIPD: 2122.10.001\nRombel: X 1")
+        self.search_siswa.assert_awaited_once_with({'search_term': '0071234567'}, None)
+
+        self.search_siswa.return_value = ([{'total': 36}], 1)
+        self.assertEqual(await self.router.answer("jumlah siswa x 1", None), ('jumlah_siswa', "Jumlah siswa rombel X 1: *36* siswa."))
+        self.assertEqual(self.router.stats()['answered']['jumlah_siswa'], 1)
+
+    async def test_counts_rows_left_out(self):
+        """Tests that the "lainnya" note counts every match, not just the rows the search returned."""
+        self.search_siswa.return_value = ([SISWA] * 25, 40)
+
+        _, reply = await self.router.answer("cari siswa ani", None)
+
+        self.assertTrue(reply.endswith("...dan 35 lainnya. Mohon perjelas pencariannya."))
+
+    async def test_falls_through_to_model(self):
+        """Tests that empty results and database errors leave the message to the model."""
+        self.search_siswa.return_value = ([], 0)
+        self.assertIsNone(await self.router.answer("cek nisn 0071234567", None))
+
+        self.search_siswa.side_effect = Exception("down")
+        self.assertIsNone(await self.router.answer("cari siswa ani", None))
+        self.assertEqual(self.router.stats()['fell_through'], 2)
+
+    def test_enabled_intents(self):
+        """Tests that the intent list can be narrowed by name."""
+        self.assertEqual([intent.name for intent in enabled_intents("jumlah_siswa, cek_nip")], ['cek_nip', 'jumlah_siswa'])
+        self.assertEqual(len(enabled_intents("")), len(INTENTS))
+        self.assertIsNone(FastPathRouter(enabled_intents("cek_nip")).match("jumlah siswa X 1"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from history_cache import HistoryCache, HistoryRow
+
+
+def make_row(row_id, size=100):
+    return HistoryRow(row_id, {"role": "user", "parts": []}, {"role": "model", "parts": []}, size)
+
+
+class TestHistoryCache(unittest.TestCase):
+
+    def test_window_served_only_when_covered(self):
+        """Tests that a lookup hits only if the entry holds every row it needs."""
+        cache = HistoryCache()
+        cache.put("a", [make_row(5), make_row(6)], after_id=0, max_rows=2, token=cache.snapshot())
+
+        self.assertEqual([r.id for r in cache.get("a", max_rows=2)], [5, 6])
+        self.assertIsNone(cache.get("a", max_rows=3))  # rows before 5 were never read
+        self.assertEqual([r.id for r in cache.get("a", after_id=5, max_rows=3)], [6])
+
+    def test_append_extends_cached_chat_only(self):
+        """Tests that saved rows are added to cached chats and ignored for others."""
+        cache = HistoryCache()
+        cache.put("a", [], after_id=0, max_rows=10, token=cache.snapshot())
+        cache.append("a", make_row(1))
+        cache.append("b", make_row(2))
+
+        self.assertEqual([r.id for r in cache.get("a", max_rows=10)], [1])
+        self.assertIsNone(cache.get("b", max_rows=10))
+
+    def test_stale_read_not_cached(self):
+        """Tests that rows read before a concurrent write are not cached."""
+        cache = HistoryCache()
+        token = cache.snapshot()
+        cache.append("a", make_row(3))
+        cache.put("a", [make_row(1), make_row(2)], after_id=0, max_rows=10, token=token)
+
+        self.assertIsNone(cache.get("a", max_rows=10))
+
+    def test_evicts_least_recently_used_by_size(self):
+        """Tests that the byte bound evicts the least recently used chat."""
+        cache = HistoryCache(max_bytes=1500)
+        cache.put("a", [make_row(1, size=300)], after_id=0, max_rows=10, token=cache.snapshot())
+        cache.put("b", [make_row(2, size=300)], after_id=0, max_rows=10, token=cache.snapshot())
+        cache.get("a", max_rows=10)
+        cache.put("c", [make_row(3, size=300)], after_id=0, max_rows=10, token=cache.snapshot())
+
+        self.assertIsNone(cache.get("b", max_rows=10))
+        self.assertIsNotNone(cache.get("a", max_rows=10))
+        self.assertEqual(cache.stats()['evictions'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import asyncio
+import unittest
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from ingest_queue import IngestQueue
+
+
+class TestIngestQueue(unittest.IsolatedAsyncioTestCase):
+
+    async def test_messages_in_same_chat_keep_order(self):
+        """Tests that one chat is processed sequentially in arrival order."""
+        seen = []
+
+        async def handler(chat_id, items):
+            await asyncio.sleep(0.01)
+            seen.extend(items)
+
+        queue = IngestQueue(handler, workers=4)
+        queue.start()
+        for i in range(5):
+            queue.submit("628111", i)
+        await asyncio.sleep(0.2)
+        await queue.stop()
+
+        self.assertEqual(seen, [0, 1, 2, 3, 4])
+
+    async def test_different_chats_run_concurrently(self):
+        """Tests that a slow chat does not hold up other chats."""
+        fast_done = asyncio.Event()
+        release_slow = asyncio.Event()
+
+        async def handler(chat_id, items):
+            if items == ["slow"]:
+                await release_slow.wait()
+            else:
+                fast_done.set()
+
+        queue = IngestQueue(handler, workers=2)
+        queue.start()
+        queue.submit("628111", "slow")
+        queue.submit("628222", "fast")
+
+        await asyncio.wait_for(fast_done.wait(), timeout=1)
+        self.assertEqual(queue.stats()['in_flight'], 1)
+        release_slow.set()
+        await asyncio.sleep(0.05)
+        await queue.stop()
+        self.assertEqual(queue.stats()['processed'], 2)
+
+    async def test_submit_rejects_when_full(self):
+        """Tests that the queue refuses new items past max_pending."""
+        async def handler(chat_id, items):
+            pass
+
+        queue = IngestQueue(handler, workers=1, max_pending=2)
+        self.assertTrue(queue.submit("a", 1))
+        self.assertTrue(queue.submit("b", 2))
+        self.assertFalse(queue.submit("c", 3))
+
+        stats = queue.stats()
+        self.assertEqual(stats['depth'], 2)
+        self.assertEqual(stats['rejected'], 1)
+
+    async def test_handler_error_does_not_stop_worker(self):
+        """Tests that a failing message is counted and the next one still runs."""
+        seen = []
+
+        async def handler(chat_id, items):
+            if items == ["bad"]:
+                raise ValueError("boom")
+            seen.extend(items)
+
+        queue = IngestQueue(handler, workers=1)
+        queue.start()
+        queue.submit("628111", "bad")
+        await asyncio.sleep(0.01)
+        queue.submit("628111", "good")
+        await asyncio.sleep(0.05)
+        await queue.stop()
+
+        self.assertEqual(seen, ["good"])
+        self.assertEqual(queue.stats()['failed'], 1)
+
+    async def test_debounce_window_coalesces_burst(self):
+        """Tests that a burst from one chat is delivered as a single batch."""
+        batches = []
+
+        async def handler(chat_id, items):
+            batches.append((chat_id, items))
+
+        queue = IngestQueue(handler, workers=2, window=0.05, max_delay=1)
+        queue.start()
+        queue.submit("628111", "halo")
+        await asyncio.sleep(0.02)
+        queue.submit("628111", "mau tanya")
+        queue.submit("628222", "pagi")
+        await asyncio.sleep(0.02)
+        queue.submit("628111", "jadwal ujian")
+        self.assertEqual(batches, [])
+
+        await asyncio.sleep(0.15)
+        await queue.stop()
+
+        self.assertIn(("628111", ["halo", "mau tanya", "jadwal ujian"]), batches)
+        self.assertIn(("628222", ["pagi"]), batches)
+        self.assertEqual(queue.stats()['batches'], 2)
+
+    async def test_max_delay_caps_debounce(self):
+        """Tests that a chat that never goes quiet is still flushed."""
+        batches = []
+
+        async def handler(chat_id, items):
+            batches.append(items)
+
+        queue = IngestQueue(handler, workers=1, window=0.05, max_delay=0.1)
+        queue.start()
+        for i in range(8):
+            queue.submit("628111", i)
+            await asyncio.sleep(0.03)
+        await asyncio.sleep(0.1)
+        await queue.stop()
+
+        self.assertGreater(len(batches), 1)
+        self.assertEqual([i for batch in batches for i in batch], list(range(8)))
+
+
+if __name__ == '__main__':
+    unittest.main()
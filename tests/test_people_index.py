@@ -0,0 +1,164 @@
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from people_index import PeopleIndex, TableIndex, fold_text
+import tools
+from tool_cache import ToolResultCache
+
+SISWA_COLS = ['nama', 'jk', 'nisn', 'nipd', 'rombel_saat_ini', 'tempat_lahir']
+SISWA = [
+    {'nama': 'Ahmad Soekarno', 'jk': 'L', 'nisn': '0071234567', 'nipd': '2122.10.001', 'rombel_saat_ini': 'X 1', 'tempat_lahir': 'Blitar'},
+    {'nama': 'Siti Aminah', 'jk': 'P', 'nisn': '0071234568', 'nipd': '2122.10.002', 'rombel_saat_ini': 'X 1', 'tempat_lahir': 'Kediri'},
+    {'nama': 'Muhammad Rizky Pratama', 'jk': 'L', 'nisn': '0071234569', 'nipd': '2122.10.003', 'rombel_saat_ini': 'X 2', 'tempat_lahir': None},
+    {'nama': 'Djoko Tjahjono', 'jk': 'L', 'nisn': '0071234570', 'nipd': '2122.10.004', 'rombel_saat_ini': 'X 2', 'tempat_lahir': None},
+]
+
+
+def siswa_index() -> TableIndex:
+    index = TableIndex(text_fields=['nama'], id_fields=['nisn', 'nipd'], filter_field='rombel_saat_ini')
+    for row in SISWA:
+        index.add(dict(row))
+    return index
+
+
+def names(rows):
+    return [row['nama'] for row in rows]
+
+
+class TestTableIndex(unittest.TestCase):
+
+    def test_spelling_variants_fold_together(self):
+        """Tests that old and variant Indonesian spellings fold to the same tokens."""
+        self.assertEqual(fold_text("Soekarno"), fold_text("Sukarno"))
+        self.assertEqual(fold_text("Achmad"), fold_text("Akhmad"))
+        self.assertEqual(fold_text("Achmad"), fold_text("Ahmad"))
+        self.assertEqual(fold_text("Mochammad Rizky"), fold_text("Muhammad Rizki"))
+        self.assertEqual(fold_text("Djoko Tjahjono"), fold_text("Joko Cahyono"))
+
+    def test_ranked_fuzzy_search(self):
+        """Tests that names match across spellings and typos, best first, and unrelated names do not."""
+        index = siswa_index()
+
+        self.assertEqual(names(index.search("sukarno")), ['Ahmad Soekarno'])
+        self.assertEqual(names(index.search("joko cahyono")), ['Djoko Tjahjono'])
+        self.assertEqual(names(index.search("mochamad rizki")), ['Muhammad Rizky Pratama'])
+        self.assertEqual(names(index.search("amina")), ['Siti Aminah'])
+        self.assertEqual(names(index.search("siti aminah pratama"))[0], 'Siti Aminah')
+        self.assertEqual(index.search("budi santoso"), [])
+
+    def test_identifiers_and_filter(self):
+        """Tests that NISN/NIPD match exactly (never fuzzily) and the rombel filter narrows or lists."""
+        index = siswa_index()
+
+        self.assertEqual(names(index.search("0071234568")), ['Siti Aminah'])
+        self.assertEqual(names(index.search("2122.10.004")), ['Djoko Tjahjono'])
+        self.assertEqual(index.search("0071234999"), [])
+        self.assertEqual(names(index.search(None, "x  2")), ['Muhammad Rizky Pratama', 'Djoko Tjahjono'])
+        self.assertEqual(names(index.search("ahmad", "X 2")), [])
+
+    def test_update_in_place(self):
+        """Tests that an UPDATE is applied to the matching rows and their index entries."""
+        index = siswa_index()
+
+        self.assertEqual(index.update({'nama': 'Budi Santoso', 'rombel_saat_ini': 'XI 1'}, {'nisn': '0071234567'}), 1)
+
+        self.assertEqual(index.search("sukarno"), [])
+        self.assertEqual(names(index.search("budi")), ['Budi Santoso'])
+        self.assertEqual(names(index.search(None, "xi 1")), ['Budi Santoso'])
+        self.assertEqual(index.update({'nama': 'x'}, {'tempat_lahir': 'Malang'}), 0)
+
+
+class TestPeopleIndex(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        patcher = patch('people_index.database', new=MagicMock())
+        self.db = patcher.start()
+        self.addCleanup(patcher.stop)
+        self.db.DatabaseError = Exception
+        self.db.execute_sql_query = AsyncMock(side_effect=lambda pool, sql: [dict(row) for row in SISWA])
+        self.index = PeopleIndex({'siswa': SISWA_COLS}, enabled=True, refresh_interval=600, min_score=0.6, max_results=1)
+
+    async def test_loads_once_and_limits_results(self):
+        """Tests that the table is loaded on first use only, and text searches return at most max_results rows with the full total."""
+        rows, total = await self.index.search('siswa', "a", None)
+        self.assertEqual((len(rows), total), (1, 2))
+        rows, total = await self.index.search('siswa', None, None, filter_value="X 2")
+        self.assertEqual((len(rows), total), (2, 2))
+        self.assertEqual(await self.index.count('siswa', None, None, filter_value="X 1"), 2)
+
+        self.db.execute_sql_query.assert_awaited_once()
+        self.assertIn("`tempat_lahir`", self.db.execute_sql_query.call_args.args[1])
+        self.assertEqual(self.index.stats()['rows'], {'siswa': 4})
+
+    async def test_writes_update_the_index(self):
+        """Tests that writes through the tools show up without a reload, including writes during a reload."""
+        await self.index.search('siswa', None, None)
+        self.index.record_update('siswa', {'nama': 'Siti Nurhaliza'}, {'nisn': '0071234568'})
+        self.index.record_insert('siswa', {'nama': 'Dewi Lestari', 'nisn': '0081111111', 'rombel_saat_ini': 'X 1'})
+
+        self.assertEqual(names((await self.index.search('siswa', "nurhaliza", None))[0]), ['Siti Nurhaliza'])
+        self.assertEqual(await self.index.count('siswa', None, None, filter_value="X 1"), 3)
+
+        # A write landing while the reload reads the table is replayed onto the new rows
+        self.index.invalidate('siswa')
+
+        async def reading(pool, sql):
+            self.index.record_update('siswa', {'rombel_saat_ini': 'XII 3'}, {'nipd': '2122.10.001'})
+            return [dict(row) for row in SISWA]
+        self.db.execute_sql_query.side_effect = reading
+        self.assertEqual(names((await self.index.search('siswa', None, None, filter_value="xii 3"))[0]), ['Ahmad Soekarno'])
+        self.assertEqual(self.index.stats()['reloads'], 2)
+
+    async def test_unavailable_index_falls_back(self):
+        """Tests that a failed load makes the tools query MySQL with LIKE, and is not retried on every search."""
+        self.db.execute_sql_query.side_effect = Exception("no such column")
+
+        self.assertIsNone(await self.index.search('siswa', "ani", None))
+        self.assertIsNone(await self.index.search('siswa', "ani", None))
+        self.db.execute_sql_query.assert_awaited_once()
+        self.assertEqual(self.index.stats()['fallbacks'], 2)
+
+        with patch.object(tools, 'search_index', self.index), patch.object(tools, 'tool_cache', ToolResultCache(ttl=0)), \
+                patch('tools.execute_sql_query', new_callable=AsyncMock, return_value=[{'total': 3}]) as sql:
+            self.assertEqual(await tools.search_siswa({'rombel_saat_ini': 'X 1', 'aggregate': 'count'}, None), ([{'total': 3}], 1))
+        self.assertIn("COUNT(*)", sql.call_args.args[1])
+
+
+class TestToolsUseIndex(unittest.IsolatedAsyncioTestCase):
+
+    async def test_tool_results_from_index(self):
+        """Tests that db_siswa_tool and db_gukar_tool answer from the index, in the columns the SQL would return."""
+        index = MagicMock()
+        index.search = AsyncMock(return_value=([dict(SISWA[0], nip='198001012005011001', mengajar='Matematika', no_hp='08123')], 1))
+        index.count = AsyncMock(return_value=7)
+
+        with patch.object(tools, 'search_index', index), patch.object(tools, 'tool_cache', ToolResultCache(ttl=0)), \
+                patch('tools.execute_sql_query', new_callable=AsyncMock) as sql:
+            siswa, _ = await tools.search_siswa({'search_term': 'sukarno'}, None)
+            total, _ = await tools.search_siswa({'search_term': 'ahmad', 'rombel_saat_ini': 'X 1', 'aggregate': 'count'}, None)
+            gukar, _ = await tools.search_gukar({'search_term': 'ahmad', 'columns': ['nama', 'no_hp', 'nik']}, None)
+
+        sql.assert_not_called()
+        self.assertEqual(list(siswa[0]), tools.SISWA_RESULT_COLS)
+        self.assertEqual(total, [{'total': 7}])
+        index.count.assert_awaited_once_with('siswa', 'ahmad', None, filter_value='X 1')
+        self.assertEqual(gukar, [{'nama': 'Ahmad Soekarno', 'no_hp': '08123'}])
+
+    async def test_capped_results_report_truncation(self):
+        """Tests that a capped search tells the model how many rows matched in all."""
+        index = MagicMock()
+        index.search = AsyncMock(side_effect=[([dict(SISWA[0])] * 2, 30), ([dict(SISWA[1])], 1)])
+
+        with patch.object(tools, 'search_index', index), patch.object(tools, 'tool_cache', ToolResultCache(ttl=0)):
+            capped = await tools._handle_db_siswa_tool({'search_term': 'a'}, None)
+            whole = await tools._handle_db_siswa_tool({'search_term': 'siti'}, None)
+
+        self.assertEqual((capped.function_response.response['total'], capped.function_response.response['truncated']), (30, True))
+        self.assertNotIn('truncated', whole.function_response.response)
+
+if __name__ == '__main__':
+    unittest.main()
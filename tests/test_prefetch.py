@@ -0,0 +1,99 @@
+import asyncio
+import unittest
+from unittest.mock import patch
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from google.genai import types
+
+import tools
+from prefetch import LookupPrefetcher, detect_identifiers
+
+
+def user_text(text: str) -> types.Content:
+    return types.Content(role="user", parts=[types.Part.from_text(text=text)])
+
+
+class TestDetectIdentifiers(unittest.TestCase):
+
+    def test_detects_nisn_nip_and_nipd(self):
+        """Tests that NISN, spaced NIP and named NIPD numbers map to the right lookup."""
+        text = "cek nisn 0071234567, guru NIP 19800101 200501 1 001 dan NIPD: 2122.10.001."
+        self.assertEqual(detect_identifiers(text), [
+            ("db_siswa_tool", "0071234567"),
+            ("db_gukar_tool", "198001012005011001"),
+            ("db_siswa_tool", "2122.10.001"),
+        ])
+
+    def test_ignores_other_numbers(self):
+        """Tests that phone numbers and digits inside a NIP are not taken for a NISN."""
+        self.assertEqual(detect_identifiers("hubungi 081234567890"), [])
+        self.assertEqual(detect_identifiers("198001012005011001"), [("db_gukar_tool", "198001012005011001")])
+
+
+class TestLookupPrefetcher(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.executed = []
+
+        async def run_lookup(tool_call):
+            self.executed.append((tool_call.name, tool_call.args['search_term']))
+            return types.Part.from_function_response(name=tool_call.name, response={'result': "[{'nama': 'Ani'}]"})
+
+        self.prefetcher = LookupPrefetcher(run_lookup)
+
+    async def test_ready_results_injected(self):
+        """Tests that finished lookups go into the prompt and count a saved round."""
+        prefetch = self.prefetcher.start(user_text("data nisn 0071234567 dong"))
+        part = await prefetch.context_part(wait=1)
+        prefetch.first_round_done([])
+        prefetch.close()
+
+        self.assertIn("db_siswa_tool(search_term='0071234567')", part.text)
+        self.assertIn("Ani", part.text)
+        stats = self.prefetcher.stats()
+        self.assertEqual((stats['injected_turns'], stats['rounds_saved'], stats['hit_rate']), (1, 1, 1.0))
+
+    async def test_matching_tool_call_served(self):
+        """Tests that a tool call for the prefetched lookup is answered without querying again."""
+        prefetch = self.prefetcher.start(user_text("nisn 0071234567"))
+        calls = [
+            types.FunctionCall(name="db_siswa_tool", args={'search_term': '0071234567'}, id="call_1"),
+            types.FunctionCall(name="db_siswa_tool", args={'search_term': '0071234567', 'aggregate': 'count'}),
+        ]
+
+        async def fake_handle(tool_call, db_pool, client):
+            return types.Part.from_function_response(name=tool_call.name, response={'result': 'queried'})
+
+        with patch('tools.handle_tool_call', side_effect=fake_handle) as handle:
+            parts = await tools.handle_tool_calls(calls, None, None, prefetched=prefetch.take)
+        prefetch.close()
+
+        self.assertEqual(parts[0].function_response.response, {'result': "[{'nama': 'Ani'}]"})
+        self.assertEqual(parts[0].function_response.id, "call_1")
+        self.assertEqual(parts[1].function_response.response, {'result': 'queried'})
+        handle.assert_called_once()
+        self.assertEqual(self.executed, [("db_siswa_tool", "0071234567")])
+        self.assertEqual(self.prefetcher.stats()['served_tool_calls'], 1)
+
+    async def test_unused_lookups_cancelled(self):
+        """Tests that lookups still running when the turn ends are cancelled and counted unused."""
+        started = asyncio.Event()
+
+        async def slow_lookup(tool_call):
+            started.set()
+            await asyncio.sleep(10)
+
+        prefetcher = LookupPrefetcher(slow_lookup)
+        prefetch = prefetcher.start(user_text("nisn 0071234567"))
+        await started.wait()
+        self.assertIsNone(await prefetch.context_part(wait=0))
+        prefetch.close()
+
+        self.assertEqual(prefetcher.stats()['unused'], 1)
+        self.assertIsNone(prefetcher.start(user_text("halo")))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+from unittest.mock import patch
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from rate_limiter import TokenBucketRateLimiter
+
+
+class TestTokenBucketRateLimiter(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = patch('rate_limiter.time.monotonic', side_effect=lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_per_chat_limit_and_refill(self):
+        """Tests that a chat is limited after its burst and refills over time."""
+        limiter = TokenBucketRateLimiter(capacity=3, window=60)
+        results = [await limiter.is_limited("628111") for _ in range(4)]
+        self.assertEqual(results, [False, False, False, True])
+
+        # Another chat is unaffected
+        self.assertFalse(await limiter.is_limited("628222"))
+
+        # One token comes back every 20 seconds
+        self.now += 20
+        self.assertFalse(await limiter.is_limited("628111"))
+        self.assertTrue(await limiter.is_limited("628111"))
+        self.assertEqual(limiter.stats()['rejected_chat'], 2)
+
+    async def test_global_limit(self):
+        """Tests that the global bucket caps traffic across chats."""
+        limiter = TokenBucketRateLimiter(capacity=5, window=60, global_capacity=2)
+        self.assertFalse(await limiter.is_limited("a"))
+        self.assertFalse(await limiter.is_limited("b"))
+        self.assertTrue(await limiter.is_limited("c"))
+        self.assertEqual(limiter.stats()['rejected_global'], 1)
+
+    async def test_idle_buckets_are_evicted(self):
+        """Tests that buckets idle for a full window are dropped."""
+        limiter = TokenBucketRateLimiter(capacity=2, window=60)
+        await limiter.is_limited("a")
+        await limiter.is_limited("b")
+        self.now += 61
+        await limiter.is_limited("c")
+
+        stats = limiter.stats()
+        self.assertEqual(stats['tracked_chats'], 1)
+        self.assertEqual(stats['evicted'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
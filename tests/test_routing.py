@@ -0,0 +1,58 @@
+import unittest
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from google.genai import types
+
+from routing import HEAVY, LIGHT, TurnRouter
+
+
+def user_text(text: str) -> types.Content:
+    return types.Content(role="user", parts=[types.Part.from_text(text=text)])
+
+
+class TestTurnRouter(unittest.TestCase):
+
+    def setUp(self):
+        self.router = TurnRouter(light_max_chars=50, heavy_keywords=['nisn', 'ijazah'])
+
+    def test_short_text_goes_light(self):
+        """Tests that a short text-only turn is routed to the light model."""
+        self.assertEqual(self.router.route(user_text("Halo, selamat pagi")), (LIGHT, 'short_text'))
+
+    def test_media_long_text_and_keywords_go_heavy(self):
+        """Tests that media, long text and tool keywords are routed to the heavy model."""
+        photo = types.Content(role="user", parts=[
+            types.Part.from_uri(file_uri="https://files/ijazah.jpg", mime_type="image/jpeg"),
+        ])
+        self.assertEqual(self.router.route(photo), (HEAVY, 'media'))
+        self.assertEqual(self.router.route(user_text("a" * 51)), (HEAVY, 'long_text'))
+        self.assertEqual(self.router.route(user_text("cek NISN saya")), (HEAVY, 'keyword'))
+        # Keywords match whole words only
+        self.assertEqual(self.router.route(user_text("nisnya belum ada")), (LIGHT, 'short_text'))
+
+    def test_heavy_without_light_model(self):
+        """Tests that every turn is heavy when no light model is configured."""
+        self.assertEqual(self.router.route(user_text("halo"), light_available=False), (HEAVY, 'no_light_model'))
+
+    def test_stats_per_route(self):
+        """Tests that decisions, escalations and call latencies are reported per route."""
+        self.router.route(user_text("halo"))
+        self.router.route(user_text("cek nisn"))
+        self.router.record(LIGHT, 0.2)
+        self.router.record(LIGHT, 0.4)
+        self.router.record(HEAVY, 2.0)
+        self.router.escalate()
+
+        stats = self.router.stats()
+        self.assertEqual(stats['routes'][LIGHT]['turns'], 1)
+        self.assertEqual(stats['routes'][LIGHT]['model_calls'], 2)
+        self.assertEqual(stats['routes'][LIGHT]['avg_ms'], 300.0)
+        self.assertEqual(stats['routes'][HEAVY]['reasons'], {'keyword': 1})
+        self.assertEqual(stats['routes'][HEAVY]['p95_ms'], 2000.0)
+        self.assertEqual(stats['escalated'], 1)
+
+if __name__ == '__main__':
+    unittest.main()
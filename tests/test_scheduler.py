@@ -0,0 +1,83 @@
+import asyncio
+import unittest
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from scheduler import ADMIN, BATCH, INTERACTIVE, ModelCallScheduler
+
+
+class TestModelCallScheduler(unittest.IsolatedAsyncioTestCase):
+
+    async def run_queued(self, scheduler, requests):
+        """Fills the only slot, queues `requests` (priority, key, label), then returns the service order."""
+        order = []
+        await scheduler.acquire()
+
+        async def call(priority, key, label):
+            async with scheduler.slot(priority, key):
+                order.append(label)
+
+        tasks = [asyncio.create_task(call(*request)) for request in requests]
+        await asyncio.sleep(0)
+        scheduler.release()
+        await asyncio.gather(*tasks)
+        return order
+
+    async def test_concurrency_limit(self):
+        """Tests that no more than max_concurrent calls hold a slot at once."""
+        scheduler = ModelCallScheduler(max_concurrent=2)
+        running = 0
+        peak = 0
+
+        async def call():
+            nonlocal running, peak
+            async with scheduler.slot():
+                running += 1
+                peak = max(peak, running)
+                await asyncio.sleep(0.01)
+                running -= 1
+
+        await asyncio.gather(*(call() for _ in range(6)))
+        self.assertEqual(peak, 2)
+
+    async def test_priority_classes_served_in_order(self):
+        """Tests that interactive replies go before admin work, and admin before batch."""
+        scheduler = ModelCallScheduler(max_concurrent=1)
+        order = await self.run_queued(scheduler, [
+            (BATCH, 'memory', 'batch'),
+            (ADMIN, 'a', 'admin'),
+            (INTERACTIVE, 'b', 'reply'),
+        ])
+        self.assertEqual(order, ['reply', 'admin', 'batch'])
+
+    async def test_busy_chat_does_not_starve_others(self):
+        """Tests that chats take turns instead of one chat's backlog going first."""
+        scheduler = ModelCallScheduler(max_concurrent=1)
+        order = await self.run_queued(scheduler, [
+            (INTERACTIVE, 'busy', 'busy-1'),
+            (INTERACTIVE, 'busy', 'busy-2'),
+            (INTERACTIVE, 'busy', 'busy-3'),
+            (INTERACTIVE, 'quiet', 'quiet-1'),
+        ])
+        self.assertEqual(order.index('quiet-1'), 1)
+
+    async def test_cancelled_waiter_frees_its_place(self):
+        """Tests that a caller giving up while queued does not leak a slot."""
+        scheduler = ModelCallScheduler(max_concurrent=1)
+        await scheduler.acquire()
+        waiter = asyncio.create_task(scheduler.acquire(key='gone'))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        scheduler.release()
+
+        await asyncio.wait_for(scheduler.acquire(), timeout=1)
+        stats = scheduler.stats()
+        self.assertEqual(stats['active'], 1)
+        self.assertEqual(stats['classes'][INTERACTIVE]['queued'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from google.genai import types
+
+from token_counter import TokenCounter
+
+
+def text(role: str, value: str) -> types.Content:
+    return types.Content(role=role, parts=[types.Part.from_text(text=value)])
+
+
+class TestTokenCounter(unittest.TestCase):
+
+    def setUp(self):
+        self.counter = TokenCounter(context_limit=lambda model: 1000, output_reserve=200,
+                                    prices={'priced-model': (0.30, 2.50)})
+
+    def test_request_within_budget_untouched(self):
+        """Tests that a prompt that fits is sent as it is."""
+        contents = [text("user", "halo"), text("model", "hai")]
+        self.assertIs(self.counter.fit("m", contents, system_instruction="prompt"), contents)
+        self.assertEqual(self.counter.stats()['trimmed_requests'], 0)
+
+    def test_oldest_turns_dropped(self):
+        """Tests that whole old turns are dropped, keeping tool calls with their results and the last turn."""
+        call = types.Content(role="model", parts=[types.Part.from_function_call(name="db_siswa_tool", args={"q": "x" * 800})])
+        result = types.Content(role="tool", parts=[types.Part.from_function_response(name="db_siswa_tool", response={"result": "y" * 800})])
+        contents = [
+            text("user", "a" * 1600), text("model", "b" * 400),
+            text("user", "cari ani"), call, result, text("model", "ketemu"),
+            text("user", "terima kasih"),
+        ]
+
+        fitted = self.counter.fit("m", contents)
+
+        self.assertEqual(fitted, contents[2:])
+        self.assertEqual(self.counter.stats()['dropped_contents'], 2)
+
+        # The last turn is kept even when it alone is over budget
+        self.assertEqual(self.counter.fit("m", [text("user", "a" * 8000)])[0].parts[0].text, "a" * 8000)
+
+    def test_usage_and_cost(self):
+        """Tests that reported usage is read back, with thinking tokens as output, and priced per model."""
+        response = types.GenerateContentResponse(usage_metadata=types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=10000, candidates_token_count=1500, thoughts_token_count=500, cached_content_token_count=8000,
+        ))
+
+        self.assertEqual(self.counter.usage(response, 'priced-model'),
+                         {'prompt_tokens': 10000, 'output_tokens': 2000, 'cached_tokens': 8000, 'cost': 0.008})
+        self.assertIsNone(self.counter.usage(response, 'other-model')['cost'])
+        self.assertIsNone(self.counter.usage(types.GenerateContentResponse(), 'priced-model'))
+        self.assertEqual(self.counter.stats()['output_tokens'], 4000)
+
+if __name__ == '__main__':
+    unittest.main()
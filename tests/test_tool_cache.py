@@ -0,0 +1,89 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, patch
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import tools
+from tool_cache import ToolResultCache, cache_key
+
+
+class TestToolResultCache(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.cache = ToolResultCache(ttl=60, max_entries=10)
+        self.load = AsyncMock(return_value=[{'total': 36}])
+
+    async def test_hit_on_normalized_arguments(self):
+        """Tests that the same lookup written differently is answered from the cache."""
+        args = {'rombel_saat_ini': 'X 1', 'aggregate': 'count'}
+
+        self.assertEqual(await self.cache.get('db_siswa_tool', args, 'siswa', self.load), [{'total': 36}])
+        self.assertEqual(await self.cache.get('db_siswa_tool', {'aggregate': 'COUNT', 'rombel_saat_ini': ' x  1'}, 'siswa', self.load),
+                         [{'total': 36}])
+
+        self.load.assert_awaited_once()
+        self.assertNotEqual(cache_key('db_siswa_tool', args), cache_key('db_gukar_tool', args))
+        self.assertEqual(self.cache.stats()['hit_rate'], 0.5)
+
+    async def test_concurrent_lookups_share_one_load(self):
+        """Tests that identical lookups in flight together make one round trip, even if the first caller gives up."""
+        release = asyncio.Event()
+
+        async def slow():
+            await release.wait()
+            return [{'nama': 'Budi'}]
+        load = AsyncMock(side_effect=slow)
+
+        first = asyncio.ensure_future(self.cache.get('db_gukar_tool', {'search_term': 'budi'}, 'gukar', load))
+        others = [asyncio.ensure_future(self.cache.get('db_gukar_tool', {'search_term': 'Budi'}, 'gukar', load)) for _ in range(3)]
+        await asyncio.sleep(0)
+        first.cancel()
+        release.set()
+
+        self.assertEqual(await asyncio.gather(*others), [[{'nama': 'Budi'}]] * 3)
+        load.assert_awaited_once()
+        self.assertEqual(self.cache.stats()['shared'], 3)
+
+    async def test_errors_reach_every_caller_and_are_not_cached(self):
+        """Tests that a failed load fails all callers sharing it, and the next lookup loads again."""
+        self.load.side_effect = [ValueError("down"), [{'total': 1}]]
+
+        with self.assertRaises(ValueError):
+            await self.cache.get('db_siswa_tool', {'search_term': 'ani'}, 'siswa', self.load)
+        self.assertEqual(await self.cache.get('db_siswa_tool', {'search_term': 'ani'}, 'siswa', self.load), [{'total': 1}])
+
+    async def test_write_invalidates_its_table(self):
+        """Tests that a write drops its table's results, including a lookup that was running during it."""
+        await self.cache.get('db_gukar_tool', {'search_term': 'budi'}, 'gukar', self.load)
+        await self.cache.get('db_siswa_tool', {'search_term': 'ani'}, 'siswa', self.load)
+
+        async def write_during_load():
+            self.cache.invalidate('siswa')
+            return [{'nama': 'Ani (old)'}]
+        self.cache.invalidate('siswa')
+        await self.cache.get('db_siswa_tool', {'search_term': 'ani'}, 'siswa', AsyncMock(side_effect=write_during_load))
+
+        self.assertEqual(self.cache.stats()['entries'], 1)
+        await self.cache.get('db_gukar_tool', {'search_term': 'budi'}, 'gukar', self.load)
+        self.assertEqual(self.load.await_count, 2)
+
+    @patch('tools.save_audit_log', new_callable=AsyncMock)
+    @patch('tools.execute_sql_query', new_callable=AsyncMock)
+    async def test_update_tool_invalidates_reads(self, mock_execute_sql, mock_audit):
+        """Tests that db_siswa_tool reads again after db_update_tool changed siswa."""
+        mock_execute_sql.return_value = [{'nama': 'Ani', 'nisn': '001'}]
+        with patch.object(tools.search_index, 'enabled', False), patch.object(tools, 'tool_cache', self.cache):
+            await tools._handle_db_siswa_tool({'search_term': 'ani'}, None)
+            await tools._handle_db_siswa_tool({'search_term': 'ani'}, None)
+            self.assertEqual(mock_execute_sql.await_count, 1)
+
+            await tools._handle_db_update_tool(
+                {'table_name': 'siswa', 'updates': {'nama': 'Ani Lestari'}, 'where_clause': {'nisn': '001'}}, None)
+            await tools._handle_db_siswa_tool({'search_term': 'ani'}, None)
+        self.assertEqual(mock_execute_sql.await_count, 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -8,6 +8,7 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 from google.genai import types
 import tools
+from tool_cache import ToolResultCache
 
 class TestTools(unittest.IsolatedAsyncioTestCase):
 
@@ -15,6 +16,13 @@ class TestTools(unittest.IsolatedAsyncioTestCase):
         """Set up reusable mocks."""
         self.mock_db_pool = AsyncMock()
         self.mock_genai_client = MagicMock()
+        # These cover the SQL path; the search index and the result cache have their own tests
+        patcher = patch.object(tools.search_index, 'enabled', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(tools, 'tool_cache', ToolResultCache(ttl=0))
+        patcher.start()
+        self.addCleanup(patcher.stop)
 
     @patch('tools.execute_sql_query', new_callable=AsyncMock)
     async def test_handle_db_gukar_tool_success(self, mock_execute_sql):
@@ -178,5 +186,74 @@ class TestTools(unittest.IsolatedAsyncioTestCase):
         self.assertEqual(result_part.function_response.response['result'], "files/fake_uri")
 
 
+class TestHandleToolCalls(unittest.IsolatedAsyncioTestCase):
+
+    async def test_independent_calls_run_concurrently_in_order(self):
+        """Tests that read-only tools overlap, respect the cap, and keep call order."""
+        running = 0
+        peak = 0
+
+        async def fake_handle(tool_call, db_pool, client):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.05)
+            running -= 1
+            return types.Part.from_function_response(name=tool_call.name, response={'result': tool_call.args['q']})
+
+        calls = [types.FunctionCall(name="db_siswa_tool", args={'q': str(i)}, id=f"call_{i}") for i in range(5)]
+        with patch('tools.handle_tool_call', side_effect=fake_handle):
+            parts = await tools.handle_tool_calls(calls, None, None, concurrency=3)
+
+        self.assertEqual(peak, 3)
+        self.assertEqual([p.function_response.response['result'] for p in parts], ['0', '1', '2', '3', '4'])
+        self.assertEqual(parts[4].function_response.id, "call_4")
+
+    async def test_write_tools_run_one_at_a_time(self):
+        """Tests that tools with side effects never overlap each other."""
+        running = 0
+        peak = 0
+
+        async def fake_handle(tool_call, db_pool, client):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.02)
+            running -= 1
+            return types.Part.from_function_response(name=tool_call.name, response={'result': 'ok'})
+
+        calls = [types.FunctionCall(name="db_update_tool", args={}) for _ in range(3)]
+        with patch('tools.handle_tool_call', side_effect=fake_handle):
+            await tools.handle_tool_calls(calls, None, None, concurrency=3)
+
+        self.assertEqual(peak, 1)
+
+    async def test_writes_are_barriers(self):
+        """Tests that reads after a write see it, while reads between writes still run together."""
+        log = []
+
+        async def fake_handle(tool_call, db_pool, client):
+            log.append(('start', tool_call.args['q']))
+            await asyncio.sleep(0.02 if tool_call.name == "db_update_tool" else 0.01)
+            log.append(('end', tool_call.args['q']))
+            return types.Part.from_function_response(name=tool_call.name, response={'result': tool_call.args['q']})
+
+        calls = [
+            types.FunctionCall(name="db_siswa_tool", args={'q': 'r1'}),
+            types.FunctionCall(name="db_update_tool", args={'q': 'w'}),
+            types.FunctionCall(name="db_siswa_tool", args={'q': 'r2'}),
+            types.FunctionCall(name="db_gukar_tool", args={'q': 'r3'}),
+        ]
+        prefetched = MagicMock(return_value=None)
+        with patch('tools.handle_tool_call', side_effect=fake_handle):
+            parts = await tools.handle_tool_calls(calls, None, None, prefetched=prefetched)
+
+        self.assertEqual([p.function_response.response['result'] for p in parts], ['r1', 'w', 'r2', 'r3'])
+        self.assertEqual(log, [('start', 'r1'), ('end', 'r1'), ('start', 'w'), ('end', 'w'),
+                               ('start', 'r2'), ('start', 'r3'), ('end', 'r2'), ('end', 'r3')])
+        # Lookups prefetched before the write would be stale after it
+        self.assertEqual([c.args[0].args['q'] for c in prefetched.call_args_list], ['r1'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -6,7 +6,7 @@ import sys
 import os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from utils import content_to_dict, _create_parts_from_dict, _create_error_response
+from utils import content_to_dict, _create_parts_from_dict, _create_error_response, trim_history, estimate_tokens
 
 class TestUtils(unittest.TestCase):
 
@@ -58,5 +58,54 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(recreated_parts[1].function_call.name, original_content.parts[1].function_call.name)
         self.assertEqual(recreated_parts[1].function_call.args, original_content.parts[1].function_call.args)
 
+def text_row(user_text, bot_text):
+    return ({"role": "user", "parts": [{"type": "text", "text": user_text}]},
+            {"role": "model", "parts": [{"type": "text", "text": bot_text}]})
+
+def tool_rows():
+    call = ({"role": "user", "parts": [{"type": "text", "text": "cari siswa"}]},
+            {"role": "model", "parts": [{"type": "function_call", "name": "db_siswa_tool", "arguments": {"q": "Ani"}}]})
+    result = ({"role": "tool", "parts": [{"type": "function_response", "name": "db_siswa_tool", "response": {"result": "Ani"}}]},
+              {"role": "model", "parts": [{"type": "text", "text": "Ketemu: Ani"}]})
+    return [call, result]
+
+
+class TestTrimHistory(unittest.TestCase):
+
+    def test_keeps_newest_rows_within_budget(self):
+        """Tests that the oldest rows are dropped first once the budget is exceeded."""
+        rows = [text_row("a" * 400, "b" * 400), text_row("halo", "hai")]
+        budget = estimate_tokens(rows[1][0]) + estimate_tokens(rows[1][1])
+
+        self.assertEqual(trim_history(rows, budget), rows[1:])
+        self.assertEqual(trim_history(rows, None), rows)
+
+    def test_function_call_and_response_kept_together(self):
+        """Tests that a tool call is dropped together with its result, never alone."""
+        rows = tool_rows() + [text_row("terima kasih", "sama-sama")]
+        last_cost = estimate_tokens(rows[2][0]) + estimate_tokens(rows[2][1])
+        result_cost = estimate_tokens(rows[1][0]) + estimate_tokens(rows[1][1])
+
+        # Room for the tool result row but not for its call: both go.
+        self.assertEqual(trim_history(rows, last_cost + result_cost), rows[2:])
+
+    def test_orphaned_parts_removed(self):
+        """Tests that a result without its call, and a call without its result, are dropped."""
+        call, result = tool_rows()
+        trimmed = trim_history([result, text_row("halo", "hai"), call])
+
+        self.assertEqual(trimmed[0], text_row("halo", "hai"))
+        self.assertEqual(trimmed[1][1]['parts'], [])
+
+    def test_unanswered_call_in_the_middle_removed(self):
+        """Tests that a call without a result is dropped from older rows too, not only the newest."""
+        call, result = tool_rows()
+        rows = [call, text_row("halo", "hai"), call, result]
+        trimmed = trim_history(rows)
+
+        self.assertEqual(trimmed[0][1]['parts'], [])
+        self.assertEqual(trimmed[1:], rows[1:])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,134 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from google.genai import types
+
+import wa
+from admission import AdmissionController
+from deadline import MODEL, TOOLS, Deadline, StageStats
+
+
+def model_response(text=None, calls=()):
+    parts = [types.Part.from_text(text=text)] if text else []
+    parts += [types.Part.from_function_call(name=name, args=args) for name, args in calls]
+    response = MagicMock(usage_metadata=None)
+    response.candidates = [MagicMock(content=types.Content(role="model", parts=parts))]
+    return response
+
+
+def tool_result(name):
+    return types.Part.from_function_response(name=name, response={'result': "[]"})
+
+
+class TestGenerateAIResponse(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.service = MagicMock()
+        self.service.generate_content = AsyncMock()
+        self.patchers = [
+            patch.object(wa.ai_settings_cache, 'get', new=AsyncMock(return_value=(None, self.service))),
+            patch('wa.database.save_chat_to_db', new_callable=AsyncMock),
+            patch('wa.whatsapp_service.send_whatsapp_message', new_callable=AsyncMock),
+            patch('wa.tools.handle_tool_calls', new_callable=AsyncMock),
+            patch.object(wa.provider_registry, 'genai_client', new=MagicMock()),
+            patch('wa.config.AI_STREAM_RESPONSES', False),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.app = {'websockets': [], 'admission': AdmissionController()}
+        self.content = types.Content(role="user", parts=[types.Part.from_text(text="cari siswa ani")])
+
+    def saved_bots(self):
+        return [call.args[3] for call in wa.database.save_chat_to_db.await_args_list]
+
+    async def test_round_limit_saves_reply_without_unrun_calls(self):
+        """Tests that the reply stopped by AI_MAX_TOOL_ROUNDS is saved without the calls that never ran."""
+        wa.tools.handle_tool_calls.return_value = [tool_result('db_siswa_tool')]
+        self.service.generate_content.side_effect = [
+            model_response(calls=[('db_siswa_tool', {'search_term': 'ani'})]),
+            model_response("Sebentar, saya cek lagi.", calls=[('db_siswa_tool', {'search_term': 'ani l'})]),
+        ]
+
+        with patch('wa.config.AI_MAX_TOOL_ROUNDS', 1):
+            await wa.generate_ai_response(self.content, "628111", self.app, None)
+
+        first, last = self.saved_bots()
+        self.assertTrue(first.parts[0].function_call)
+        self.assertEqual([part.text for part in last.parts], ["Sebentar, saya cek lagi."])
+        wa.tools.handle_tool_calls.assert_awaited_once()
+        self.assertIn("terlalu banyak langkah", wa.whatsapp_service.send_whatsapp_message.await_args.args[1])
+
+    async def test_tool_timeout_saves_error_results(self):
+        """Tests that calls cut off by the tool stage timeout get error results in the history."""
+        async def hang(*args, **kwargs):
+            await asyncio.sleep(10)
+        wa.tools.handle_tool_calls.side_effect = hang
+        self.service.generate_content.return_value = model_response(calls=[('db_siswa_tool', {'search_term': 'ani'})])
+
+        deadline = Deadline(60, caps={TOOLS: 0.05}, stats=StageStats())
+        await wa.generate_ai_response(self.content, "628111", self.app, None, deadline=deadline)
+
+        (_, _, _, call_bot), (_, _, result_user, result_bot) = \
+            [call.args for call in wa.database.save_chat_to_db.await_args_list]
+        self.assertEqual(call_bot.parts[0].function_call.name, 'db_siswa_tool')
+        self.assertEqual(result_user['parts'][0]['type'], 'function_response')
+        self.assertEqual(result_user['parts'][0]['name'], 'db_siswa_tool')
+        self.assertEqual(result_bot.parts, [])
+
+    async def test_model_timeout_keeps_streamed_text(self):
+        """Tests that text streamed before a model timeout is sent and saved before the fallback reply."""
+        async def stream(contents, on_text, **kwargs):
+            await on_text("Data siswa Ani:")
+            await asyncio.sleep(10)
+        self.service.generate_content_stream = stream
+
+        deadline = Deadline(60, caps={MODEL: 0.05}, stats=StageStats())
+        with patch('wa.config.AI_STREAM_RESPONSES', True):
+            await wa.generate_ai_response(self.content, "628111", self.app, None, deadline=deadline)
+
+        sent = [call.args[1] for call in wa.whatsapp_service.send_whatsapp_message.await_args_list]
+        self.assertEqual(sent, ["Data siswa Ani:", wa.config.DEADLINE_FALLBACK_REPLY])
+        self.assertEqual([part.text for part in self.saved_bots()[0].parts], ["Data siswa Ani:"])
+
+
+class TestPrepareWhatsAppMessage(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.patchers = [
+            patch.object(wa.rate_limiter, 'is_limited', new=AsyncMock(return_value=False)),
+            patch('wa.database.check_auto_reply', new=AsyncMock(return_value=None)),
+            patch('wa.database.get_control_status', new=AsyncMock(return_value='admin')),
+            patch('wa.database.save_chat_to_db', new_callable=AsyncMock),
+            patch('wa.whatsapp_service.send_whatsapp_message', new_callable=AsyncMock),
+            patch('wa.whatsapp_service._process_media', new=AsyncMock(return_value=None)),
+            patch.object(wa.provider_registry, 'genai_client', new=MagicMock()),
+            patch.object(wa.fast_path, 'answer', new=AsyncMock(return_value=('cek_nomor_siswa', "*Ani*"))),
+        ]
+        for patcher in self.patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.message = {'id': 'w1', 'from': '628111', 'type': 'text', 'text': {'body': 'cek nisn 0071234567'}}
+
+    async def test_admin_controlled_chat_gets_no_automatic_answer(self):
+        """Tests that a chat an admin has taken over is not answered by the fast path or an FAQ, and the message goes on to the admin."""
+        faq_cache = MagicMock()
+        faq_cache.match = AsyncMock(return_value=(1, "Jam 07.00."))
+        parts, _ = await wa.prepare_whatsapp_message(self.message, {'faq_cache': faq_cache})
+
+        self.assertEqual(parts[0].text, 'cek nisn 0071234567')
+        wa.fast_path.answer.assert_not_awaited()
+        faq_cache.match.assert_not_awaited()
+        wa.whatsapp_service.send_whatsapp_message.assert_not_awaited()
+
+        wa.database.get_control_status.return_value = 'bot'
+        self.assertIsNone(await wa.prepare_whatsapp_message(self.message, {}))
+        wa.whatsapp_service.send_whatsapp_message.assert_awaited_once()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import sys
+import os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import whatsapp_service
+from deadline import MEDIA_UPLOAD, Deadline, StageStats, StageTimeout
+from whatsapp_service import MessageStreamer, _upload_to_google, split_message
+
+
+class TestSplitMessage(unittest.TestCase):
+
+    def test_short_text_is_one_chunk(self):
+        self.assertEqual(split_message("  halo  "), ["halo"])
+
+    def test_long_text_split_at_paragraphs_within_limit(self):
+        """Tests that long text is cut at paragraph breaks and every chunk fits the limit."""
+        text = "\n\n".join(["a" * 30, "b" * 30, "c" * 30])
+        chunks = split_message(text, limit=70)
+
+        self.assertEqual(chunks, ["a" * 30 + "\n\n" + "b" * 30, "c" * 30])
+
+    def test_unbreakable_text_is_hard_split(self):
+        chunks = split_message("x" * 25, limit=10)
+        self.assertEqual([len(c) for c in chunks], [10, 10, 5])
+
+
+class TestMessageStreamer(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        patcher = patch.object(whatsapp_service, 'send_whatsapp_message', new_callable=AsyncMock)
+        self.mock_send = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def sent_texts(self):
+        return [call.args[1] for call in self.mock_send.call_args_list]
+
+    async def test_paragraphs_sent_as_they_finish(self):
+        """Tests that a finished paragraph is sent before the stream ends, in order."""
+        streamer = MessageStreamer("628111", {}, min_chars=5)
+        await streamer.feed("Paragraf pertama.")
+        self.mock_send.assert_not_called()
+
+        await streamer.feed("\n\nParagraf ")
+        self.assertEqual(self.sent_texts(), ["Paragraf pertama."])
+
+        await streamer.feed("kedua.")
+        await streamer.finish()
+        self.assertEqual(self.sent_texts(), ["Paragraf pertama.", "Paragraf kedua."])
+
+    async def test_short_paragraphs_held_until_min_chars(self):
+        """Tests that short paragraphs are merged instead of sent one by one."""
+        streamer = MessageStreamer("628111", {}, min_chars=50)
+        await streamer.feed("Satu.\n\nDua.\n\nTiga.")
+        await streamer.finish()
+
+        self.assertEqual(self.sent_texts(), ["Satu.\n\nDua.\n\nTiga."])
+
+    async def test_buffer_never_exceeds_limit(self):
+        """Tests that text without paragraph breaks is sent in chunks within the limit."""
+        streamer = MessageStreamer("628111", {}, min_chars=5, limit=20)
+        for _ in range(10):
+            await streamer.feed("kata ")
+        await streamer.finish()
+
+        self.assertTrue(all(len(text) <= 20 for text in self.sent_texts()))
+        self.assertEqual(" ".join(self.sent_texts()).split(), ["kata"] * 10)
+
+
+
+class TestUploadToGoogle(unittest.IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        patcher = patch.object(whatsapp_service, 'UPLOAD_POLL_INTERVAL', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = MagicMock()
+        self.client.aio.files.upload = AsyncMock(return_value=SimpleNamespace(name="files/1", state="PROCESSING", uri=None))
+
+    async def test_waits_until_active(self):
+        self.client.aio.files.get = AsyncMock(side_effect=[
+            SimpleNamespace(name="files/1", state="PROCESSING", uri=None),
+            SimpleNamespace(name="files/1", state="ACTIVE", uri="https://files/1"),
+        ])
+        self.assertEqual(await _upload_to_google(self.client, "/tmp/x.jpg"), "https://files/1")
+
+    async def test_failed_file_stops_polling(self):
+        """Tests that a file Google failed to process ends the wait instead of polling forever."""
+        self.client.aio.files.get = AsyncMock(return_value=SimpleNamespace(name="files/1", state="FAILED", uri=None))
+        self.assertIsNone(await _upload_to_google(self.client, "/tmp/x.jpg"))
+        self.client.aio.files.get.assert_awaited_once()
+
+    async def test_stuck_processing_cut_by_stage_cap(self):
+        """Tests that polling a file that never becomes ACTIVE is cancelled by the upload stage cap."""
+        self.client.aio.files.get = AsyncMock(return_value=SimpleNamespace(name="files/1", state="PROCESSING", uri=None))
+        deadline = Deadline(60, caps={MEDIA_UPLOAD: 0.05}, stats=StageStats())
+
+        with self.assertRaises(StageTimeout):
+            await deadline.run(MEDIA_UPLOAD, _upload_to_google(self.client, "/tmp/x.jpg"))
+
+
+if __name__ == '__main__':
+    unittest.main()
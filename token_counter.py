@@ -0,0 +1,140 @@
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import config
+from utils import CHARS_PER_TOKEN, estimate_content_tokens
+
+# Estimated tokens per tool set: tuple of tool ids -> (tools, tokens)
+MAX_ESTIMATED_TOOL_SETS = 32
+
+
+def _starts_turn(content: Any) -> bool:
+    # A turn starts at a user message; tool results belong to the call before them
+    if content.role != "user":
+        return False
+    parts = content.parts if isinstance(content.parts, list) else [content.parts] if content.parts else []
+    return not any(getattr(part, 'function_response', None) for part in parts)
+
+
+class TokenCounter:
+    """
+    Local token estimates for requests about to be sent, and the actual
+    usage reported back by the providers.
+
+    fit() is called by every provider before a request goes out: if the
+    estimated prompt (system instruction, tools and contents) does not fit
+    the model's context window minus `output_reserve`, whole turns are
+    dropped from the front until it does, so the request is trimmed here
+    instead of being rejected by the API. The last turn is always kept.
+    """
+
+    def __init__(self, context_limit: Callable[[Optional[str]], int] = None, output_reserve: int = None,
+                 prices: Optional[Dict[str, Tuple[float, float]]] = None):
+        self._context_limit = context_limit or config.get_context_token_limit
+        self._output_reserve = config.CONTEXT_OUTPUT_RESERVE if output_reserve is None else output_reserve
+        self._prices = config.TOKEN_PRICES if prices is None else prices
+        self._tool_tokens: Dict[Tuple[int, ...], Tuple[List[Any], int]] = {}
+
+        # Metrics
+        self.requests = 0
+        self.trimmed_requests = 0
+        self.dropped_contents = 0
+        self.max_fill = 0.0
+        self.estimated_prompt_tokens = 0
+        self.reported_responses = 0
+        self.prompt_tokens = 0
+        self.output_tokens = 0
+        self.cost = 0.0
+
+    def _estimate_tools(self, tools: Optional[List[Any]]) -> int:
+        if not tools:
+            return 0
+        # The tool set is the same module-level objects on every call
+        key = tuple(id(tool) for tool in tools)
+        cached = self._tool_tokens.get(key)
+        if cached is not None and all(a is b for a, b in zip(cached[0], tools)):
+            return cached[1]
+        chars = 0
+        for tool in tools:
+            dump = tool.model_dump_json(exclude_none=True) if hasattr(tool, 'model_dump_json') else json.dumps(tool, default=str)
+            chars += len(dump)
+        tokens = chars // CHARS_PER_TOKEN + 1
+        if len(self._tool_tokens) >= MAX_ESTIMATED_TOOL_SETS:
+            self._tool_tokens.clear()
+        self._tool_tokens[key] = (list(tools), tokens)
+        return tokens
+
+    def fit(self, model_name: Optional[str], contents: List[Any], system_instruction: Optional[str] = None,
+            tools: Optional[List[Any]] = None) -> List[Any]:
+        """Returns `contents`, without its oldest turns if the request would not fit the model's context window."""
+        budget = self._context_limit(model_name) - self._output_reserve
+        prefix = len(system_instruction or "") // CHARS_PER_TOKEN + self._estimate_tools(tools)
+        sizes = [estimate_content_tokens(content) for content in contents]
+        total = prefix + sum(sizes)
+
+        self.requests += 1
+        self.estimated_prompt_tokens += total
+        self.max_fill = max(self.max_fill, total / budget if budget > 0 else 1.0)
+        if total <= budget:
+            return contents
+
+        starts = [i for i, content in enumerate(contents) if _starts_turn(content)]
+        start = 0
+        for turn_start in starts[1:]:
+            if total <= budget:
+                break
+            total -= sum(sizes[start:turn_start])
+            start = turn_start
+        self.trimmed_requests += 1
+        self.dropped_contents += start
+        logging.warning(
+            f"Prompt for {model_name} over its {budget}-token budget; dropped the {start} oldest content(s), "
+            f"~{total} tokens left."
+        )
+        return contents[start:]
+
+    def usage(self, response: Any, model_name: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        The token usage a response reports, as stored per turn: prompt,
+        output and cached tokens, and the cost when the model is priced.
+        None if the provider reported no usage.
+        """
+        metadata = getattr(response, 'usage_metadata', None)
+        if metadata is None or getattr(metadata, 'prompt_token_count', None) is None:
+            return None
+        prompt_tokens = metadata.prompt_token_count or 0
+        # Thinking tokens are billed as output
+        output_tokens = (getattr(metadata, 'candidates_token_count', None) or 0) + (getattr(metadata, 'thoughts_token_count', None) or 0)
+        cached_tokens = getattr(metadata, 'cached_content_token_count', None) or 0
+
+        # Cached tokens are priced as ordinary input, so the cost is an upper bound
+        cost = None
+        prices = self._prices.get(model_name) if model_name else None
+        if prices:
+            input_price, output_price = prices
+            cost = round((prompt_tokens * input_price + output_tokens * output_price) / 1_000_000, 6)
+            self.cost += cost
+
+        self.reported_responses += 1
+        self.prompt_tokens += prompt_tokens
+        self.output_tokens += output_tokens
+        return {
+            'prompt_tokens': prompt_tokens,
+            'output_tokens': output_tokens,
+            'cached_tokens': cached_tokens,
+            'cost': cost,
+        }
+
+    def stats(self) -> dict:
+        return {
+            'requests': self.requests,
+            'trimmed_requests': self.trimmed_requests,
+            'dropped_contents': self.dropped_contents,
+            'max_context_fill': round(self.max_fill, 3),
+            'avg_estimated_prompt_tokens': round(self.estimated_prompt_tokens / self.requests) if self.requests else 0,
+            'avg_prompt_tokens': round(self.prompt_tokens / self.reported_responses) if self.reported_responses else 0,
+            'prompt_tokens': self.prompt_tokens,
+            'output_tokens': self.output_tokens,
+            'cost': round(self.cost, 6),
+        }
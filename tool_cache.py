@@ -0,0 +1,124 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Tuple
+
+import config
+
+
+def _normalize(value: Any) -> Any:
+    # MySQL compares case-insensitively and the index folds case, so
+    # "X 1", "x  1 " and "x 1" are the same lookup
+    if isinstance(value, str):
+        return " ".join(value.lower().split())
+    if isinstance(value, dict):
+        return {key: _normalize(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(item) for item in value]
+    return value
+
+
+def cache_key(tool_name: str, args: Dict) -> Tuple[str, str]:
+    """The cache key of a tool call: its name and its normalized arguments."""
+    return tool_name, json.dumps(_normalize(args), sort_keys=True, default=str)
+
+
+class _Entry:
+    __slots__ = ('table', 'value', 'expires_at')
+
+    def __init__(self, table: str, value: Any, expires_at: float):
+        self.table = table
+        self.value = value
+        self.expires_at = expires_at
+
+
+class ToolResultCache:
+    """
+    TTL cache of read-only tool results (db_siswa_tool, db_gukar_tool),
+    keyed by tool name and normalized arguments.
+
+    Identical lookups that arrive while one is already running wait for
+    it instead of querying again. Writes through db_update_tool and
+    db_insert_tool invalidate every entry of their table, and a lookup
+    that was running when its table was written to is not cached. Edits
+    made outside the bot are visible after at most `ttl` seconds.
+    A `ttl` of 0 disables the cache.
+    """
+
+    def __init__(self, ttl: float = None, max_entries: int = None):
+        self.ttl = config.TOOL_CACHE_TTL if ttl is None else ttl
+        self._max_entries = config.TOOL_CACHE_MAX_ENTRIES if max_entries is None else max_entries
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._in_flight: Dict[Hashable, Tuple[str, asyncio.Future]] = {}
+        # Writes per table, so a lookup that overlapped one is not cached
+        self._writes: Dict[str, int] = {}
+
+        # Metrics
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self.invalidations = 0
+
+    async def get(self, tool_name: str, args: Dict, table: str, load: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the cached result of a tool call, or awaits `load()` for it.
+        Exceptions from `load` reach every caller sharing it and are not cached.
+        """
+        if self.ttl <= 0:
+            return await load()
+        key = cache_key(tool_name, args)
+        entry = self._entries.get(key)
+        if entry is not None and entry.expires_at > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.shared += 1
+            return await asyncio.shield(in_flight[1])
+
+        self.misses += 1
+        # A task of its own, so a caller that gives up does not cancel it for the others
+        task = asyncio.ensure_future(self._load(key, table, load, self._writes.get(table, 0)))
+        task.add_done_callback(lambda t: t.cancelled() or t.exception())
+        self._in_flight[key] = (table, task)
+        return await asyncio.shield(task)
+
+    async def _load(self, key: Hashable, table: str, load: Callable[[], Awaitable[Any]], writes: int) -> Any:
+        try:
+            value = await load()
+        finally:
+            if self._in_flight.get(key, (None, None))[1] is asyncio.current_task():
+                del self._in_flight[key]
+        if self._writes.get(table, 0) == writes:
+            self._store(key, _Entry(table, value, time.monotonic() + self.ttl))
+        return value
+
+    def _store(self, key: Hashable, entry: _Entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self._max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, table: str):
+        """Drops the cached results of `table`, after it was written to."""
+        self._writes[table] = self._writes.get(table, 0) + 1
+        for key in [key for key, entry in self._entries.items() if entry.table == table]:
+            del self._entries[key]
+        # Lookups started before the write are not shared with later callers
+        for key in [key for key, (entry_table, _) in self._in_flight.items() if entry_table == table]:
+            del self._in_flight[key]
+        self.invalidations += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.shared
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'shared': self.shared,
+            'hit_rate': round((self.hits + self.shared) / lookups, 3) if lookups else 0.0,
+            'invalidations': self.invalidations,
+        }
@@ -1,12 +1,15 @@
 import asyncio
+import logging
 import os
 import tempfile
-from typing import Dict
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
 
 import pyautogui
 from google.genai import types
 
 from database import execute_sql_query, save_audit_log, DatabaseError
+from people_index import PeopleIndex
+from tool_cache import ToolResultCache
 from utils import _create_error_response
 
 google_search_tool = types.Tool(
@@ -17,7 +20,7 @@ db_gukar_tool = types.FunctionDeclaration(
     name="db_gukar_tool",
     description="""
         Tool ini digunakan untuk mencari data guru atau karyawan dari database. Gunakan tool ini HANYA untuk query SELECT. 
-        Mendukung pencarian fuzzy (LIKE '%%term%%') pada nama, nip, atau mengajar.
+        Mendukung pencarian fuzzy pada nama atau mengajar (toleran ejaan, mis. Achmad/Ahmad, hasil terbaik di urutan pertama) dan NIP persis.
         Jangan pernah tampilkan data Ibu kandung dan NIK guru.
     """,
     parameters=types.Schema(
@@ -41,7 +44,7 @@ db_siswa_tool = types.FunctionDeclaration(
     name="db_siswa_tool",
     description="""
         Gunakan tool ini untuk mencari data siswa atau menghitung jumlah siswa berdasarkan nama, NISN, NIPD, atau rombel_saat_ini (kelas).
-        Mendukung pencarian fuzzy pada nama. Hasil agregasi (count) bisa diminta.
+        Mendukung pencarian fuzzy pada nama (toleran ejaan, mis. Soekarno/Sukarno, hasil terbaik di urutan pertama). Hasil agregasi (count) bisa diminta.
     """,
     parameters=types.Schema(
         type="OBJECT",
@@ -169,42 +172,40 @@ ALLOWED_COLUMNS = {
     "siswa": {"select": SISWA_ALLOWED_COLS, "update": SISWA_UPDATE_ALLOWED_COLS},
 }
 
+# What db_siswa_tool returns per student
+SISWA_RESULT_COLS = ["nama", "jk", "nisn", "nipd", "rombel_saat_ini"]
 
-async def _handle_db_gukar_tool(args: Dict, db_pool) -> types.Part:
-    tool_name = "db_gukar_tool"
-    search_term = args.get("search_term")
+# Holds every whitelisted column, so any allowed WHERE clause can be applied in memory
+search_index = PeopleIndex({"siswa": SISWA_ALLOWED_COLS, "gukar": GUKAR_ALLOWED_COLS})
+tool_cache = ToolResultCache()
+
+
+def _gukar_columns(args: Dict) -> List[str]:
     cols = args.get("columns", ["nama", "nip", "mengajar"])
-    
     safe_cols = [c for c in cols if c in GUKAR_ALLOWED_COLS]
-    if not safe_cols:
-        safe_cols = ["nama", "nip", "mengajar"]
-    
-    col_str = ", ".join([f"`{c}`" for c in safe_cols])
+    return safe_cols or ["nama", "nip", "mengajar"]
+
+def build_gukar_query(args: Dict) -> Tuple[str, tuple]:
+    """The SELECT behind db_gukar_tool, as (sql, params)."""
+    search_term = args.get("search_term")
+    col_str = ", ".join([f"`{c}`" for c in _gukar_columns(args)])
     sql_query = f"SELECT {col_str} FROM `gukar` WHERE `nama` LIKE %s OR `nip` = %s OR `mengajar` LIKE %s"
     params = (f"%{search_term}%", search_term, f"%{search_term}%")
-    
-    try:
-        query_result = await execute_sql_query(db_pool, sql_query, params=params)
-        return types.Part.from_function_response(
-            name=tool_name,
-            response={'result': str(query_result)},
-        )
-    except DatabaseError as e:
-        return _create_error_response(tool_name, f"Error executing database operation: {e}")
+    return sql_query, params
 
-async def _handle_db_siswa_tool(args: Dict, db_pool) -> types.Part:
-    tool_name = "db_siswa_tool"
+def build_siswa_query(args: Dict) -> Tuple[str, tuple]:
+    """The SELECT behind db_siswa_tool, as (sql, params). Raises ValueError without a filter."""
     search_term = args.get("search_term")
     rombel_saat_ini = args.get("rombel_saat_ini")
     aggregate = args.get("aggregate")
 
     if not search_term and not rombel_saat_ini:
-        return _create_error_response(tool_name, "Missing required arguments: search_term or rombel_saat_ini")
+        raise ValueError("Missing required arguments: search_term or rombel_saat_ini")
 
     if aggregate and aggregate.lower() == 'count':
         base_query = "SELECT COUNT(*) as total FROM siswa"
     else:
-        base_query = "SELECT nama, jk, nisn, nipd, rombel_saat_ini FROM siswa"
+        base_query = f"SELECT {', '.join(SISWA_RESULT_COLS)} FROM siswa"
     
     conditions = []
     params = []
@@ -221,13 +222,78 @@ async def _handle_db_siswa_tool(args: Dict, db_pool) -> types.Part:
         sql_query = f"{base_query} WHERE {' AND '.join(conditions)}"
     else:
         sql_query = base_query
+    return sql_query, tuple(params)
+
+async def search_gukar(args: Dict, db_pool) -> Tuple[List[dict], int]:
+    """
+    (rows, total): the rows db_gukar_tool answers with, from the search
+    index (ranked, spelling-tolerant, at most SEARCH_MAX_RESULTS) or, when
+    it is unavailable, from a LIKE query, and how many rows matched in all.
+    Results are cached in tool_cache. Raises DatabaseError.
+    """
+    return await tool_cache.get("db_gukar_tool", args, "gukar", lambda: _search_gukar(args, db_pool))
+
+async def _search_gukar(args: Dict, db_pool) -> Tuple[List[dict], int]:
+    found = await search_index.search("gukar", args.get("search_term"), db_pool)
+    if found is None:
+        sql_query, params = build_gukar_query(args)
+        rows = await execute_sql_query(db_pool, sql_query, params=params)
+        return rows, len(rows)
+    rows, total = found
+    return [{c: row.get(c) for c in _gukar_columns(args)} for row in rows], total
+
+async def search_siswa(args: Dict, db_pool) -> Tuple[List[dict], int]:
+    """Like search_gukar, for db_siswa_tool. Raises ValueError without a filter, and DatabaseError."""
+    build_siswa_query(args)
+    return await tool_cache.get("db_siswa_tool", args, "siswa", lambda: _search_siswa(args, db_pool))
+
+async def _search_siswa(args: Dict, db_pool) -> Tuple[List[dict], int]:
+    sql_query, params = build_siswa_query(args)
+    search_term = args.get("search_term")
+    rombel_saat_ini = args.get("rombel_saat_ini")
+    aggregate = args.get("aggregate")
+
+    if aggregate and aggregate.lower() == 'count':
+        total = await search_index.count("siswa", search_term, db_pool, filter_value=rombel_saat_ini)
+        if total is not None:
+            return [{'total': total}], 1
+    else:
+        found = await search_index.search("siswa", search_term, db_pool, filter_value=rombel_saat_ini)
+        if found is not None:
+            rows, total = found
+            return [{c: row.get(c) for c in SISWA_RESULT_COLS} for row in rows], total
+    rows = await execute_sql_query(db_pool, sql_query, params=params)
+    return rows, len(rows)
+
+def _search_response(rows: List[dict], total: int) -> Dict:
+    # Tell the model when rows were left out, so it does not present them as all
+    response = {'result': str(rows)}
+    if total > len(rows):
+        response.update(total=total, truncated=True)
+    return response
+
+async def _handle_db_gukar_tool(args: Dict, db_pool) -> types.Part:
+    tool_name = "db_gukar_tool"
 
     try:
-        query_result = await execute_sql_query(db_pool, sql_query, params=tuple(params))
+        rows, total = await search_gukar(args, db_pool)
         return types.Part.from_function_response(
             name=tool_name,
-            response={'result': str(query_result)},
+            response=_search_response(rows, total),
+        )
+    except DatabaseError as e:
+        return _create_error_response(tool_name, f"Error executing database operation: {e}")
+
+async def _handle_db_siswa_tool(args: Dict, db_pool) -> types.Part:
+    tool_name = "db_siswa_tool"
+    try:
+        rows, total = await search_siswa(args, db_pool)
+        return types.Part.from_function_response(
+            name=tool_name,
+            response=_search_response(rows, total),
         )
+    except ValueError as e:
+        return _create_error_response(tool_name, str(e))
     except DatabaseError as e:
         return _create_error_response(tool_name, f"Error executing database operation: {e}")
 
@@ -266,6 +332,8 @@ async def _handle_db_update_tool(args: Dict, db_pool) -> types.Part:
     sql_query = f"UPDATE `{table_name}` SET {', '.join(set_parts)} WHERE {' AND '.join(where_parts)}"
     try:
         query_result = await execute_sql_query(db_pool, sql_query, params=tuple(params))
+        search_index.record_update(table_name, updates, where_clause)
+        tool_cache.invalidate(table_name)
         # Audit log
         await save_audit_log(db_pool, table_name, "UPDATE", details=f"SET {updates} WHERE {where_clause}")
         return types.Part.from_function_response(
@@ -300,6 +368,8 @@ async def _handle_db_insert_tool(args: Dict, db_pool) -> types.Part:
     sql_query = f"INSERT INTO `{table_name}` ({column_str}) VALUES ({placeholders})"
     try:
         query_result = await execute_sql_query(db_pool, sql_query, params=tuple(vals))
+        search_index.record_insert(table_name, data)
+        tool_cache.invalidate(table_name)
         # Audit log
         await save_audit_log(db_pool, table_name, "INSERT", details=f"DATA {data}")
         return types.Part.from_function_response(
@@ -340,11 +410,12 @@ async def _handle_cctv_tool(args: Dict) -> types.Part:
 
 async def _handle_ss_tool(args: Dict, client) -> types.Part:
     try:
-        screenshot = pyautogui.screenshot()
+        # Screenshot capture and upload block, keep them off the event loop
+        screenshot = await asyncio.to_thread(pyautogui.screenshot)
         with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
             screenshot.save(tmp_file.name)
             temp_file_path = tmp_file.name
-        uploaded_file = client.files.upload(file=temp_file_path)
+        uploaded_file = await asyncio.to_thread(client.files.upload, file=temp_file_path)
         os.unlink(temp_file_path)
         
         return types.Part.from_function_response(
@@ -357,6 +428,53 @@ async def _handle_ss_tool(args: Dict, client) -> types.Part:
             response={"result": f"Error: {e}"}
         )
 
+# Tools with side effects; each runs alone, after every call the model made before it
+SERIAL_TOOLS = {"db_update_tool", "db_insert_tool", "ss_tool"}
+
+async def handle_tool_calls(tool_calls: List[types.FunctionCall], db_pool, client, concurrency: int = 4,
+                            prefetched: Optional[Callable[[types.FunctionCall], Optional[Awaitable[types.Part]]]] = None) -> List[types.Part]:
+    """
+    Runs the function calls of one model response and returns the
+    responses in call order. Each tool with side effects is a barrier: it
+    starts once the calls before it are done, and the calls after it start
+    once it is done. Runs of read-only calls between them run
+    concurrently, at most `concurrency` at a time.
+
+    `prefetched(tool_call)` may return an already running lookup for the
+    call (see prefetch.py), which is awaited instead of running the tool.
+    Prefetched lookups are not used after a write in the same round.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(tool_call: types.FunctionCall, allow_prefetched: bool) -> types.Part:
+        pending = prefetched(tool_call) if prefetched and allow_prefetched else None
+        if pending is not None:
+            logging.info(f"Answering tool: {tool_call.name} with args: {tool_call.args} from prefetched lookup")
+            part = await pending
+        else:
+            async with semaphore:
+                logging.info(f"Executing tool: {tool_call.name} with args: {tool_call.args}")
+                part = await handle_tool_call(tool_call, db_pool, client)
+        # Pass back the ID for OpenAI/OpenRouter compatibility
+        if getattr(tool_call, 'id', None):
+            part.function_response.id = tool_call.id
+        return part
+
+    parts: List[types.Part] = []
+    reads: List[types.FunctionCall] = []
+    wrote = False
+    for tool_call in tool_calls + [None]:
+        if tool_call is not None and tool_call.name not in SERIAL_TOOLS:
+            reads.append(tool_call)
+            continue
+        if reads:
+            parts.extend(await asyncio.gather(*(run(read, not wrote) for read in reads)))
+            reads = []
+        if tool_call is not None:
+            parts.append(await run(tool_call, False))
+            wrote = True
+    return parts
+
 async def handle_tool_call(tool_call: types.FunctionCall, db_pool, client) -> types.Part:
     tool_name = tool_call.name
     args = tool_call.args
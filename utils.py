@@ -1,5 +1,5 @@
 import json
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
 from google.genai import types
 
 def content_to_dict(content: types.Content) -> dict:
@@ -33,6 +33,83 @@ def _create_parts_from_dict(parts_list: List[Dict]) -> List[types.Part]:
         if part.get('type')  # Skip parts without a type (e.g. local_media)
     ]
 
+# Rough token cost of a stored part: ~4 characters per token for text and
+# JSON, a flat cost for media (what Gemini charges for one image).
+CHARS_PER_TOKEN = 4
+MEDIA_PART_TOKENS = 258
+
+def estimate_tokens(content_dict: dict) -> int:
+    """Estimates the prompt tokens of a stored content dict without calling a tokenizer."""
+    chars = 0
+    media = 0
+    for part in content_dict.get('parts', []):
+        part_type = part.get('type')
+        if part_type == 'text':
+            chars += len(part.get('text') or '')
+        elif part_type == 'FileData':
+            media += 1
+        elif part_type == 'function_call':
+            chars += len(part.get('name', '')) + len(json.dumps(part.get('arguments'), default=str))
+        elif part_type == 'function_response':
+            chars += len(part.get('name', '')) + len(json.dumps(part.get('response'), default=str))
+    return chars // CHARS_PER_TOKEN + 1 + media * MEDIA_PART_TOKENS
+
+def estimate_content_tokens(content) -> int:
+    """Like estimate_tokens, for a types.Content (or Gemini-shaped) object about to be sent."""
+    chars = 0
+    media = 0
+    parts = content.parts if isinstance(content.parts, list) else [content.parts] if content.parts else []
+    for part in parts:
+        if getattr(part, 'text', None):
+            chars += len(part.text)
+        elif getattr(part, 'file_data', None) or getattr(part, 'inline_data', None):
+            media += 1
+        elif getattr(part, 'function_call', None):
+            chars += len(part.function_call.name or '') + len(json.dumps(part.function_call.args, default=str))
+        elif getattr(part, 'function_response', None):
+            chars += len(part.function_response.name or '') + len(json.dumps(part.function_response.response, default=str))
+    return chars // CHARS_PER_TOKEN + 1 + media * MEDIA_PART_TOKENS
+
+def _has_part(content_dict: dict, part_type: str) -> bool:
+    return any(part.get('type') == part_type for part in content_dict.get('parts', []))
+
+def trim_history(rows: List[Tuple[dict, dict]], token_budget: Optional[int] = None) -> List[Tuple[dict, dict]]:
+    """
+    Keeps the newest (user, bot) rows of a chat that fit in `token_budget`.
+
+    Rows are grouped into turns: a row whose user side is a tool result
+    belongs to the turn of the function call before it. Whole turns are
+    kept or dropped, so a function_call is never separated from its
+    function_response. Tool results whose call is not in `rows` are
+    dropped, and so are calls that never got a result.
+    """
+    turns = []
+    for user, bot in rows:
+        if _has_part(user, 'function_response'):
+            if turns:
+                turns[-1].append((user, bot))
+            continue
+        turns.append([(user, bot)])
+
+    # Only the last row of a turn can hold calls without a result: any
+    # other row is followed by its tool result row
+    for turn in turns:
+        user, bot = turn[-1]
+        if _has_part(bot, 'function_call'):
+            parts = [part for part in bot.get('parts', []) if part.get('type') != 'function_call']
+            turn[-1] = (user, dict(bot, parts=parts))
+
+    kept = []
+    used = 0
+    for turn in reversed(turns):
+        cost = sum(estimate_tokens(user) + estimate_tokens(bot) for user, bot in turn)
+        if token_budget is not None and used + cost > token_budget:
+            break
+        used += cost
+        kept.append(turn)
+
+    return [row for turn in reversed(kept) for row in turn]
+
 def _create_error_response(tool_name: str, message: str) -> types.Part:
     """Helper function to create a function response for errors."""
     return types.Part.from_function_response(
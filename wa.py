@@ -12,42 +12,101 @@ import aiomysql
 from google import genai
 from google.genai import types
 from google.genai.types import GenerateContentConfig
-from typing import Optional, List
+from typing import Optional, List, Tuple
 import pathlib
-from collections import defaultdict
 
 # Import dari modul-modul yang telah dibuat
 import config
 import database
 import tools
 import whatsapp_service
-from utils import content_to_dict
-from ai_service import AIService
+from utils import content_to_dict, _create_error_response
+from ai_service import ActiveSettingCache, model_scheduler, provider_health, provider_registry, token_counter
+from scheduler import ADMIN, BATCH
+from deadline import MEDIA_FETCH, MEDIA_UPLOAD, MODEL, TOOLS, Deadline, StageTimeout, stage_stats
+from routing import HEAVY, LIGHT, TurnRouter
+from ingest_queue import IngestQueue
+from dedupe import MessageDeduplicator
+from chat_memory import ConversationCompactor
+from fast_path import FastPathRouter, enabled_intents
+from faq_cache import APPROVED, PENDING, FaqAnswerCache
+from prefetch import LookupPrefetcher, PrefetchedLookups
+from admission import AdmissionController
+from rate_limiter import TokenBucketRateLimiter
 
 # --- Variabel Global ---
 db_pool = None
-ai_service = None
+ai_settings_cache = ActiveSettingCache(check_interval=config.AI_SETTINGS_CHECK_INTERVAL)
+lookup_prefetcher = LookupPrefetcher(
+    lambda tool_call: tools.handle_tool_call(tool_call, db_pool, None),
+    max_lookups=config.PREFETCH_MAX_LOOKUPS,
+)
+fast_path = FastPathRouter(enabled_intents(config.FAST_PATH_INTENTS), enabled=config.FAST_PATH_ENABLED)
+turn_router = TurnRouter(light_max_chars=config.ROUTE_LIGHT_MAX_CHARS, heavy_keywords=config.ROUTE_HEAVY_KEYWORDS)
+deduplicator = MessageDeduplicator(
+    ttl=config.DEDUPE_TTL,
+    max_entries=config.DEDUPE_MAX_ENTRIES,
+    retention_hours=config.DEDUPE_RETENTION_HOURS,
+)
 logging.basicConfig(level=logging.INFO)
 BASE_DIR = pathlib.Path(__file__).parent
 TEMPLATES_DIR = BASE_DIR / 'templates'
 
 # --- Rate Limiter ---
-rate_limit_store = defaultdict(list)
+rate_limiter = TokenBucketRateLimiter(
+    capacity=config.RATE_LIMIT_MAX,
+    window=config.RATE_LIMIT_WINDOW,
+    global_capacity=config.RATE_LIMIT_GLOBAL_MAX,
+)
+
+def message_deadline(received_at: Optional[float] = None) -> Deadline:
+    """The time budget for a message that arrived at `received_at` (time.monotonic(); default now)."""
+    return Deadline(
+        config.MESSAGE_DEADLINE,
+        caps={
+            MEDIA_FETCH: config.MEDIA_FETCH_TIMEOUT,
+            MEDIA_UPLOAD: config.MEDIA_UPLOAD_TIMEOUT,
+            MODEL: config.AI_ROUND_TIMEOUT,
+            TOOLS: config.AI_TOOLS_TIMEOUT,
+        },
+        started_at=received_at,
+    )
 
-def check_rate_limit(chat_id: str) -> bool:
-    """Returns True if the user is rate-limited."""
-    now = time.time()
-    window = config.RATE_LIMIT_WINDOW
-    max_requests = config.RATE_LIMIT_MAX
-    
-    # Clean old entries
-    rate_limit_store[chat_id] = [t for t in rate_limit_store[chat_id] if now - t < window]
-    
-    if len(rate_limit_store[chat_id]) >= max_requests:
-        return True
-    
-    rate_limit_store[chat_id].append(now)
-    return False
+async def send_fallback_reply(chat_id: str, error: StageTimeout):
+    """Tells the user their message ran out of time instead of leaving them without an answer."""
+    stage_stats.fallback_replies += 1
+    logging.error(f"Message from {chat_id} ran out of time in the {error.stage} stage: {error}")
+    await whatsapp_service.send_whatsapp_message(chat_id, config.DEADLINE_FALLBACK_REPLY, config.get_whatsapp_config())
+
+async def save_interrupted_turn(chat_id: str, user_dict: Optional[dict], pending_calls: List[types.FunctionCall],
+                                partial_text: str = ""):
+    """
+    Saves what a turn stopped by its deadline leaves unsaved, so the
+    history never holds a function call without its result: the results
+    of calls that ran (or an error result for each call that did not),
+    with any text the user already received as the bot side.
+    """
+    if user_dict is None and pending_calls:
+        user_dict = content_to_dict(types.Content(role="tool", parts=[
+            _create_error_response(call.name, "stopped by the message deadline") for call in pending_calls
+        ]))
+    if user_dict is None or not (pending_calls or partial_text):
+        return
+    parts = [types.Part.from_text(text=partial_text)] if partial_text else []
+    try:
+        await database.save_chat_to_db(db_pool, chat_id, user_dict, types.Content(role="model", parts=parts))
+    except database.DatabaseError as e:
+        logging.warning(f"Could not save the interrupted turn of {chat_id}: {e}")
+
+# --- AI Turn Metrics ---
+turn_stats = {
+    'turns': 0,
+    'tool_rounds': 0,
+    'max_rounds_reached': 0,
+    'deadline_exceeded': 0,
+    'model_ms_total': 0.0,
+    'tool_ms_total': 0.0,
+}
 
 # --- WebSocket Helper ---
 async def broadcast_to_websockets(app, message: dict):
@@ -67,201 +126,433 @@ def check_auth(request) -> bool:
     return session.get('authenticated', False)
 
 # --- Logika Inti Bot ---
-async def generate_ai_response(content: types.Content, chat_id: str, app: web.Application, user_message_dict: dict, chat_history: Optional[List[types.Content]] = None):
-    """Generates an AI response and handles potential tool calls."""
-    global db_pool, ai_service
+async def load_chat_history(chat_id: str) -> Tuple[Optional[str], Optional[List[types.Content]]]:
+    """
+    Loads a chat's conversation memory: the stored summary of compacted
+    turns, and the newer turns that fit the active model's token budget.
+    """
+    active_setting, _ = await ai_settings_cache.get(db_pool)
+    model_name = active_setting.get('model_name') if active_setting else None
+    summary, last_history_id = await database.get_chat_summary(db_pool, chat_id)
+    history = await database.get_chat_history_from_db(
+        db_pool, chat_id,
+        max_rows=config.HISTORY_MAX_ROWS,
+        token_budget=config.get_history_token_budget(model_name),
+        after_id=last_history_id,
+    )
+    return summary, history
+
+async def generate_ai_response(content: types.Content, chat_id: str, app: web.Application, user_message_dict: dict, chat_history: Optional[List[types.Content]] = None,
+                               memory: Optional[str] = None, prefetch: Optional[PrefetchedLookups] = None,
+                               deadline: Optional[Deadline] = None):
+    """
+    Generates an AI response and handles potential tool calls.
+
+    Each round calls the model once; if it asks for tools, they run in
+    order, reads concurrently between writes (see tools.handle_tool_calls),
+    and their results go back to the model in the next round. The turn
+    stops after AI_MAX_TOOL_ROUNDS tool rounds, or when a model or tool
+    stage runs out of the message's `deadline`; the user then gets the
+    fallback reply.
+
+    The turn_router picks the light or heavy model for the turn; a light
+    turn that asks for tools continues on the heavy model.
+
+    `memory` is the chat's rolling summary of older turns; it goes in front
+    of the history, so the system prompt stays the same for every chat (and
+    can be served from the Gemini context cache).
+
+    `prefetch` holds lookups already running for identifiers in the
+    message; finished ones are added to the prompt, and a tool call asking
+    for one of them gets its result instead of querying again.
+    """
+    global db_pool
     wa_config = config.get_whatsapp_config()
-    
-    # Initialize ai_service if not already done
-    if ai_service is None:
-        active_setting = await database.get_active_ai_setting(db_pool)
-        ai_service = AIService(active_setting)
+    loop = asyncio.get_running_loop()
+    deadline = deadline or message_deadline()
+    round_timings = []
+    streamer = None
+    save_user_dict = None
+    # Calls of the last saved reply whose results are not saved yet
+    pending_calls = []
 
     try:
         contents = chat_history + [content] if chat_history else [content]
+        if memory:
+            contents = [types.Content(role="user", parts=[
+                types.Part.from_text(text=f"Ringkasan percakapan sebelumnya dengan user ini:\n{memory}")
+            ])] + contents
         
-        # Determine if we should use tools
-        active_setting = await database.get_active_ai_setting(db_pool)
-        # Tools supported by Gemini, OpenRouter, and OpenAI
-        provider_name = active_setting.get('provider') if active_setting else 'gemini'
-        tools_supported = provider_name in ['gemini', 'openrouter', 'openai']
-        
-        provider_tools = [tools.db_tool, tools.extra_tools] if tools_supported else None
-        system_prompt = active_setting.get('system_prompt') or config.SYSTEM_PROMPT if active_setting else config.SYSTEM_PROMPT
+        active_setting, heavy_service = await ai_settings_cache.get(db_pool)
+        light_setting, light_service = await ai_settings_cache.get(db_pool, LIGHT)
+        route, reason = turn_router.route(content, light_available=light_service is not None)
+        logging.info(f"Routing turn for {chat_id} to the {route} model ({reason}).")
 
-        response = await ai_service.generate_content(
-            contents=contents,
-            system_instruction=system_prompt,
-            tools=provider_tools
-        )
+        system_prompt = active_setting.get('system_prompt') or config.SYSTEM_PROMPT if active_setting else config.SYSTEM_PROMPT
 
-        candidate = response.candidates[0]
-        res_parts = candidate.content.parts
+        lookup_context = None
+        if prefetch:
+            lookup_context = await prefetch.context_part(config.PREFETCH_WAIT)
+            if lookup_context:
+                # Only the model sees the lookup results; the stored message stays as sent
+                contents[-1] = types.Content(role="user", parts=list(content.parts) + [lookup_context])
 
         save_user_dict = user_message_dict if user_message_dict else content_to_dict(content)
-        await database.save_chat_to_db(db_pool, chat_id, save_user_dict, candidate.content)
-        
-        bot_message_broadcast = {
-            'type': 'new_message',
-            'data': {
-                'chat_id': chat_id,
-                'message': {
-                    'user': None,
-                    'bot': content_to_dict(candidate.content)
+
+        for tool_round in range(config.AI_MAX_TOOL_ROUNDS + 1):
+            round_started = loop.time()
+            route_setting, ai_service = (light_setting, light_service) if route == LIGHT else (active_setting, heavy_service)
+            # Tools supported by Gemini, OpenRouter, and OpenAI
+            provider_name = route_setting.get('provider') if route_setting else 'gemini'
+            tools_supported = provider_name in ['gemini', 'openrouter', 'openai']
+            provider_tools = [tools.db_tool, tools.extra_tools] if tools_supported else None
+
+            streamer = whatsapp_service.MessageStreamer(chat_id, wa_config, min_chars=config.AI_STREAM_MIN_CHARS) if config.AI_STREAM_RESPONSES else None
+            call_info = {}
+            async with app['admission'].track():
+                if streamer:
+                    model_call = ai_service.generate_content_stream(
+                        contents=contents,
+                        on_text=streamer.feed,
+                        system_instruction=system_prompt,
+                        tools=provider_tools,
+                        key=chat_id,
+                        call_info=call_info
+                    )
+                else:
+                    model_call = ai_service.generate_content(
+                        contents=contents,
+                        system_instruction=system_prompt,
+                        tools=provider_tools,
+                        key=chat_id,
+                        call_info=call_info
+                    )
+                response = await deadline.run(MODEL, model_call)
+
+            if streamer:
+                await streamer.finish()
+            model_done = loop.time()
+            turn_router.record(route, model_done - round_started)
+
+            candidate = response.candidates[0]
+            res_parts = candidate.content.parts
+            function_calls = [part.function_call for part in res_parts if part.function_call]
+
+            saved_content = candidate.content
+            if function_calls and tool_round == config.AI_MAX_TOOL_ROUNDS:
+                # These calls never run, so the history keeps the reply without them
+                saved_content = types.Content(role=candidate.content.role, parts=[part for part in res_parts if not part.function_call])
+            await database.save_chat_to_db(db_pool, chat_id, save_user_dict, saved_content, provider=call_info.get('provider'),
+                                           usage=token_counter.usage(response, call_info.get('model')))
+            save_user_dict = None
+            pending_calls = []
+            
+            bot_message_broadcast = {
+                'type': 'new_message',
+                'data': {
+                    'chat_id': chat_id,
+                    'message': {
+                        'user': None,
+                        'bot': content_to_dict(saved_content)
+                    }
                 }
             }
-        }
-        await broadcast_to_websockets(app, bot_message_broadcast)
+            await broadcast_to_websockets(app, bot_message_broadcast)
 
-        response_text = "".join(part.text + "\n" for part in res_parts if part.text)
-        if response_text.strip():
-            await whatsapp_service.send_whatsapp_message(chat_id, response_text.strip(), wa_config)
-        
-        # Handle Function Calls
-        function_calls = [part.function_call for part in res_parts if part.function_call]
-        if function_calls:
-            function_responses = []
-            for fc in function_calls:
-                logging.info(f"Executing tool: {fc.name} with args: {fc.args}")
-                # We still use the global client instance for tool calls if needed, 
-                # but tools.handle_tool_call should be provider-agnostic if possible.
-                # For now, we pass the gemini client as it's the only one using tools.
-                gemini_client = genai.Client(api_key=config.GOOGLE_API_KEY)
-                fc_res_part = await tools.handle_tool_call(fc, db_pool, gemini_client)
-                # Pass back the ID for OpenAI/OpenRouter compatibility
-                if hasattr(fc, 'id') and fc.id:
-                    fc_res_part.function_response.id = fc.id
-                function_responses.append(fc_res_part)
+            if not streamer:
+                response_text = "".join(part.text + "\n" for part in res_parts if part.text)
+                for chunk in whatsapp_service.split_message(response_text):
+                    await whatsapp_service.send_whatsapp_message(chat_id, chunk, wa_config)
             
-            tool_content = types.Content(role="tool", parts=function_responses)
-            await generate_ai_response(tool_content, chat_id, app, {}, chat_history=contents + [candidate.content])
+            # Handle Function Calls
+            if prefetch and tool_round == 0:
+                prefetch.first_round_done(function_calls)
+            if not function_calls:
+                round_timings.append((route, call_info.get('provider'), model_done - round_started, 0.0))
+                if tool_round == 0 and 'faq_cache' in app and len(content.parts) == 1:
+                    # A plain question answered without tools may be worth vetting as an FAQ
+                    await app['faq_cache'].suggest(content.parts[0].text, "".join(part.text for part in res_parts if part.text),
+                                                   had_context=bool(chat_history or memory or lookup_context))
+                break
+            if tool_round == config.AI_MAX_TOOL_ROUNDS:
+                round_timings.append((route, call_info.get('provider'), model_done - round_started, 0.0))
+                turn_stats['max_rounds_reached'] += 1
+                logging.warning(f"Stopping tool loop for {chat_id} after {tool_round} rounds.")
+                await whatsapp_service.send_whatsapp_message(chat_id, "Maaf, permintaan ini membutuhkan terlalu banyak langkah. Coba sederhanakan pertanyaannya.", wa_config)
+                break
+
+            pending_calls = function_calls
+            # Tool calls use the Gemini client (ss_tool uploads screenshots to it)
+            gemini_client = provider_registry.genai_client(config.GOOGLE_API_KEY)
+            function_responses = await deadline.run(TOOLS, tools.handle_tool_calls(
+                function_calls, db_pool, gemini_client, concurrency=config.AI_TOOL_CONCURRENCY,
+                prefetched=prefetch.take if prefetch else None,
+            ))
+            round_timings.append((route, call_info.get('provider'), model_done - round_started, loop.time() - model_done))
+            if route == LIGHT:
+                turn_router.escalate()
+                route = HEAVY
 
+            tool_content = types.Content(role="tool", parts=function_responses)
+            contents = contents + [candidate.content, tool_content]
+            save_user_dict = content_to_dict(tool_content)
+
+    except StageTimeout as e:
+        turn_stats['deadline_exceeded'] += 1
+        partial_text = ""
+        if streamer and e.stage == MODEL:
+            # Text streamed before the cut-off is sent and kept, not dropped
+            await streamer.finish()
+            partial_text = streamer.text.strip()
+        await save_interrupted_turn(chat_id, save_user_dict, pending_calls, partial_text)
+        await send_fallback_reply(chat_id, e)
     except Exception as e:
         logging.exception("Error in generate_ai_response:")
         wa_config = config.get_whatsapp_config()
         await whatsapp_service.send_whatsapp_message(chat_id, "Maaf, terjadi kesalahan saat memproses permintaan Anda.", wa_config)
-
-async def handle_whatsapp_message(message_data: dict, app: web.Application):
-    """Handles incoming WhatsApp messages based on control status."""
+    finally:
+        _record_turn(chat_id, round_timings)
+
+def _record_turn(chat_id: str, round_timings: List[tuple]):
+    """Logs how long each model/tool round of a turn took and updates turn_stats."""
+    if not round_timings:
+        return
+    turn_stats['turns'] += 1
+    turn_stats['tool_rounds'] += len(round_timings) - 1
+    for _, _, model_seconds, tool_seconds in round_timings:
+        turn_stats['model_ms_total'] += model_seconds * 1000
+        turn_stats['tool_ms_total'] += tool_seconds * 1000
+    rounds = ", ".join(f"{r} {p or 'model'} {m * 1000:.0f}ms + tools {t * 1000:.0f}ms" for r, p, m, t in round_timings)
+    logging.info(f"AI turn for {chat_id}: {len(round_timings)} round(s): {rounds}")
+
+async def prepare_whatsapp_message(message_data: dict, app: web.Application, deadline: Optional[Deadline] = None) -> Optional[tuple]:
+    """
+    Handles one incoming message up to the point where the AI would answer.
+
+    Rate limiting, the 'clear' command, auto-replies and cached FAQ answers
+    are answered here.
+    Otherwise returns (parts, ui_parts): the Gemini parts for the model and
+    extra dict parts (local media) that are only stored for the admin UI.
+    Media handling runs within `deadline` and may raise StageTimeout.
+    """
     global db_pool
     recipient_number = message_data['from']
     wa_config = config.get_whatsapp_config()
-    
-    try:
-        # Check rate limit
-        if check_rate_limit(recipient_number):
-            await whatsapp_service.send_whatsapp_message(
-                recipient_number, 
-                "⏳ Anda terlalu sering mengirim pesan. Silakan tunggu sebentar.", 
-                wa_config
-            )
-            return
-
-        control_status = await database.get_control_status(db_pool, recipient_number)
-        
-        parts = []
-        message_text = None
-        local_uri_for_ui = None
-        mime_type_for_ui = None
-        filename_for_ui = None
-
-        if message_data.get('type') == 'text':
-            message_text = message_data.get('text', {}).get('body')
-            if message_text and message_text.strip().lower() == 'clear':
-                media_uris = await database.get_all_media_uris_for_chat(db_pool, recipient_number)
-                await database.delete_chat_history_from_db(db_pool, recipient_number)
-                
-                for uri in media_uris:
-                    try:
-                        file_path = BASE_DIR / uri.lstrip('/')
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                            logging.info(f"Deleted media file: {file_path}")
-                    except Exception as e:
-                        logging.error(f"Error deleting media file {uri}: {e}")
-
-                await whatsapp_service.send_whatsapp_message(recipient_number, "Riwayat percakapan dan media Anda telah berhasil dihapus.", wa_config)
-                return
-            
-            # Check auto-reply rules first
-            if message_text:
-                auto_reply = await database.check_auto_reply(db_pool, message_text)
-                if auto_reply:
-                    await whatsapp_service.send_whatsapp_message(recipient_number, auto_reply, wa_config)
-                    # Save to history
-                    user_dict = {"role": "user", "parts": [{"type": "text", "text": message_text}]}
-                    bot_content = types.Content(role="model", parts=[types.Part.from_text(text=auto_reply)])
-                    await database.save_chat_to_db(db_pool, recipient_number, user_dict, bot_content)
-                    return
-            
-            parts.append(types.Part.from_text(text=message_text))
-
-        media_result = await whatsapp_service._process_media(message_data, genai.Client(api_key=config.GOOGLE_API_KEY), wa_config)
-        if media_result:
-            google_uri, local_uri, mime_type, filename = media_result
-            if google_uri and mime_type:
-                local_uri_for_ui = local_uri
-                mime_type_for_ui = mime_type
-                filename_for_ui = filename
-                media_type = message_data.get('type')
-                caption = message_data.get(media_type, {}).get('caption')
-                if caption:
-                    parts.append(types.Part.from_text(text=caption))
-                else:
-                    parts.append(types.Part.from_text(text="perhatikan ini."))
-                parts.append(types.Part.from_uri(file_uri=google_uri, mime_type=mime_type))
-        
-        if not parts:
-            return
 
-        content = types.Content(role="user", parts=parts)
-        user_message_dict = content_to_dict(content)
-
-        if local_uri_for_ui:
-            user_message_dict['parts'].append({
+    # Check rate limit
+    if await rate_limiter.is_limited(recipient_number):
+        await whatsapp_service.send_whatsapp_message(
+            recipient_number,
+            "⏳ Anda terlalu sering mengirim pesan. Silakan tunggu sebentar.",
+            wa_config
+        )
+        return None
+
+    parts = []
+    ui_parts = []
+    message_text = None
+
+    if message_data.get('type') == 'text':
+        message_text = message_data.get('text', {}).get('body')
+        if _is_clear_command(message_data):
+            media_uris = await database.get_all_media_uris_for_chat(db_pool, recipient_number)
+            await database.delete_chat_history_from_db(db_pool, recipient_number)
+
+            for uri in media_uris:
+                try:
+                    file_path = BASE_DIR / uri.lstrip('/')
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
+                        logging.info(f"Deleted media file: {file_path}")
+                except Exception as e:
+                    logging.error(f"Error deleting media file {uri}: {e}")
+
+            await whatsapp_service.send_whatsapp_message(recipient_number, "Riwayat percakapan dan media Anda telah berhasil dihapus.", wa_config)
+            return None
+
+        # Check auto-reply rules first
+        if message_text:
+            auto_reply = await database.check_auto_reply(db_pool, message_text)
+            if auto_reply:
+                await whatsapp_service.send_whatsapp_message(recipient_number, auto_reply, wa_config)
+                # Save to history
+                user_dict = {"role": "user", "parts": [{"type": "text", "text": message_text}]}
+                bot_content = types.Content(role="model", parts=[types.Part.from_text(text=auto_reply)])
+                await database.save_chat_to_db(db_pool, recipient_number, user_dict, bot_content)
+                return None
+
+        # Chats an admin has taken over get no automatic answers; the admin sees the message
+        admin_controlled = await database.get_control_status(db_pool, recipient_number) == 'admin'
+
+        # Lookup commands are answered straight from the database
+        fast_reply = None if admin_controlled else await fast_path.answer(message_text, db_pool)
+        if fast_reply:
+            intent_name, reply = fast_reply
+            await whatsapp_service.send_whatsapp_message(recipient_number, reply, wa_config)
+            user_dict = {"role": "user", "parts": [{"type": "text", "text": message_text}]}
+            bot_content = types.Content(role="model", parts=[types.Part.from_text(text=reply)])
+            await database.save_chat_to_db(db_pool, recipient_number, user_dict, bot_content, provider=f"fast_path#{intent_name}")
+            return None
+
+        # Then vetted FAQ answers, before paying for a model turn
+        faq = await app['faq_cache'].match(message_text) if 'faq_cache' in app and not admin_controlled else None
+        if faq:
+            entry_id, answer = faq
+            await whatsapp_service.send_whatsapp_message(recipient_number, answer, wa_config)
+            user_dict = {"role": "user", "parts": [{"type": "text", "text": message_text}]}
+            bot_content = types.Content(role="model", parts=[types.Part.from_text(text=answer)])
+            await database.save_chat_to_db(db_pool, recipient_number, user_dict, bot_content, provider=f"faq#{entry_id}")
+            await app['faq_cache'].record_hit(entry_id)
+            return None
+
+        parts.append(types.Part.from_text(text=message_text))
+
+    media_result = await whatsapp_service._process_media(message_data, provider_registry.genai_client(config.GOOGLE_API_KEY), wa_config,
+                                                         deadline=deadline)
+    if media_result:
+        google_uri, local_uri, mime_type, filename = media_result
+        if google_uri and mime_type:
+            media_type = message_data.get('type')
+            caption = message_data.get(media_type, {}).get('caption')
+            if caption:
+                parts.append(types.Part.from_text(text=caption))
+            else:
+                parts.append(types.Part.from_text(text="perhatikan ini."))
+            parts.append(types.Part.from_uri(file_uri=google_uri, mime_type=mime_type))
+            ui_parts.append({
                 'local_media': {
-                    'uri': local_uri_for_ui,
-                    'mime_type': mime_type_for_ui,
-                    'filename': filename_for_ui
+                    'uri': local_uri,
+                    'mime_type': mime_type,
+                    'filename': filename
                 }
             })
 
-        is_new_conversation = not await database.chat_exists(db_pool, recipient_number)
+    if not parts:
+        return None
+    return parts, ui_parts
+
+def _is_clear_command(message_data: dict) -> bool:
+    if message_data.get('type') != 'text':
+        return False
+    message_text = message_data.get('text', {}).get('body')
+    return bool(message_text) and message_text.strip().lower() == 'clear'
+
+async def handle_whatsapp_messages(recipient_number: str, messages: List[dict], app: web.Application,
+                                   deadline: Optional[Deadline] = None):
+    """
+    Handles a batch of messages from one chat.
+
+    Messages that arrived in quick succession are merged into a single user
+    turn, so the history is read and the model is called only once. Every
+    stage runs within `deadline`, the batch's budget from when its first
+    message arrived.
+    """
+    wa_config = config.get_whatsapp_config()
+    deadline = deadline or message_deadline()
+    parts = []
+    ui_parts = []
 
-        message_to_broadcast = {
-            'type': 'new_message',
-            'data': {
-                'chat_id': recipient_number,
-                'message': {
-                    'user': user_message_dict,
-                    'bot': None
-                }
+    for message_data in messages:
+        try:
+            if _is_clear_command(message_data) and parts:
+                # Answer what came before 'clear' first, it is about to be wiped.
+                await respond_to_user_turn(recipient_number, parts, ui_parts, app, deadline)
+                parts, ui_parts = [], []
+
+            prepared = await prepare_whatsapp_message(message_data, app, deadline)
+            if prepared:
+                parts.extend(prepared[0])
+                ui_parts.extend(prepared[1])
+        except StageTimeout as e:
+            await send_fallback_reply(recipient_number, e)
+            return
+        except Exception as e:
+            logging.exception("Error processing message:")
+            await whatsapp_service.send_whatsapp_message(recipient_number, "Maaf, terjadi kesalahan.", wa_config)
+
+    if not parts:
+        return
+
+    if len(messages) > 1:
+        logging.info(f"Coalesced {len(messages)} messages from {recipient_number} into one turn.")
+    try:
+        await respond_to_user_turn(recipient_number, parts, ui_parts, app, deadline)
+    except StageTimeout as e:
+        await send_fallback_reply(recipient_number, e)
+    except Exception as e:
+        logging.exception("Error processing message:")
+        await whatsapp_service.send_whatsapp_message(recipient_number, "Maaf, terjadi kesalahan.", wa_config)
+
+async def respond_to_user_turn(recipient_number: str, parts: List[types.Part], ui_parts: List[dict], app: web.Application,
+                               deadline: Optional[Deadline] = None):
+    """Stores a user turn and answers it based on control status."""
+    global db_pool
+    content = types.Content(role="user", parts=parts)
+    control_status = await database.get_control_status(db_pool, recipient_number)
+
+    user_message_dict = content_to_dict(content)
+    user_message_dict['parts'].extend(ui_parts)
+
+    is_new_conversation = not await database.chat_exists(db_pool, recipient_number)
+
+    message_to_broadcast = {
+        'type': 'new_message',
+        'data': {
+            'chat_id': recipient_number,
+            'message': {
+                'user': user_message_dict,
+                'bot': None
             }
         }
-
-        if control_status == 'admin':
-            logging.info(f"Chat for {recipient_number} is admin-controlled. Storing message and notifying UI.")
-            await broadcast_to_websockets(app, message_to_broadcast)
-            await database.save_user_message_only(db_pool, recipient_number, user_message_dict)
-        elif control_status == 'bot':
-            logging.info(f"Chat for {recipient_number} is bot-controlled. Notifying UI and generating AI response.")
+    }
+
+    if control_status == 'admin':
+        logging.info(f"Chat for {recipient_number} is admin-controlled. Storing message and notifying UI.")
+        await broadcast_to_websockets(app, message_to_broadcast)
+        await database.save_user_message_only(db_pool, recipient_number, user_message_dict)
+    elif control_status == 'bot' and not app['admission'].admit():
+        logging.warning(f"AI backlog too deep, sending busy reply to {recipient_number}.")
+        await broadcast_to_websockets(app, message_to_broadcast)
+        await database.save_user_message_only(db_pool, recipient_number, user_message_dict)
+        await whatsapp_service.send_whatsapp_message(recipient_number, config.SHED_BUSY_REPLY, config.get_whatsapp_config())
+    elif control_status == 'bot':
+        logging.info(f"Chat for {recipient_number} is bot-controlled. Notifying UI and generating AI response.")
+        # Lookups for identifiers in the message run while the turn is prepared
+        prefetch = lookup_prefetcher.start(content) if config.PREFETCH_LOOKUPS else None
+        try:
             await broadcast_to_websockets(app, message_to_broadcast)
 
-            chat_history = await database.get_chat_history_from_db(db_pool, recipient_number)
-            await generate_ai_response(content, recipient_number, app, user_message_dict, chat_history)
+            memory, chat_history = await load_chat_history(recipient_number)
+            await generate_ai_response(content, recipient_number, app, user_message_dict, chat_history, memory=memory,
+                                       prefetch=prefetch, deadline=deadline)
+        finally:
+            if prefetch:
+                prefetch.close()
 
-        if is_new_conversation:
-            new_conversation_broadcast = {
-                'type': 'new_conversation',
-                'data': {
-                    'chat_id': recipient_number
-                }
+    if is_new_conversation:
+        new_conversation_broadcast = {
+            'type': 'new_conversation',
+            'data': {
+                'chat_id': recipient_number
             }
-            await broadcast_to_websockets(app, new_conversation_broadcast)
-
-    except Exception as e:
-        logging.exception("Error processing message:")
-        await whatsapp_service.send_whatsapp_message(recipient_number, "Maaf, terjadi kesalahan.", wa_config)
+        }
+        await broadcast_to_websockets(app, new_conversation_broadcast)
+
+async def process_incoming_messages(recipient_number: str, items: List[Tuple[float, dict]], app: web.Application):
+    """
+    Entry point for queued (received_at, message) items: drops redeliveries,
+    then handles the batch within a deadline counted from its first arrival.
+    """
+    deadline = message_deadline(min(received_at for received_at, _ in items))
+    fresh = []
+    for _, message_data in items:
+        message_id = message_data.get('id')
+        if message_id and not await deduplicator.claim(db_pool, message_id):
+            logging.info(f"Skipping already processed message {message_id}")
+            continue
+        fresh.append(message_data)
+    if fresh:
+        await handle_whatsapp_messages(recipient_number, fresh, app, deadline)
 
 # --- WhatsApp Webhook ---
 async def whatsapp_webhook_handler(request):
@@ -276,12 +567,20 @@ async def whatsapp_webhook_handler(request):
     elif request.method == 'POST':
         try:
           data = await request.json()
+          ingest_queue = request.app['ingest_queue']
           if data.get("entry"):
             for entry in data.get("entry"):
                  for change in entry.get("changes"):
                       if change.get("value", {}).get("messages"):
                           for message in change.get("value", {}).get("messages"):
-                            await handle_whatsapp_message(message, request.app)
+                            if message.get('id') and deduplicator.check_and_mark(message['id']):
+                                logging.info(f"Dropping duplicate delivery of message {message['id']}")
+                                continue
+                            # Ack right away; the worker pool does the slow part.
+                            if not ingest_queue.submit(message['from'], (time.monotonic(), message)):
+                                deduplicator.forget(message.get('id'))
+                                logging.warning(f"Ingest queue full, asking WhatsApp to redeliver message from {message['from']}")
+                                return web.Response(status=503)
         except Exception as e:
           logging.exception(f"Error handling webhook: {e}")
 
@@ -511,21 +810,40 @@ async def global_websocket_handler(request):
     return ws
 
 # --- Chat Summary ---
-async def generate_chat_summary(db_pool, chat_id, _):
+async def summarize_conversation(previous_summary: Optional[str], transcript: str, app: web.Application) -> str:
+    """Merges newly compacted turns into a chat's rolling summary (background job)."""
+    _, ai_service = await ai_settings_cache.get(db_pool)
+    prompt = (
+        "Kamu merangkum percakapan WhatsApp antara user dan asisten sekolah untuk dipakai sebagai memori asisten. "
+        "Perbarui ringkasan di bawah dengan percakapan baru. Pertahankan fakta penting: identitas user, data yang "
+        "dicari atau diubah, permintaan yang belum selesai, dan preferensi user. Tulis ringkas, maksimal 200 kata.\n\n"
+        f"Ringkasan sebelumnya:\n{previous_summary or '(belum ada)'}\n\n"
+        f"Percakapan baru:\n{transcript}"
+    )
+    async with app['admission'].track():
+        response = await ai_service.generate_content(
+            contents=[types.Content(role='user', parts=[types.Part.from_text(text=prompt)])],
+            priority=BATCH,
+        )
+    return response.text
+
+async def generate_chat_summary(db_pool, chat_id, app):
     """Generates a summary of the chat using active AI."""
-    history = await database.get_chat_history_from_db(db_pool, chat_id)
-    if not history:
+    memory, history = await load_chat_history(chat_id)
+    if not history and not memory:
         return "No chat history found."
     
     try:
          # Summarize using the active AI service
-         active_setting = await database.get_active_ai_setting(db_pool)
-         temp_ai_service = AIService(active_setting)
+         _, ai_service = await ai_settings_cache.get(db_pool)
          
          summary_prompt = "Please summarize the following conversation between a user and an AI assistant. Focus on the user's main intent and the outcome."
-         contents = [types.Content(role='user', parts=[types.Part.from_text(text=summary_prompt)])] + history
+         if memory:
+             summary_prompt += f"\n\nSummary of the earlier part of the conversation:\n{memory}"
+         contents = [types.Content(role='user', parts=[types.Part.from_text(text=summary_prompt)])] + (history or [])
          
-         response = await temp_ai_service.generate_content(contents=contents)
+         async with app['admission'].track():
+             response = await ai_service.generate_content(contents=contents, priority=ADMIN, key=chat_id)
          return response.text
     except Exception as e:
         logging.error(f"Error generating summary: {e}")
@@ -549,17 +867,45 @@ async def get_stats_handler(request):
         return web.json_response({
             'active_chats': active_chats,
             'uptime': uptime_str,
-            'model': config.GOOGLE_MODEL
+            'model': config.GOOGLE_MODEL,
+            'ai_load': request.app['admission'].state()
         })
     except Exception as e:
         return web.json_response({'error': str(e)}, status=500)
 
+@require_auth
+async def get_metrics_handler(request):
+    """Runtime metrics of the message pipeline, for sizing and monitoring."""
+    return web.json_response({
+        'ingest_queue': request.app['ingest_queue'].stats(),
+        'dedupe': deduplicator.stats(),
+        'rate_limiter': rate_limiter.stats(),
+        'admission': request.app['admission'].stats(),
+        'memory': request.app['compactor'].stats(),
+        'faq': request.app['faq_cache'].stats(),
+        'fast_path': fast_path.stats(),
+        'search_index': tools.search_index.stats(),
+        'tool_cache': tools.tool_cache.stats(),
+        'history_cache': database.history_cache.stats(),
+        'scheduler': model_scheduler.stats(),
+        'providers': provider_health.stats(),
+        'routing': turn_router.stats(),
+        'prefetch': lookup_prefetcher.stats(),
+        'context_cache': provider_registry.context_cache_stats(),
+        'deadlines': stage_stats.stats(),
+        'tokens': token_counter.stats(),
+        'ai_turns': {key: round(value, 1) for key, value in turn_stats.items()},
+    })
+
 @require_auth
 async def generate_summary_handler(request):
     global db_pool
     chat_id = request.match_info.get('chat_id')
+    # Summaries are low priority; don't add to the load when the AI is backed up.
+    if not request.app['admission'].admit(low_priority=True):
+        return web.json_response({'error': 'AI sedang sibuk, coba lagi nanti.'}, status=503)
     try:
-         summary = await generate_chat_summary(db_pool, chat_id, None) # client param is now unused inside
+         summary = await generate_chat_summary(db_pool, chat_id, request.app)
          return web.json_response({'summary': summary})
     except Exception as e:
         return web.json_response({'error': str(e)}, status=500)
@@ -574,6 +920,19 @@ async def get_analytics_handler(request):
     except database.DatabaseError as e:
         return web.json_response({'error': str(e)}, status=500)
 
+@require_auth
+async def get_token_usage_handler(request):
+    global db_pool
+    try:
+        days = min(max(int(request.query.get('days', 30)), 1), 365)
+    except ValueError:
+        return web.json_response({'error': 'days must be a number'}, status=400)
+    try:
+        data = await database.get_token_usage_report(db_pool, days=days)
+        return web.json_response(data)
+    except database.DatabaseError as e:
+        return web.json_response({'error': str(e)}, status=500)
+
 # --- Broadcast ---
 @require_auth
 async def broadcast_handler(request):
@@ -711,6 +1070,85 @@ async def delete_auto_reply_handler(request):
     except database.DatabaseError as e:
         return web.json_response({'error': str(e)}, status=500)
 
+# --- FAQ Answers API ---
+@require_auth
+async def get_faq_handler(request):
+    global db_pool
+    try:
+        entries = await database.get_faq_entries(db_pool, include_expired=True)
+        return web.json_response([
+            {
+                'id': entry['id'],
+                'question': entry['question'],
+                'answer': entry['answer'],
+                'status': entry['status'],
+                'asked_count': entry['asked_count'],
+                'hit_count': entry['hit_count'],
+                'expires_at': entry['expires_at'].isoformat() if entry['expires_at'] else None,
+                'expired': entry['expires_in'] is not None and entry['expires_in'] <= 0,
+            }
+            for entry in entries
+        ])
+    except database.DatabaseError as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+@require_auth
+async def save_faq_handler(request):
+    global db_pool
+    data = await request.json()
+    question = data.get('question')
+    answer = data.get('answer')
+    if not question or not answer:
+        return web.json_response({'error': 'Question and answer are required'}, status=400)
+    try:
+        # Entries written by an admin are vetted already
+        entry_id = await database.save_faq_entry(
+            db_pool, question, answer,
+            status=data.get('status') or APPROVED,
+            expires_at=data.get('expires_at') or None,
+            entry_id=data.get('id'),
+        )
+        request.app['faq_cache'].invalidate()
+        return web.json_response({'success': True, 'id': entry_id})
+    except database.DatabaseError as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+@require_auth
+async def faq_action_handler(request):
+    global db_pool
+    entry_id = int(request.match_info.get('entry_id'))
+    action = request.match_info.get('action')
+    try:
+        if action == 'approve':
+            await database.set_faq_status(db_pool, entry_id, APPROVED)
+        elif action == 'unapprove':
+            await database.set_faq_status(db_pool, entry_id, PENDING)
+        elif action == 'expire':
+            await database.expire_faq_entry(db_pool, entry_id)
+        else:
+            return web.json_response({'error': f'Unknown action: {action}'}, status=400)
+        request.app['faq_cache'].invalidate()
+        return web.json_response({'success': True})
+    except database.DatabaseError as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+@require_auth
+async def delete_faq_handler(request):
+    global db_pool
+    entry_id = request.match_info.get('entry_id')
+    try:
+        await database.delete_faq_entry(db_pool, int(entry_id))
+        request.app['faq_cache'].invalidate()
+        return web.json_response({'success': True})
+    except database.DatabaseError as e:
+        return web.json_response({'error': str(e)}, status=500)
+
+@require_auth
+async def invalidate_faq_handler(request):
+    """Drops the in-memory FAQ index, e.g. after editing faq_answers by hand."""
+    request.app['faq_cache'].invalidate()
+    return web.json_response({'success': True})
+
 # --- AI Settings API ---
 @require_auth
 async def get_ai_settings_handler(request):
@@ -724,7 +1162,7 @@ async def get_ai_settings_handler(request):
 
 @require_auth
 async def save_ai_setting_handler(request):
-    global db_pool, ai_service
+    global db_pool
     data = await request.json()
     try:
         await database.save_ai_setting(
@@ -734,33 +1172,34 @@ async def save_ai_setting_handler(request):
             data.get('api_key'),
             data.get('system_prompt'),
             data.get('is_active', False),
-            setting_id=data.get('id') # Support update by ID
+            setting_id=data.get('id'), # Support update by ID
+            route=data.get('route') or None
         )
-        # Reset local ai_service so it reloads on next use
-        ai_service = None 
+        # Reload the active setting and AIService on next use
+        ai_settings_cache.invalidate()
         return web.json_response({'success': True})
     except database.DatabaseError as e:
         return web.json_response({'error': str(e)}, status=500)
 
 @require_auth
 async def delete_ai_setting_handler(request):
-    global db_pool, ai_service
+    global db_pool
     setting_id = request.match_info.get('id')
     try:
         await database.delete_ai_setting(db_pool, int(setting_id))
-        ai_service = None
+        ai_settings_cache.invalidate()
         return web.json_response({'success': True})
     except database.DatabaseError as e:
         return web.json_response({'error': str(e)}, status=500)
 
 @require_auth
 async def set_active_ai_handler(request):
-    global db_pool, ai_service
+    global db_pool
     data = await request.json()
     provider_id = data.get('id')
     try:
         await database.set_active_ai_provider(db_pool, provider_id)
-        ai_service = None
+        ai_settings_cache.invalidate()
         return web.json_response({'success': True})
     except database.DatabaseError as e:
         return web.json_response({'error': str(e)}, status=500)
@@ -778,6 +1217,40 @@ async def main():
     
     app = web.Application()
     app['websockets'] = []
+    app['ingest_queue'] = IngestQueue(
+        lambda chat_id, items: process_incoming_messages(chat_id, items, app),
+        workers=config.INGEST_WORKERS,
+        max_pending=config.INGEST_QUEUE_MAX,
+        window=config.COALESCE_WINDOW,
+        max_delay=config.COALESCE_MAX_DELAY,
+    )
+    app['admission'] = AdmissionController(
+        queue_age=app['ingest_queue'].oldest_wait,
+        degrade_in_flight=config.SHED_DEGRADE_IN_FLIGHT,
+        shed_in_flight=config.SHED_MAX_IN_FLIGHT,
+        degrade_queue_age=config.SHED_DEGRADE_QUEUE_AGE,
+        shed_queue_age=config.SHED_MAX_QUEUE_AGE,
+    )
+    app['compactor'] = ConversationCompactor(
+        db_pool,
+        lambda previous_summary, transcript: summarize_conversation(previous_summary, transcript, app),
+        admit=lambda: app['admission'].admit(low_priority=True),
+        interval=config.MEMORY_COMPACT_INTERVAL,
+        min_rows=config.MEMORY_COMPACT_MIN_ROWS,
+        keep_recent=config.MEMORY_KEEP_RECENT_ROWS,
+    )
+    app['faq_cache'] = FaqAnswerCache(
+        db_pool,
+        enabled=config.FAQ_CACHE_ENABLED,
+        threshold=config.FAQ_MATCH_THRESHOLD,
+        max_question_chars=config.FAQ_MAX_QUESTION_CHARS,
+        suggest=config.FAQ_SUGGEST,
+        max_answer_chars=config.FAQ_MAX_ANSWER_CHARS,
+    )
+    # Load siswa/gukar now rather than on the first lookup
+    if tools.search_index.enabled:
+        for table in ('siswa', 'gukar'):
+            await tools.search_index.search(table, None, db_pool)
 
     app.add_routes([
         # WhatsApp Webhook
@@ -806,6 +1279,8 @@ async def main():
         # Stats & Analytics
         web.get('/api/stats', get_stats_handler),
         web.get('/api/analytics', get_analytics_handler),
+        web.get('/api/metrics', get_metrics_handler),
+        web.get('/api/token-usage', get_token_usage_handler),
         
         # Broadcast
         web.post('/api/broadcast', broadcast_handler),
@@ -819,6 +1294,13 @@ async def main():
         web.get('/api/auto-replies', get_auto_replies_handler),
         web.post('/api/auto-replies', create_auto_reply_handler),
         web.delete('/api/auto-replies/{rule_id}', delete_auto_reply_handler),
+
+        # FAQ Answers
+        web.get('/api/faq', get_faq_handler),
+        web.post('/api/faq', save_faq_handler),
+        web.post('/api/faq/invalidate', invalidate_faq_handler),
+        web.post('/api/faq/{entry_id}/{action}', faq_action_handler),
+        web.delete('/api/faq/{entry_id}', delete_faq_handler),
         
         # AI Settings
         web.get('/api/ai-settings', get_ai_settings_handler),
@@ -833,6 +1315,8 @@ async def main():
     app.router.add_static('/static/', path=str(BASE_DIR / 'static'), name='static')
 
     app['start_time'] = time.time()
+    app['ingest_queue'].start()
+    app['compactor'].start()
 
     runner = web.AppRunner(app)
     await runner.setup()
@@ -852,6 +1336,9 @@ async def main():
         # Graceful shutdown
         logging.info("Cleaning up resources...")
         
+        await app['ingest_queue'].stop()
+        await app['compactor'].stop()
+
         # Close all websockets
         ws_list = list(app.get('websockets', []))
         for ws in ws_list:
@@ -861,6 +1348,7 @@ async def main():
                 pass
         
         await runner.cleanup()
+        await provider_registry.close()
         if db_pool:
             db_pool.close()
             await db_pool.wait_closed()
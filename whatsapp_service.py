@@ -5,7 +5,9 @@ import aiohttp
 import uuid
 import pathlib
 import asyncio
-from typing import Dict, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
+
+from deadline import MEDIA_FETCH, MEDIA_UPLOAD, SEND, Deadline, stage_stats
 
 # Define base directory
 BASE_DIR = pathlib.Path(__file__).parent
@@ -14,6 +16,13 @@ MEDIA_DIR = BASE_DIR / 'static' / 'media'
 # Ensure media directory exists
 MEDIA_DIR.mkdir(parents=True, exist_ok=True)
 
+# WhatsApp rejects text messages with a longer body
+MAX_TEXT_LENGTH = 4096
+# Seconds a send may take when the config does not say
+DEFAULT_SEND_TIMEOUT = 15
+# Seconds between checks whether an uploaded file is ready
+UPLOAD_POLL_INTERVAL = 1
+
 async def send_whatsapp_message(recipient_number: str, text: str, config: Dict, media_url: Optional[str] = None, mime_type: Optional[str] = None):
     """Function to send a WhatsApp message."""
     headers = {
@@ -41,17 +50,88 @@ async def send_whatsapp_message(recipient_number: str, text: str, config: Dict,
               "body": text
         }
     
-    async with aiohttp.ClientSession() as session:
+    timeout = aiohttp.ClientTimeout(total=config.get('WHATSAPP_SEND_TIMEOUT', DEFAULT_SEND_TIMEOUT))
+    async with aiohttp.ClientSession(timeout=timeout) as session:
         try:
             url = f"{config['WHATSAPP_API_URL']}/{config['WHATSAPP_API_VERSION']}/{config['WHATSAPP_PHONE_NUMBER_ID']}/messages"
             async with session.post(url, headers=headers, json=payload) as response:
                 response.raise_for_status()
                 response_data = await response.json()
                 return response_data
+        except asyncio.TimeoutError:
+           stage_stats.record_timeout(SEND)
+           logging.error(f"Sending WhatsApp message to {recipient_number} timed out after {timeout.total}s")
+           return None
         except aiohttp.ClientError as e:
            logging.error(f"Error sending WhatsApp message: {e}")
            return None
 
+def split_message(text: str, limit: int = MAX_TEXT_LENGTH) -> List[str]:
+    """Splits text into WhatsApp-sized chunks, preferring paragraph, line and word breaks."""
+    chunks = []
+    text = text.strip()
+    while len(text) > limit:
+        cut = -1
+        for separator in ("\n\n", "\n", " "):
+            cut = text.rfind(separator, 0, limit)
+            if cut > 0:
+                break
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut].rstrip())
+        text = text[cut:].lstrip()
+    if text:
+        chunks.append(text)
+    return chunks
+
+class MessageStreamer:
+    """
+    Sends streamed model text to WhatsApp one finished paragraph at a time.
+
+    Text is buffered until a paragraph break; completed paragraphs are sent
+    once they add up to `min_chars` (so short lines are not sent as a burst
+    of tiny messages), or as soon as the buffer nears the WhatsApp size
+    limit. Chunks are sent one after another, in order.
+    """
+
+    def __init__(self, recipient_number: str, config: Dict, min_chars: int = 200, limit: int = MAX_TEXT_LENGTH):
+        self._recipient_number = recipient_number
+        self._config = config
+        self._min_chars = min_chars
+        self._limit = limit
+        self._buffer = ""
+        self.sent = 0
+        # Everything fed so far, sent or not
+        self.text = ""
+
+    async def feed(self, text: str):
+        self.text += text
+        self._buffer += text
+        if len(self._buffer) >= self._limit:
+            trailing = self._buffer[len(self._buffer.rstrip()):]
+            chunks = split_message(self._buffer, self._limit)
+            self._buffer = (chunks.pop() if chunks else "") + trailing
+            for chunk in chunks:
+                await self._send(chunk)
+            return
+
+        cut = self._buffer.rfind("\n\n")
+        if cut >= self._min_chars:
+            ready, self._buffer = self._buffer[:cut], self._buffer[cut + 2:]
+            await self._send(ready)
+
+    async def finish(self):
+        """Sends whatever is left once the model is done."""
+        for chunk in split_message(self._buffer, self._limit):
+            await self._send(chunk)
+        self._buffer = ""
+
+    async def _send(self, text: str):
+        text = text.strip()
+        if text:
+            await send_whatsapp_message(self._recipient_number, text, self._config)
+            self.sent += 1
+
 async def send_typing_indicator(recipient_number: str, config: Dict):
     """Send a typing indicator to WhatsApp."""
     headers = {
@@ -74,12 +154,40 @@ async def send_typing_indicator(recipient_number: str, config: Dict):
     # For now, just log it
     logging.debug(f"Typing indicator sent for {recipient_number}")
 
-async def _process_media(message_data: Dict, client, config: Dict) -> Optional[Tuple[str, str, str, str]]:
+async def _download_media(session: aiohttp.ClientSession, url: str, headers: Dict) -> Optional[Tuple[bytes, str]]:
+    """Looks up a WhatsApp media id and downloads it. Returns (bytes, mime_type) or None."""
+    async with session.get(url, headers=headers) as response:
+        response.raise_for_status()
+        media_info = await response.json()
+    media_url = media_info.get("url")
+    mime_type = media_info.get("mime_type")
+    if not media_url or not mime_type:
+        return None
+    async with session.get(media_url, headers=headers) as media_response:
+        media_response.raise_for_status()
+        return await media_response.read(), mime_type
+
+async def _upload_to_google(client, file_path: str) -> Optional[str]:
+    """Uploads a file for the model and waits until it is ACTIVE. Returns its URI, or None if processing failed."""
+    file_upload = await client.aio.files.upload(file=file_path)
+    while file_upload.state != "ACTIVE":
+        if file_upload.state == "FAILED":
+            logging.error(f"Google could not process uploaded file {file_upload.name}")
+            return None
+        await asyncio.sleep(UPLOAD_POLL_INTERVAL)
+        file_upload = await client.aio.files.get(name=file_upload.name)
+    return file_upload.uri
+
+async def _process_media(message_data: Dict, client, config: Dict, deadline: Optional[Deadline] = None) -> Optional[Tuple[str, str, str, str]]:
     """
     Helper function to process media files from WhatsApp.
     Saves the media locally for the UI and uploads it to Google for the model.
     Returns a tuple of (google_uri, local_uri, mime_type, filename) or None.
+
+    The download and the upload each run as a stage of `deadline`, which
+    raises StageTimeout when one takes too long.
     """
+    deadline = deadline or Deadline()
     media_type = message_data.get('type')
     if not media_type or media_type not in ["image", "video", "audio", "document"]:
          return None
@@ -97,55 +205,41 @@ async def _process_media(message_data: Dict, client, config: Dict) -> Optional[T
     url = f"{config['WHATSAPP_API_URL']}/{config['WHATSAPP_API_VERSION']}/{media_id}"
     async with aiohttp.ClientSession() as session:
       try:
-        async with session.get(url, headers=headers) as response:
-            response.raise_for_status()
-            media_info = await response.json()
-            media_url = media_info.get("url")
-            mime_type = media_info.get("mime_type")
-            
-            if not media_url or not mime_type:
-                return None
-
-            # Determine file extension
-            ext_map = {
-                'image/jpeg': 'jpg', 'image/png': 'png', 'image/gif': 'gif',
-                'video/mp4': 'mp4', 'audio/mpeg': 'mp3', 'audio/ogg': 'ogg',
-                'application/pdf': 'pdf', 'text/plain': 'txt'
-            }
-            ext_name = ext_map.get(mime_type, 'bin')
-
-            # Download media content
-            async with session.get(media_url, headers=headers) as media_response:
-                media_response.raise_for_status()
-                file_bytes = await media_response.read()
-
-            # 1. Save locally for UI access
-            MEDIA_DIR.mkdir(parents=True, exist_ok=True)
-            local_filename = f"{uuid.uuid4()}.{ext_name}"
-            local_path = MEDIA_DIR / local_filename
-            with open(local_path, 'wb') as f:
-                f.write(file_bytes)
-            local_uri = f"/static/media/{local_filename}"
-            logging.info(f"Media saved locally to {local_path}")
-
-            # 2. Upload to Google for AI processing
-            google_uri = None
-            with tempfile.NamedTemporaryFile(delete=False, suffix=f".{ext_name}") as temp_file:
-                temp_file.write(file_bytes)
-                temp_file_path = temp_file.name
-            
-            try:
-                file_upload = client.files.upload(file=temp_file_path)
-                while file_upload.state != "ACTIVE":
-                    await asyncio.sleep(1)
-                    file_upload = client.files.get(name=file_upload.name)
-                google_uri = file_upload.uri
-                logging.info(f"Media uploaded to Google with URI: {google_uri}")
-            finally:
-                os.remove(temp_file_path)
-
-            return google_uri, local_uri, mime_type, filename
-
+        downloaded = await deadline.run(MEDIA_FETCH, _download_media(session, url, headers))
       except aiohttp.ClientError as e:
           logging.error(f"Error fetching WhatsApp media: {e}")
           return None
+    if not downloaded:
+        return None
+    file_bytes, mime_type = downloaded
+
+    # Determine file extension
+    ext_map = {
+        'image/jpeg': 'jpg', 'image/png': 'png', 'image/gif': 'gif',
+        'video/mp4': 'mp4', 'audio/mpeg': 'mp3', 'audio/ogg': 'ogg',
+        'application/pdf': 'pdf', 'text/plain': 'txt'
+    }
+    ext_name = ext_map.get(mime_type, 'bin')
+
+    # 1. Save locally for UI access
+    MEDIA_DIR.mkdir(parents=True, exist_ok=True)
+    local_filename = f"{uuid.uuid4()}.{ext_name}"
+    local_path = MEDIA_DIR / local_filename
+    with open(local_path, 'wb') as f:
+        f.write(file_bytes)
+    local_uri = f"/static/media/{local_filename}"
+    logging.info(f"Media saved locally to {local_path}")
+
+    # 2. Upload to Google for AI processing
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{ext_name}") as temp_file:
+        temp_file.write(file_bytes)
+        temp_file_path = temp_file.name
+
+    try:
+        google_uri = await deadline.run(MEDIA_UPLOAD, _upload_to_google(client, temp_file_path))
+        if google_uri:
+            logging.info(f"Media uploaded to Google with URI: {google_uri}")
+    finally:
+        os.remove(temp_file_path)
+
+    return google_uri, local_uri, mime_type, filename